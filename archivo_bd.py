@@ -0,0 +1,286 @@
+"""Archivo mensual de conversaciones y pedidos (almacenamiento caliente/frío)
+
+Los meses cerrados se mueven de la base principal a un archivo SQLite por mes
+(`archivo/<base>_AAAA-MM.db`, junto a la base), con el session_data
+comprimido, y después se compacta la base principal con VACUUM. Así las
+vistas en vivo solo tocan una base pequeña.
+
+La tabla `archivo_contactos` de la base principal indica en qué meses
+archivados tiene mensajes cada contacto, para que las lecturas históricas
+adjunten (ATTACH) solo los archivos necesarios. contact_summary y los rollups
+no se tocan: siguen reflejando todo el historial.
+
+Uso como script:
+
+    python archivo_bd.py [--meses-calientes 2] [--sin-vacuum] [papanatas_chat.db]
+"""
+
+import json
+import os
+import sqlite3
+import zlib
+from contextlib import contextmanager
+from datetime import datetime
+
+DIRECTORIO_ARCHIVO = 'archivo'
+
+SQL_INDICE_CONTACTOS = """
+CREATE TABLE IF NOT EXISTS archivo_contactos (
+    numero_telefono TEXT NOT NULL,
+    mes TEXT NOT NULL,
+    mensajes INTEGER NOT NULL DEFAULT 0,
+    PRIMARY KEY (numero_telefono, mes)
+) WITHOUT ROWID
+"""
+
+# Esquema de cada archivo mensual: el del bot, con session_data comprimido
+SQL_ARCHIVO = [
+    """CREATE TABLE IF NOT EXISTS {esquema}.conversaciones (
+    id INTEGER PRIMARY KEY,
+    numero_telefono TEXT NOT NULL,
+    timestamp DATETIME,
+    mensaje_usuario TEXT,
+    mensaje_bot TEXT,
+    step TEXT,
+    session_data_zlib BLOB
+)""",
+    """CREATE TABLE IF NOT EXISTS {esquema}.pedidos (
+    id INTEGER PRIMARY KEY,
+    numero_telefono TEXT NOT NULL,
+    nombre_cliente TEXT,
+    tamaño TEXT,
+    agregado TEXT,
+    bebida BOOLEAN,
+    total INTEGER,
+    timestamp DATETIME,
+    estado TEXT,
+    comprobante_recibido BOOLEAN DEFAULT 0,
+    comprobante_url TEXT
+)""",
+    "CREATE INDEX IF NOT EXISTS {esquema}.idx_conversaciones_numero_timestamp "
+    "ON conversaciones (numero_telefono, timestamp)",
+    "CREATE INDEX IF NOT EXISTS {esquema}.idx_conversaciones_timestamp ON conversaciones (timestamp)",
+    "CREATE INDEX IF NOT EXISTS {esquema}.idx_pedidos_timestamp ON pedidos (timestamp)",
+]
+
+COLUMNAS_PEDIDOS = [
+    'id', 'numero_telefono', 'nombre_cliente', 'tamaño', 'agregado', 'bebida', 'total',
+    'timestamp', 'estado', 'comprobante_recibido', 'comprobante_url'
+]
+
+
+def comprimir(texto):
+    """session_data (JSON) comprimido con zlib"""
+    return None if texto is None else zlib.compress(texto.encode('utf-8'), 9)
+
+
+def descomprimir(blob):
+    """session_data original a partir de lo guardado en el archivo"""
+    return None if blob is None else zlib.decompress(blob).decode('utf-8')
+
+
+def leer_session_data(blob):
+    """session_data archivado como dict"""
+    texto = descomprimir(blob)
+    return json.loads(texto) if texto else None
+
+
+def ruta_archivo(ruta_bd, mes):
+    """Archivo del mes 'AAAA-MM' para la base `ruta_bd`"""
+    directorio = os.path.join(os.path.dirname(os.path.abspath(ruta_bd)), DIRECTORIO_ARCHIVO)
+    base = os.path.splitext(os.path.basename(ruta_bd))[0]
+    return os.path.join(directorio, f"{base}_{mes}.db")
+
+
+def meses_archivados(ruta_bd):
+    """Meses 'AAAA-MM' con archivo en disco, en orden cronológico"""
+    directorio = os.path.dirname(ruta_archivo(ruta_bd, '0000-00'))
+    prefijo = os.path.splitext(os.path.basename(ruta_bd))[0] + '_'
+    if not os.path.isdir(directorio):
+        return []
+    return sorted(
+        nombre[len(prefijo):-3] for nombre in os.listdir(directorio)
+        if nombre.startswith(prefijo) and nombre.endswith('.db')
+    )
+
+
+def ruta_principal(conn):
+    """Ruta del archivo de la base 'main' de una conexión"""
+    for _, nombre, archivo in conn.execute("PRAGMA database_list").fetchall():
+        if nombre == 'main':
+            return archivo
+    return None
+
+
+@contextmanager
+def adjuntar(conn, mes):
+    """Adjunta el archivo del mes; entrega el nombre del esquema o None si no existe"""
+    ruta = ruta_archivo(ruta_principal(conn), mes)
+    if not os.path.exists(ruta):
+        yield None
+        return
+    esquema = f"archivo_{mes.replace('-', '_')}"
+    conn.execute(f"ATTACH DATABASE ? AS {esquema}", [ruta])
+    try:
+        yield esquema
+    finally:
+        conn.execute(f"DETACH DATABASE {esquema}")
+
+
+@contextmanager
+def esquema_para_fecha(conn, fecha):
+    """Esquema que contiene los datos del día `fecha`: 'main' o el archivo adjunto de su mes"""
+    mes = fecha.strftime('%Y-%m') if fecha else None
+    if mes is None or mes not in meses_archivados(ruta_principal(conn) or ''):
+        yield 'main'
+        return
+    with adjuntar(conn, mes) as esquema:
+        yield esquema or 'main'
+
+
+def meses_de_contacto(conn, numero_telefono, hasta_mes=None):
+    """Meses archivados con mensajes del contacto, del más reciente al más antiguo"""
+    query = "SELECT mes FROM archivo_contactos WHERE numero_telefono = ?"
+    params = [numero_telefono]
+    if hasta_mes:
+        query += " AND mes <= ?"
+        params.append(hasta_mes)
+    try:
+        filas = conn.execute(query + " ORDER BY mes DESC", params).fetchall()
+    except sqlite3.OperationalError:
+        # Todavía no se archivó nada
+        return []
+    return [fila[0] for fila in filas]
+
+
+def _meses_a_archivar(conn, limite):
+    """Meses con filas anteriores a `limite` en conversaciones o pedidos"""
+    filas = conn.execute("""
+    SELECT DISTINCT substr(timestamp, 1, 7) FROM conversaciones WHERE timestamp < ?
+    UNION
+    SELECT DISTINCT substr(timestamp, 1, 7) FROM pedidos WHERE timestamp < ?
+    """, [limite, limite]).fetchall()
+    return sorted(fila[0] for fila in filas if fila[0])
+
+
+def _limite_caliente(meses_calientes, ahora=None):
+    """Inicio del mes más antiguo que se conserva en la base principal"""
+    ahora = ahora or datetime.now()
+    indice = ahora.year * 12 + (ahora.month - 1) - (meses_calientes - 1)
+    return datetime(indice // 12, indice % 12 + 1, 1).strftime('%Y-%m-%d %H:%M:%S')
+
+
+def _archivar_mes(conn, ruta_bd, mes):
+    """Copia el mes a su archivo y luego lo borra de la base principal; devuelve filas movidas"""
+    inicio = f"{mes}-01 00:00:00"
+    anio, numero_mes = int(mes[:4]), int(mes[5:])
+    fin = f"{anio + numero_mes // 12:04d}-{numero_mes % 12 + 1:02d}-01 00:00:00"
+    ruta = ruta_archivo(ruta_bd, mes)
+    os.makedirs(os.path.dirname(ruta), exist_ok=True)
+
+    columnas = [col[1] for col in conn.execute("PRAGMA table_info(pedidos)").fetchall()]
+    columnas_pedidos = ', '.join(col for col in COLUMNAS_PEDIDOS if col in columnas)
+    # Con sesiones normalizadas (sesiones_bd) el JSON se reconstruye desde la vista,
+    # así cada archivo sigue siendo autosuficiente
+    vista = conn.execute(
+        "SELECT 1 FROM sqlite_master WHERE type = 'view' AND name = 'conversaciones_sesion'"
+    ).fetchone()
+    origen = 'main.conversaciones_sesion' if vista else 'main.conversaciones'
+
+    conn.execute("ATTACH DATABASE ? AS archivo", [ruta])
+    try:
+        for sql in SQL_ARCHIVO:
+            conn.execute(sql.format(esquema='archivo'))
+        conn.commit()
+
+        # 1) Copia: solo escribe en el archivo, así que es atómica por sí sola
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            conn.execute(f"""
+            INSERT OR REPLACE INTO archivo.conversaciones
+                (id, numero_telefono, timestamp, mensaje_usuario, mensaje_bot, step, session_data_zlib)
+            SELECT id, numero_telefono, timestamp, mensaje_usuario, mensaje_bot, step,
+                   comprimir_sesion(session_data)
+            FROM {origen}
+            WHERE timestamp >= ? AND timestamp < ?
+            """, [inicio, fin])
+            conn.execute(f"""
+            INSERT OR REPLACE INTO archivo.pedidos ({columnas_pedidos})
+            SELECT {columnas_pedidos} FROM main.pedidos
+            WHERE timestamp >= ? AND timestamp < ?
+            """, [inicio, fin])
+            # Índice de búsqueda propio del archivo (busqueda_bd importa este módulo)
+            import busqueda_bd
+            busqueda_bd.indexar_esquema(conn, 'archivo')
+            conn.commit()
+        except Exception:
+            conn.rollback()
+            raise
+
+        # 2) Índice por contacto y borrado de lo que ya quedó copiado en el archivo
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            conn.execute(SQL_INDICE_CONTACTOS)
+            conn.execute("""
+            INSERT OR REPLACE INTO main.archivo_contactos (numero_telefono, mes, mensajes)
+            SELECT numero_telefono, ?, COUNT(*) FROM archivo.conversaciones GROUP BY numero_telefono
+            """, [mes])
+            movidas = conn.execute("""
+            DELETE FROM main.conversaciones
+            WHERE timestamp >= ? AND timestamp < ?
+              AND id IN (SELECT id FROM archivo.conversaciones)
+            """, [inicio, fin]).rowcount
+            movidas += conn.execute("""
+            DELETE FROM main.pedidos
+            WHERE timestamp >= ? AND timestamp < ?
+              AND id IN (SELECT id FROM archivo.pedidos)
+            """, [inicio, fin]).rowcount
+            conn.commit()
+        except Exception:
+            conn.rollback()
+            raise
+    finally:
+        conn.execute("DETACH DATABASE archivo")
+    return movidas
+
+
+def archivar(ruta_bd, meses_calientes=2, vacuum=True, ahora=None):
+    """Mueve a archivos mensuales todo lo anterior a los últimos `meses_calientes` meses
+
+    Con meses_calientes=2 se conservan el mes actual y el anterior (pedidos
+    que todavía pueden estar esperando pago). El mes actual nunca se archiva:
+    el snapshot del dashboard lee el día de hoy sin adjuntar archivos.
+    Devuelve {mes: filas movidas}.
+    """
+    meses_calientes = max(1, meses_calientes)
+    conn = sqlite3.connect(ruta_bd, timeout=30)
+    conn.create_function('comprimir_sesion', 1, comprimir, deterministic=True)
+    try:
+        limite = _limite_caliente(meses_calientes, ahora)
+        resultado = {}
+        for mes in _meses_a_archivar(conn, limite):
+            resultado[mes] = _archivar_mes(conn, ruta_bd, mes)
+        if resultado and vacuum:
+            # Devuelve al sistema el espacio liberado y deja la base caliente desfragmentada
+            conn.execute("VACUUM")
+            conn.execute("PRAGMA wal_checkpoint(TRUNCATE)")
+        return resultado
+    finally:
+        conn.close()
+
+
+if __name__ == '__main__':
+    import argparse
+
+    parser = argparse.ArgumentParser(description="Archiva los meses cerrados en archivos mensuales")
+    parser.add_argument('ruta', nargs='?', default='papanatas_chat.db')
+    parser.add_argument('--meses-calientes', type=int, default=2,
+                        help="Meses que se conservan en la base principal (incluido el actual)")
+    parser.add_argument('--sin-vacuum', action='store_true')
+    args = parser.parse_args()
+
+    movidos = archivar(args.ruta, args.meses_calientes, vacuum=not args.sin_vacuum)
+    if not movidos:
+        print("Nada que archivar")
+    for mes, filas in movidos.items():
+        print(f"✅ {mes}: {filas} filas movidas a {ruta_archivo(args.ruta, mes)}")
@@ -0,0 +1,407 @@
+"""Benchmark de las consultas del dashboard y del render completo de la página
+
+Para cada tamaño genera una base sintética (generar_datos.py), la prepara como
+lo hace el dashboard (índices y contact_summary), mide cada función de
+consultas_bd, el arranque en frío y un render headless de
+streamlit_dashboard.py con AppTest, y guarda p50/p95 y el pico de memoria (RSS) en un JSON para comparar commits.
+
+Uso:
+
+    python benchmark.py --tamanos 10k,100k,1m,10m [--repeticiones 20] [--salida resultados.json]
+    python benchmark.py --comparar benchmark_abc123.json benchmark_def456.json
+"""
+
+import json
+import multiprocessing
+import os
+import platform
+import resource
+import sqlite3
+import subprocess
+import sys
+import time
+from datetime import datetime, timedelta
+
+DIRECTORIO = os.path.dirname(os.path.abspath(__file__))
+
+# Una regresión se marca cuando el p50 empeora más que este factor
+UMBRAL_REGRESION = 1.2
+
+
+def percentil(valores, p):
+    """Percentil p (0-100) con interpolación lineal"""
+    ordenados = sorted(valores)
+    if not ordenados:
+        return None
+    posicion = (len(ordenados) - 1) * p / 100
+    inferior = int(posicion)
+    superior = min(inferior + 1, len(ordenados) - 1)
+    return ordenados[inferior] + (ordenados[superior] - ordenados[inferior]) * (posicion - inferior)
+
+
+def resumir(tiempos):
+    """Resumen en milisegundos de una lista de duraciones en segundos"""
+    ms = [t * 1000 for t in tiempos]
+    return {
+        'n': len(ms),
+        'p50_ms': round(percentil(ms, 50), 3),
+        'p95_ms': round(percentil(ms, 95), 3),
+        'min_ms': round(min(ms), 3),
+        'max_ms': round(max(ms), 3),
+    }
+
+
+def rss_pico_mb():
+    """Pico de memoria residente del proceso actual (ru_maxrss está en KiB en Linux, bytes en macOS)"""
+    pico = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    divisor = 1024 * 1024 if sys.platform == 'darwin' else 1024
+    return round(pico / divisor, 1)
+
+
+def cronometrar(funcion, repeticiones, calentamiento=1):
+    """Ejecuta funcion() y devuelve las duraciones (sin contar el calentamiento)"""
+    for _ in range(calentamiento):
+        funcion()
+    tiempos = []
+    for _ in range(repeticiones):
+        inicio = time.perf_counter()
+        funcion()
+        tiempos.append(time.perf_counter() - inicio)
+    return tiempos
+
+
+def consultas_a_medir(conn):
+    """(nombre, funcion(conn)) de cada consulta del dashboard, con parámetros realistas"""
+    import busqueda_bd
+    import consultas_bd
+    import embudo_bd
+
+    estructura = consultas_bd.estructura_bd(conn)
+    con_comprobante = estructura['tiene_comprobante_recibido']
+    # El contacto con más mensajes es el peor caso del panel de chat
+    numero, nombre = conn.execute(
+        "SELECT numero_telefono, COALESCE(nombre_cliente, '') FROM contact_summary "
+        "ORDER BY total_mensajes DESC LIMIT 1"
+    ).fetchone() or ('', '')
+    ultimo_id = consultas_bd.ultimo_id_conversaciones(conn)
+    mensajes, _ = consultas_bd.pagina_mensajes(conn, numero)
+    antes = tuple(mensajes.iloc[0][['timestamp', 'id']]) if len(mensajes) else None
+    antes = (antes[0], int(antes[1])) if antes else None
+    _, total_contactos = consultas_bd.pagina_contactos(conn, por_pagina=1)
+    ultima_pagina = max(0, (total_contactos - 1) // 50)
+    hoy = datetime.now().date()
+    desde_mes = (hoy - timedelta(days=29)).strftime('%Y-%m-%d')
+    hasta = (hoy + timedelta(days=1)).strftime('%Y-%m-%d')
+
+    return [
+        ('estructura_bd', lambda c: consultas_bd.estructura_bd(c)),
+        ('ultimo_id_conversaciones', lambda c: consultas_bd.ultimo_id_conversaciones(c)),
+        ('conversaciones_por_numero', lambda c: consultas_bd.conversaciones_por_numero(c)),
+        ('conversaciones_por_numero_delta',
+         lambda c: consultas_bd.conversaciones_por_numero(c, desde_id=max(0, ultimo_id - 100))),
+        ('pagina_contactos', lambda c: consultas_bd.pagina_contactos(c)),
+        ('pagina_contactos_filtrada',
+         lambda c: consultas_bd.pagina_contactos(c, nombre=nombre[:4], estado='esperando_pago')),
+        ('pagina_contactos_ultima', lambda c: consultas_bd.pagina_contactos(c, pagina=ultima_pagina)),
+        ('estados_pedido', lambda c: consultas_bd.estados_pedido(c)),
+        ('resumen_contacto', lambda c: consultas_bd.resumen_contacto(c, numero)),
+        ('mensajes_numero', lambda c: consultas_bd.mensajes_numero(c, numero)),
+        ('pagina_mensajes', lambda c: consultas_bd.pagina_mensajes(c, numero)),
+        ('pagina_mensajes_anterior', lambda c: consultas_bd.pagina_mensajes(c, numero, antes=antes)),
+        ('estadisticas_generales', lambda c: consultas_bd.estadisticas_generales(c, con_comprobante)),
+        ('comprobantes_recientes', lambda c: consultas_bd.comprobantes_recientes(c)),
+        ('totales', lambda c: consultas_bd.totales(c, con_comprobante)),
+        ('rollup_actividad_30d', lambda c: consultas_bd.rollup_actividad(c, 'dia', desde_mes, hasta)),
+        ('rollup_horario_30d', lambda c: consultas_bd.rollup_actividad(c, 'hora', desde_mes, hasta)),
+        ('rollup_productos_30d', lambda c: consultas_bd.rollup_productos(c, 'dia', desde_mes, hasta)),
+        # Un nombre (pocas coincidencias) y una palabra de las respuestas del bot (muchísimas)
+        ('buscar_nombre', lambda c: busqueda_bd.buscar(c, nombre.split(' ')[0] or 'hola', 30)),
+        ('buscar_palabra_comun', lambda c: busqueda_bd.buscar(c, 'transferencia', 30)),
+        ('embudo_30d', lambda c: embudo_bd.embudo(c, desde_mes, hasta)),
+        ('tiempos_paso_30d', lambda c: embudo_bd.tiempos(c, desde_mes, hasta)),
+    ]
+
+
+# Primer render en un intérprete nuevo; informa qué módulos pesados quedaron cargados
+_SCRIPT_ARRANQUE = """
+import json, sys
+from streamlit.testing.v1 import AppTest
+app = AppTest.from_file(sys.argv[1], default_timeout=600)
+app.run()
+print(json.dumps({
+    'errores': [str(e.value) for e in app.exception],
+    'modulos': [m for m in ('pandas', 'pyarrow', 'altair', 'plotly') if m in sys.modules],
+}))
+"""
+
+
+def medir_arranque(ruta, repeticiones):
+    """Arranque en frío: proceso nuevo, imports y primer render de la página"""
+    script = os.path.join(DIRECTORIO, 'streamlit_dashboard.py')
+    entorno_hijo = dict(os.environ, PAPANATAS_DB=ruta)
+    tiempos, salida = [], {}
+    for _ in range(repeticiones):
+        inicio = time.perf_counter()
+        proceso = subprocess.run(
+            [sys.executable, '-c', _SCRIPT_ARRANQUE, script],
+            cwd=DIRECTORIO, env=entorno_hijo, capture_output=True, text=True
+        )
+        tiempos.append(time.perf_counter() - inicio)
+        lineas = proceso.stdout.strip().splitlines()
+        salida = json.loads(lineas[-1]) if proceso.returncode == 0 and lineas else {
+            'errores': [proceso.stderr.strip()[-500:]], 'modulos': []
+        }
+    return resumir(tiempos), salida
+
+
+def medir_render(ruta, repeticiones):
+    """Render headless de la página completa con AppTest
+
+    'arranque' es un proceso nuevo hasta el primer render (imports incluidos),
+    'render_frio' la primera ejecución dentro de este proceso (cachés vacías),
+    'render_sesion_nueva' lo que ve un operador que abre el dashboard con las
+    cachés ya pobladas y 'rerun' una interacción dentro de la misma sesión.
+    """
+    from streamlit.testing.v1 import AppTest
+
+    os.environ['PAPANATAS_DB'] = ruta
+    script = os.path.join(DIRECTORIO, 'streamlit_dashboard.py')
+    errores = []
+
+    def ejecutar(app):
+        inicio = time.perf_counter()
+        app.run()
+        duracion = time.perf_counter() - inicio
+        errores.extend(str(e.value) for e in app.exception)
+        return duracion
+
+    app = AppTest.from_file(script, default_timeout=600)
+    frio = ejecutar(app)
+    sesiones = [ejecutar(AppTest.from_file(script, default_timeout=600)) for _ in range(repeticiones)]
+    reruns = [ejecutar(app) for _ in range(repeticiones)]
+    arranque, detalle_arranque = medir_arranque(ruta, repeticiones)
+    errores.extend(detalle_arranque['errores'])
+    return {
+        'arranque': arranque,
+        'modulos_al_arrancar': detalle_arranque['modulos'],
+        'render_frio': resumir([frio]),
+        'render_sesion_nueva': resumir(sesiones),
+        'rerun': resumir(reruns),
+        'errores': sorted(set(errores)),
+    }
+
+
+def medir_tamano(filas, opciones):
+    """Genera, prepara y mide una base de `filas` mensajes (corre en un proceso aparte)"""
+    import generar_datos
+    import resumen_contactos
+    import busqueda_bd
+    import contadores_bd
+    import embudo_bd
+    import rollups_bd
+    import sesiones_bd
+    from indices_bd import crear_indices
+    from pool_bd import PoolConexiones
+
+    ruta = os.path.join(opciones['directorio'], f"papanatas_bench_{filas}.db")
+    resultado = {'filas': filas, 'ruta': ruta}
+
+    if opciones['reutilizar'] and os.path.exists(ruta):
+        resultado['generacion_s'] = None
+    else:
+        resumen = generar_datos.generar(ruta, filas, dias=opciones['dias'], semilla=opciones['semilla'])
+        resultado['generacion_s'] = round(resumen['segundos'], 2)
+
+    # Preparación que hace el dashboard al arrancar (índices, sesiones, contact_summary, contadores,
+    # búsqueda, rollups y embudo)
+    inicio = time.perf_counter()
+    conn = sqlite3.connect(ruta)
+    crear_indices(conn)
+    if sesiones_bd.instalar(conn) == 'creada':
+        sesiones_bd.migrar(conn)
+    resumen_contactos.instalar(conn)
+    contadores_bd.instalar(conn)
+    if busqueda_bd.instalar(conn) != 'pendiente' and busqueda_bd.pendientes(conn):
+        busqueda_bd.indexar(conn)
+    resultado['preparacion_s'] = round(time.perf_counter() - inicio, 2)
+    inicio = time.perf_counter()
+    rollups_bd.instalar(conn)
+    rollups_bd.actualizar(conn)
+    resultado['rollups_s'] = round(time.perf_counter() - inicio, 2)
+    inicio = time.perf_counter()
+    embudo_bd.instalar(conn)
+    embudo_bd.actualizar(conn)
+    resultado['embudo_s'] = round(time.perf_counter() - inicio, 2)
+    conn.close()
+
+    pool = PoolConexiones(ruta, max_conexiones=2)
+    resultado.update(pool.leer(lambda c: {
+        'conversaciones': c.execute("SELECT COUNT(*) FROM conversaciones").fetchone()[0],
+        'pedidos': c.execute("SELECT COUNT(*) FROM pedidos").fetchone()[0],
+        'contactos': c.execute("SELECT COUNT(*) FROM contact_summary").fetchone()[0],
+        'sesiones': c.execute("SELECT COUNT(*) FROM sesiones").fetchone()[0],
+    }))
+    resultado['archivo_mb'] = round(os.path.getsize(ruta) / 1024 / 1024, 1)
+
+    consultas = {}
+    for nombre, funcion in pool.leer(consultas_a_medir):
+        tiempos = cronometrar(lambda: pool.leer(funcion), opciones['repeticiones'])
+        consultas[nombre] = resumir(tiempos)
+        print(f"  {nombre}: p50 {consultas[nombre]['p50_ms']:.2f} ms, "
+              f"p95 {consultas[nombre]['p95_ms']:.2f} ms", flush=True)
+    resultado['consultas'] = consultas
+
+    # Snapshot completo que el servicio de fondo arma cada pocos segundos
+    from snapshot_bd import ServicioSnapshot
+    servicio = ServicioSnapshot(pool)
+    resultado['snapshot'] = resumir(cronometrar(
+        lambda: pool.leer_consistente(servicio._consultar), opciones['repeticiones']
+    ))
+    pool.cerrar()
+    resultado['rss_pico_consultas_mb'] = rss_pico_mb()
+
+    if opciones['render']:
+        resultado['render'] = medir_render(ruta, opciones['repeticiones_render'])
+        for nombre in ('arranque', 'render_frio', 'render_sesion_nueva', 'rerun'):
+            print(f"  {nombre}: p50 {resultado['render'][nombre]['p50_ms']:.0f} ms", flush=True)
+    resultado['rss_pico_mb'] = rss_pico_mb()
+    return resultado
+
+
+def _proceso_tamano(filas, opciones, cola):
+    try:
+        cola.put(medir_tamano(filas, opciones))
+    except Exception as e:
+        cola.put({'filas': filas, 'error': f"{type(e).__name__}: {e}"})
+
+
+def entorno():
+    """Commit y versiones con las que se tomó la medición"""
+    def git(*argumentos):
+        try:
+            return subprocess.run(
+                ['git', *argumentos], cwd=DIRECTORIO, capture_output=True, text=True, check=True
+            ).stdout.strip()
+        except Exception:
+            return None
+
+    try:
+        import streamlit
+        version_streamlit = streamlit.__version__
+    except ImportError:
+        version_streamlit = None
+    import pandas
+
+    return {
+        'commit': git('rev-parse', '--short', 'HEAD'),
+        'cambios_sin_commit': bool(git('status', '--porcelain', '--untracked-files=no')),
+        'fecha': datetime.now().isoformat(timespec='seconds'),
+        'python': platform.python_version(),
+        'sqlite': sqlite3.sqlite_version,
+        'pandas': pandas.__version__,
+        'streamlit': version_streamlit,
+        'plataforma': platform.platform(),
+    }
+
+
+def comparar(ruta_base, ruta_nueva):
+    """Imprime el cambio de p50 por métrica entre dos resultados; devuelve las regresiones"""
+    with open(ruta_base) as f:
+        base = json.load(f)
+    with open(ruta_nueva) as f:
+        nueva = json.load(f)
+
+    def metricas(resultado):
+        datos = {f"consulta {k}": v for k, v in resultado.get('consultas', {}).items()}
+        if 'snapshot' in resultado:
+            datos['snapshot'] = resultado['snapshot']
+        for k, v in resultado.get('render', {}).items():
+            if isinstance(v, dict):
+                datos[k] = v
+        return datos
+
+    print(f"Base:  {base['entorno'].get('commit')} ({base['entorno'].get('fecha')})")
+    print(f"Nueva: {nueva['entorno'].get('commit')} ({nueva['entorno'].get('fecha')})")
+    regresiones = []
+    por_filas = {r['filas']: r for r in base['resultados']}
+    for resultado in nueva['resultados']:
+        anterior = por_filas.get(resultado['filas'])
+        if anterior is None or 'error' in resultado or 'error' in anterior:
+            continue
+        print(f"\n== {resultado['filas']:,} mensajes ==")
+        previas = metricas(anterior)
+        for nombre, actual in metricas(resultado).items():
+            if nombre not in previas:
+                continue
+            antes, ahora = previas[nombre]['p50_ms'], actual['p50_ms']
+            factor = ahora / antes if antes else float('inf')
+            marca = '⚠️' if factor > UMBRAL_REGRESION else '  '
+            print(f"{marca} {nombre:<40} {antes:>10.2f} → {ahora:>10.2f} ms  (x{factor:.2f})")
+            if factor > UMBRAL_REGRESION:
+                regresiones.append((resultado['filas'], nombre, factor))
+        rss_antes, rss_ahora = anterior.get('rss_pico_mb'), resultado.get('rss_pico_mb')
+        if rss_antes and rss_ahora:
+            print(f"   {'RSS pico':<40} {rss_antes:>10.1f} → {rss_ahora:>10.1f} MB")
+    return regresiones
+
+
+def main():
+    import argparse
+    from generar_datos import interpretar_tamano
+
+    parser = argparse.ArgumentParser(description="Benchmark de consultas y render del dashboard")
+    parser.add_argument('--tamanos', default='10k,100k',
+                        help="Cantidades de mensajes separadas por coma (ej. 10k,100k,1m,10m)")
+    parser.add_argument('--repeticiones', type=int, default=20)
+    parser.add_argument('--repeticiones-render', type=int, default=5)
+    parser.add_argument('--sin-render', action='store_true', help="Omitir el render con AppTest")
+    parser.add_argument('--directorio', default=DIRECTORIO, help="Dónde guardar las bases generadas")
+    parser.add_argument('--reutilizar', action='store_true',
+                        help="Usar las bases ya generadas en vez de regenerarlas")
+    parser.add_argument('--dias', type=int, default=90)
+    parser.add_argument('--semilla', type=int, default=1)
+    parser.add_argument('--salida', help="Archivo JSON (por defecto benchmark_<commit>.json)")
+    parser.add_argument('--comparar', nargs=2, metavar=('BASE', 'NUEVA'),
+                        help="Comparar dos resultados y salir con código 1 si hay regresiones")
+    args = parser.parse_args()
+
+    if args.comparar:
+        sys.exit(1 if comparar(*args.comparar) else 0)
+
+    opciones = {
+        'directorio': args.directorio,
+        'reutilizar': args.reutilizar,
+        'dias': args.dias,
+        'semilla': args.semilla,
+        'repeticiones': args.repeticiones,
+        'repeticiones_render': args.repeticiones_render,
+        'render': not args.sin_render,
+    }
+    datos = {'entorno': entorno(), 'opciones': opciones, 'resultados': []}
+
+    # Un proceso por tamaño para que el pico de RSS sea el de esa medición
+    contexto = multiprocessing.get_context('spawn')
+    for tamano in args.tamanos.split(','):
+        filas = interpretar_tamano(tamano)
+        print(f"== {filas:,} mensajes ==", flush=True)
+        cola = contexto.Queue()
+        proceso = contexto.Process(target=_proceso_tamano, args=(filas, opciones, cola))
+        proceso.start()
+        resultado = cola.get()
+        proceso.join()
+        if 'error' in resultado:
+            print(f"  ❌ {resultado['error']}")
+        else:
+            print(f"  RSS pico: {resultado['rss_pico_mb']} MB")
+        datos['resultados'].append(resultado)
+
+    salida = args.salida or os.path.join(
+        DIRECTORIO, f"benchmark_{datos['entorno']['commit'] or 'sin_git'}.json"
+    )
+    with open(salida, 'w') as f:
+        json.dump(datos, f, indent=2, ensure_ascii=False)
+    print(f"✅ Resultados guardados en {salida}")
+
+
+if __name__ == '__main__':
+    main()
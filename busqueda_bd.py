@@ -0,0 +1,294 @@
+"""Búsqueda de texto completo (FTS5) en los mensajes de conversaciones
+
+El índice `conversaciones_fts` cubre mensaje_usuario y mensaje_bot sin copiar
+el texto: es una tabla FTS5 de contenido externo que apunta a conversaciones
+(content_rowid = id). Triggers lo mantienen al insertar, borrar (ej. al
+archivar un mes) o editar mensajes; el historial existente se indexa por lotes
+de ids, así el bot nunca espera más que un lote por el lock de escritura.
+
+Cada archivo mensual de archivo_bd lleva su propio índice, creado al archivar
+(o con `indexar_archivos` para los archivos anteriores), y `buscar` los
+consulta adjuntándolos uno por uno. El tokenizador ignora mayúsculas y
+tildes: "tamano" encuentra "tamaño".
+
+Uso como script:
+
+    python busqueda_bd.py [--backfill] [papanatas_chat.db]
+    python busqueda_bd.py --buscar "transferencia grande" [papanatas_chat.db]
+"""
+
+import re
+import sqlite3
+
+import pandas as pd
+
+import archivo_bd
+
+TABLA = 'conversaciones_fts'
+TOKENIZADOR = 'unicode61 remove_diacritics 2'
+
+# Delimitadores de las coincidencias en los fragmentos (caracteres de uso
+# privado: no aparecen en los mensajes y sobreviven a html.escape)
+INICIO_COINCIDENCIA = '\ue000'
+FIN_COINCIDENCIA = '\ue001'
+
+# Coincidencias más recientes que se ordenan por relevancia en cada base
+VENTANA_RANKING = 1000
+
+
+def sql_tabla(esquema='main'):
+    return f"""CREATE VIRTUAL TABLE IF NOT EXISTS {esquema}.{TABLA} USING fts5(
+    mensaje_usuario, mensaje_bot,
+    content='conversaciones', content_rowid='id',
+    tokenize='{TOKENIZADOR}'
+)"""
+
+
+def _insertar(fila):
+    return (f"INSERT INTO {TABLA} (rowid, mensaje_usuario, mensaje_bot) "
+            f"VALUES ({fila}.id, {fila}.mensaje_usuario, {fila}.mensaje_bot);")
+
+
+def _borrar(fila):
+    return (f"INSERT INTO {TABLA} ({TABLA}, rowid, mensaje_usuario, mensaje_bot) "
+            f"VALUES ('delete', {fila}.id, {fila}.mensaje_usuario, {fila}.mensaje_bot);")
+
+
+# Con contenido externo el índice no guarda el texto: para borrar hay que
+# pasarle los valores que tenía la fila
+TRIGGERS = {
+    f'trg_{TABLA}_insertar': f"""CREATE TRIGGER trg_{TABLA}_insertar
+AFTER INSERT ON conversaciones
+BEGIN
+    {_insertar('NEW')}
+END""",
+    f'trg_{TABLA}_borrar': f"""CREATE TRIGGER trg_{TABLA}_borrar
+AFTER DELETE ON conversaciones
+BEGIN
+    {_borrar('OLD')}
+END""",
+    f'trg_{TABLA}_actualizar': f"""CREATE TRIGGER trg_{TABLA}_actualizar
+AFTER UPDATE OF mensaje_usuario, mensaje_bot ON conversaciones
+BEGIN
+    {_borrar('OLD')}
+    {_insertar('NEW')}
+END""",
+}
+
+
+def _normalizar(sql):
+    return re.sub(r'\s+', ' ', sql or '').strip()
+
+
+def instalar(conn):
+    """Crea el índice y sus triggers
+
+    Devuelve 'pendiente' si el bot aún no creó conversaciones, 'ok' si ya
+    estaba todo y 'creada' si hubo cambios (el historial se indexa aparte con
+    `indexar`).
+    """
+    existentes = {
+        (fila[0], fila[1]): fila[2] for fila in conn.execute(
+            "SELECT type, name, sql FROM sqlite_master WHERE type IN ('table', 'trigger')"
+        ).fetchall()
+    }
+    if ('table', 'conversaciones') not in existentes:
+        return 'pendiente'
+    cambios = {
+        nombre: sql for nombre, sql in TRIGGERS.items()
+        if _normalizar(existentes.get(('trigger', nombre))) != _normalizar(sql)
+    }
+    if ('table', TABLA) in existentes and not cambios:
+        return 'ok'
+
+    conn.commit()
+    conn.execute("BEGIN IMMEDIATE")
+    try:
+        conn.execute(sql_tabla())
+        for nombre, sql in cambios.items():
+            conn.execute(f"DROP TRIGGER IF EXISTS {nombre}")
+            conn.execute(sql)
+        conn.commit()
+    except Exception:
+        conn.rollback()
+        raise
+    return 'creada'
+
+
+def pendientes(conn):
+    """Mensajes de la base principal que todavía no están en el índice"""
+    return conn.execute(f"""
+    SELECT (SELECT COUNT(*) FROM conversaciones) - (SELECT COUNT(*) FROM {TABLA}_docsize)
+    """).fetchone()[0]
+
+
+def indexar(conn, lote=50_000):
+    """Indexa por lotes de ids los mensajes que faltan (cada lote en su propia transacción)
+
+    Los triggers ya cubren los mensajes nuevos; `conversaciones_fts_docsize`
+    (una fila por mensaje indexado) permite retomar un backfill interrumpido sin duplicar.
+    Devuelve la cantidad de mensajes indexados.
+    """
+    ultimo_id = conn.execute("SELECT COALESCE(MAX(id), 0) FROM conversaciones").fetchone()[0]
+    total = 0
+    for desde in range(0, ultimo_id, lote):
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            total += conn.execute(f"""
+            INSERT INTO {TABLA} (rowid, mensaje_usuario, mensaje_bot)
+            SELECT c.id, c.mensaje_usuario, c.mensaje_bot
+            FROM conversaciones c
+            WHERE c.id > ? AND c.id <= ?
+              AND NOT EXISTS (SELECT 1 FROM {TABLA}_docsize d WHERE d.id = c.id)
+            """, [desde, desde + lote]).rowcount
+            conn.commit()
+        except Exception:
+            conn.rollback()
+            raise
+    return total
+
+
+def indexar_esquema(conn, esquema):
+    """Crea (o rehace) el índice completo de un archivo mensual adjunto; no tiene triggers porque no cambia"""
+    conn.execute(sql_tabla(esquema))
+    conn.execute(f"INSERT INTO {esquema}.{TABLA} ({TABLA}) VALUES ('rebuild')")
+
+
+def indexar_archivos(conn):
+    """Indexa los archivos mensuales creados antes de que existiera la búsqueda; devuelve los meses indexados"""
+    indexados = []
+    for mes in archivo_bd.meses_archivados(archivo_bd.ruta_principal(conn) or ''):
+        with archivo_bd.adjuntar(conn, mes) as esquema:
+            if esquema is None:
+                continue
+            existe = conn.execute(
+                f"SELECT 1 FROM {esquema}.sqlite_master WHERE name = ?", [TABLA]
+            ).fetchone()
+            if existe:
+                continue
+            conn.execute("BEGIN IMMEDIATE")
+            try:
+                indexar_esquema(conn, esquema)
+                conn.commit()
+            except Exception:
+                conn.rollback()
+                raise
+            indexados.append(mes)
+    return indexados
+
+
+def consulta_fts(texto):
+    """Convierte lo que escribe el operador en una consulta FTS5 segura
+
+    Las frases entre comillas se buscan tal cual y las palabras sueltas como
+    palabras completas; terminada en * una palabra se busca como prefijo
+    ("transf*" encuentra "transferencia"). Todos los términos deben
+    aparecer. Devuelve None si no queda nada que buscar.
+    """
+    terminos = []
+    for frase, palabra in re.findall(r'"([^"]*)"|(\S+)', texto or ''):
+        partes = re.findall(r'\w+', frase or palabra)
+        if not partes:
+            continue
+        if frase:
+            terminos.append('"' + ' '.join(partes) + '"')
+            continue
+        terminos.extend(f'"{parte}"' for parte in partes)
+        if palabra.endswith('*'):
+            terminos[-1] += '*'
+    return ' '.join(terminos) or None
+
+
+def _buscar_esquema(conn, esquema, consulta, limite, mes):
+    # Ordenar por bm25 todas las coincidencias de un término muy común (ej. una
+    # palabra de las respuestas del bot) recorre cientos de miles de filas: se
+    # ordenan solo las VENTANA_RANKING más recientes, y los fragmentos se arman
+    # solo para las `limite` elegidas
+    return pd.read_sql_query(f"""
+    WITH recientes AS (
+        SELECT rowid FROM {esquema}.{TABLA} WHERE {TABLA} MATCH :consulta
+        ORDER BY rowid DESC LIMIT :ventana
+    ), mejores AS (
+        SELECT rowid, bm25({TABLA}, 2.0, 1.0) AS rango
+        FROM {esquema}.{TABLA}
+        WHERE {TABLA} MATCH :consulta AND rowid >= (SELECT COALESCE(MIN(rowid), 0) FROM recientes)
+        ORDER BY rango
+        LIMIT :limite
+    )
+    SELECT c.id, c.numero_telefono, c.timestamp, c.step,
+           snippet({TABLA}, 0, :inicio, :fin, '…', 12) AS fragmento_usuario,
+           snippet({TABLA}, 1, :inicio, :fin, '…', 12) AS fragmento_bot,
+           m.rango, :mes AS mes
+    FROM mejores m
+    JOIN {esquema}.{TABLA} ON {TABLA}.rowid = m.rowid
+    JOIN {esquema}.conversaciones c ON c.id = m.rowid
+    WHERE {TABLA} MATCH :consulta
+      -- FTS5 no busca por rowid junto con MATCH: acotar el rango evita recorrer todas las coincidencias
+      AND {TABLA}.rowid >= (SELECT MIN(rowid) FROM mejores)
+    ORDER BY m.rango
+    """, conn, params={
+        'consulta': consulta, 'ventana': VENTANA_RANKING, 'limite': limite,
+        'inicio': INICIO_COINCIDENCIA, 'fin': FIN_COINCIDENCIA, 'mes': mes,
+    })
+
+
+def buscar(conn, texto, limite=50, archivados=True):
+    """Mensajes que coinciden con `texto`: primero la base principal y después
+    los meses archivados, del más reciente al más antiguo
+
+    Dentro de cada base se ordenan por relevancia (bm25, los mensajes del
+    cliente pesan el doble que las respuestas del bot) entre sus
+    VENTANA_RANKING coincidencias más recientes; los puntajes de índices
+    distintos no son comparables, por eso no se mezclan. Los archivos solo se
+    adjuntan si faltan resultados. `mes` indica el archivo de cada resultado
+    (None: base principal) y los fragmentos marcan las coincidencias con
+    INICIO_COINCIDENCIA / FIN_COINCIDENCIA.
+    """
+    consulta = consulta_fts(texto)
+    columnas = ['id', 'numero_telefono', 'timestamp', 'step', 'fragmento_usuario', 'fragmento_bot',
+                'rango', 'mes']
+    if consulta is None:
+        return pd.DataFrame(columns=columnas)
+    resultados = [_buscar_esquema(conn, 'main', consulta, limite, None)]
+    faltan = limite - len(resultados[0])
+    if archivados and faltan > 0:
+        for mes in reversed(archivo_bd.meses_archivados(archivo_bd.ruta_principal(conn) or '')):
+            with archivo_bd.adjuntar(conn, mes) as esquema:
+                if esquema is None:
+                    continue
+                try:
+                    encontrados = _buscar_esquema(conn, esquema, consulta, faltan, mes)
+                except (sqlite3.OperationalError, pd.errors.DatabaseError):
+                    # Archivo sin índice todavía (ver indexar_archivos)
+                    continue
+            resultados.append(encontrados)
+            faltan -= len(encontrados)
+            if faltan <= 0:
+                break
+    resultados = [df for df in resultados if len(df) > 0]
+    if not resultados:
+        return pd.DataFrame(columns=columnas)
+    return pd.concat(resultados, ignore_index=True)
+
+
+if __name__ == '__main__':
+    import argparse
+
+    parser = argparse.ArgumentParser(description="Índice de búsqueda de texto completo de conversaciones")
+    parser.add_argument('ruta', nargs='?', default='papanatas_chat.db')
+    parser.add_argument('--backfill', action='store_true', help="Indexa el historial y los archivos mensuales")
+    parser.add_argument('--buscar', help="Texto a buscar")
+    args = parser.parse_args()
+
+    conexion = sqlite3.connect(args.ruta, timeout=30)
+    print(f"Instalación: {instalar(conexion)}")
+    if args.backfill or pendientes(conexion):
+        print(f"✅ {indexar(conexion)} mensajes indexados")
+        for mes in indexar_archivos(conexion):
+            print(f"✅ Archivo {mes} indexado")
+    if args.buscar:
+        for fila in buscar(conexion, args.buscar, limite=20).itertuples(index=False):
+            fragmento = fila.fragmento_usuario if INICIO_COINCIDENCIA in (fila.fragmento_usuario or '') \
+                else fila.fragmento_bot
+            fragmento = (fragmento or '').replace(INICIO_COINCIDENCIA, '[').replace(FIN_COINCIDENCIA, ']')
+            print(f"{fila.timestamp}  {fila.numero_telefono}  #{fila.id}  {fragmento}")
@@ -0,0 +1,331 @@
+"""Caché local de los comprobantes (imágenes y PDF) con miniaturas
+
+`comprobante_url` apunta a la API de medios de Twilio: abrir un comprobante
+desde el dashboard lo descargaba completo en cada clic. Esta caché guarda cada
+archivo en disco una sola vez, con un tope de tamaño y desalojo LRU (la fecha
+de modificación del archivo registra el último uso, así el orden sobrevive a
+los reinicios), y genera una miniatura JPEG por imagen la primera vez que se
+pide.
+
+`Precargador` descarga en segundo plano los comprobantes nuevos que publica
+el ServicioSnapshot, de modo que cuando el operador los abre ya están en disco.
+
+Con `base_api` (TWILIO_API_URL, la misma variable que usa index.js) las URLs
+de api.twilio.com se piden a otro servidor, ej. el stub de carga_webhook.py.
+"""
+
+import base64
+import hashlib
+import os
+import queue
+import threading
+import time
+import urllib.error
+import urllib.parse
+import urllib.request
+import uuid
+from collections import OrderedDict
+
+API_TWILIO = 'https://api.twilio.com'
+
+EXTENSIONES = {
+    'image/jpeg': '.jpg',
+    'image/png': '.png',
+    'image/webp': '.webp',
+    'image/gif': '.gif',
+    'application/pdf': '.pdf',
+}
+EXTENSIONES_IMAGEN = ('.jpg', '.png', '.webp', '.gif')
+SUFIJO_MINIATURA = '.mini.jpg'
+
+
+def clave(url):
+    """Nombre base del archivo en caché para una URL"""
+    return hashlib.sha256(url.encode('utf-8')).hexdigest()[:32]
+
+
+class CacheMedios:
+    """Archivos descargados en `directorio`, con desalojo LRU al pasar `max_bytes`"""
+
+    def __init__(self, directorio, max_bytes=200 * 1024 * 1024, credenciales=None, base_api=None,
+                 timeout=10, max_archivo_bytes=20 * 1024 * 1024, lado_miniatura=320, reintentar_fallo=60):
+        self.directorio = os.path.abspath(directorio)
+        self.max_bytes = max_bytes
+        self.credenciales = credenciales
+        self.base_api = base_api.rstrip('/') if base_api else None
+        self.timeout = timeout
+        self.max_archivo_bytes = max_archivo_bytes
+        self.lado_miniatura = lado_miniatura
+        self.reintentar_fallo = reintentar_fallo
+
+        self._lock = threading.Lock()
+        self._en_curso = {}
+        self._fallos = {}
+        self._archivos = OrderedDict()
+        self._bytes = 0
+        self._estadisticas = {
+            'aciertos': 0,
+            'descargas': 0,
+            'bytes_descargados': 0,
+            'errores': 0,
+            'miniaturas': 0,
+            'desalojados': 0,
+        }
+        os.makedirs(self.directorio, exist_ok=True)
+        self._cargar_indice()
+
+    def _cargar_indice(self):
+        """Reconstruye el orden LRU desde el disco (más antiguo primero)"""
+        archivos = []
+        for nombre in os.listdir(self.directorio):
+            ruta = os.path.join(self.directorio, nombre)
+            if nombre.startswith('.tmp-'):
+                os.remove(ruta)
+                continue
+            estado = os.stat(ruta)
+            archivos.append((estado.st_mtime, nombre, estado.st_size))
+        for _, nombre, tamaño in sorted(archivos):
+            self._archivos[nombre] = tamaño
+            self._bytes += tamaño
+
+    def _tocar(self, nombre):
+        """Marca un archivo como recién usado; False si ya no está"""
+        with self._lock:
+            if nombre not in self._archivos:
+                return False
+            self._archivos.move_to_end(nombre)
+        try:
+            os.utime(os.path.join(self.directorio, nombre))
+        except OSError:
+            pass
+        return True
+
+    def _registrar(self, nombre, tamaño):
+        """Agrega un archivo ya escrito y desaloja los menos usados si hace falta"""
+        desalojar = []
+        with self._lock:
+            self._bytes += tamaño - self._archivos.pop(nombre, 0)
+            self._archivos[nombre] = tamaño
+            while self._bytes > self.max_bytes and len(self._archivos) > 1:
+                viejo, tamaño_viejo = self._archivos.popitem(last=False)
+                self._bytes -= tamaño_viejo
+                desalojar.append(viejo)
+            self._estadisticas['desalojados'] += len(desalojar)
+        for viejo in desalojar:
+            try:
+                os.remove(os.path.join(self.directorio, viejo))
+            except OSError:
+                pass
+
+    def _buscar(self, base):
+        """Nombre del original en caché para una clave, o None"""
+        with self._lock:
+            for extension in (*EXTENSIONES.values(), '.bin'):
+                if base + extension in self._archivos:
+                    return base + extension
+        return None
+
+    def _url_descarga(self, url):
+        if self.base_api and url.startswith(API_TWILIO + '/'):
+            return self.base_api + url[len(API_TWILIO):]
+        return url
+
+    def _descargar(self, url, base):
+        # comprobante_url viene del webhook: solo http(s), y las credenciales
+        # solo para la API de Twilio (o su reemplazo configurado en base_api)
+        if urllib.parse.urlsplit(url).scheme not in ('http', 'https'):
+            raise ValueError(f"esquema no permitido en {url}")
+        peticion = urllib.request.Request(self._url_descarga(url))
+        if self.credenciales and url.startswith(API_TWILIO + '/'):
+            token = base64.b64encode(':'.join(self.credenciales).encode('utf-8')).decode('ascii')
+            # Sin reenviarla al seguir la redirección al enlace firmado de los medios
+            peticion.add_unredirected_header('Authorization', f'Basic {token}')
+        temporal = os.path.join(self.directorio, f'.tmp-{uuid.uuid4().hex}')
+        try:
+            # Twilio redirige a un enlace firmado; urllib sigue la redirección
+            with urllib.request.urlopen(peticion, timeout=self.timeout) as respuesta:
+                tipo = (respuesta.headers.get_content_type() or '').lower()
+                tamaño = 0
+                with open(temporal, 'wb') as salida:
+                    while True:
+                        bloque = respuesta.read(64 * 1024)
+                        if not bloque:
+                            break
+                        tamaño += len(bloque)
+                        if tamaño > self.max_archivo_bytes:
+                            raise ValueError(f"comprobante de más de {self.max_archivo_bytes} bytes")
+                        salida.write(bloque)
+            nombre = base + EXTENSIONES.get(tipo, '.bin')
+            os.replace(temporal, os.path.join(self.directorio, nombre))
+        except BaseException:
+            try:
+                os.remove(temporal)
+            except OSError:
+                pass
+            raise
+        self._registrar(nombre, tamaño)
+        with self._lock:
+            self._estadisticas['descargas'] += 1
+            self._estadisticas['bytes_descargados'] += tamaño
+        return nombre
+
+    def obtener(self, url, descargar=True):
+        """Ruta local del comprobante; lo descarga si falta
+
+        Devuelve None si no está y `descargar` es False, o si la descarga
+        falló hace menos de `reintentar_fallo` segundos. Dos pedidos
+        simultáneos de la misma URL hacen una sola descarga.
+        """
+        if not url:
+            return None
+        base = clave(url)
+        while True:
+            nombre = self._buscar(base)
+            if nombre and self._tocar(nombre):
+                with self._lock:
+                    self._estadisticas['aciertos'] += 1
+                return os.path.join(self.directorio, nombre)
+            if not descargar:
+                return None
+            with self._lock:
+                fallo = self._fallos.get(base)
+                if fallo and time.monotonic() - fallo < self.reintentar_fallo:
+                    return None
+                evento = self._en_curso.get(base)
+                propio = evento is None
+                if propio:
+                    evento = self._en_curso[base] = threading.Event()
+            if not propio:
+                # Otro hilo la está descargando: esperar y volver a buscar
+                evento.wait(self.timeout * 2)
+                with self._lock:
+                    if base in self._fallos:
+                        return None
+                continue
+            try:
+                nombre = self._descargar(url, base)
+                with self._lock:
+                    self._fallos.pop(base, None)
+                return os.path.join(self.directorio, nombre)
+            except (OSError, ValueError, urllib.error.URLError) as e:
+                print(f"Error descargando comprobante {url}: {e}")
+                with self._lock:
+                    self._fallos[base] = time.monotonic()
+                    self._estadisticas['errores'] += 1
+                return None
+            finally:
+                with self._lock:
+                    self._en_curso.pop(base, None)
+                evento.set()
+
+    def fallo_reciente(self, url):
+        """True si la descarga de `url` falló hace menos de `reintentar_fallo` segundos"""
+        with self._lock:
+            fallo = self._fallos.get(clave(url))
+        return fallo is not None and time.monotonic() - fallo < self.reintentar_fallo
+
+    def es_imagen(self, ruta):
+        return bool(ruta) and ruta.endswith(EXTENSIONES_IMAGEN)
+
+    def tiene_miniatura(self, url):
+        """True si la miniatura ya está en disco (sin tocar el orden LRU)"""
+        with self._lock:
+            return bool(url) and clave(url) + SUFIJO_MINIATURA in self._archivos
+
+    def miniatura(self, url, descargar=True):
+        """Bytes JPEG de la miniatura del comprobante, o None (no descargado, no es imagen o falló)
+
+        Se genera una sola vez desde el original y queda en la caché como un archivo más.
+        """
+        if not url:
+            return None
+        nombre = clave(url) + SUFIJO_MINIATURA
+        ruta = os.path.join(self.directorio, nombre)
+        if self._tocar(nombre):
+            try:
+                with open(ruta, 'rb') as f:
+                    return f.read()
+            except OSError:
+                pass
+        original = self.obtener(url, descargar)
+        if not self.es_imagen(original):
+            return None
+        try:
+            from PIL import Image, ImageOps
+
+            with Image.open(original) as imagen:
+                imagen = ImageOps.exif_transpose(imagen)
+                imagen.thumbnail((self.lado_miniatura, self.lado_miniatura))
+                temporal = os.path.join(self.directorio, f'.tmp-{uuid.uuid4().hex}')
+                imagen.convert('RGB').save(temporal, 'JPEG', quality=80, optimize=True)
+            os.replace(temporal, ruta)
+            with open(ruta, 'rb') as f:
+                datos = f.read()
+        except Exception as e:
+            print(f"Error generando miniatura de {url}: {e}")
+            return None
+        self._registrar(nombre, len(datos))
+        with self._lock:
+            self._estadisticas['miniaturas'] += 1
+        return datos
+
+    def estadisticas(self):
+        """Copia de los contadores de la caché"""
+        with self._lock:
+            datos = dict(self._estadisticas)
+            datos['archivos'] = len(self._archivos)
+            datos['bytes'] = self._bytes
+        return datos
+
+
+class Precargador:
+    """Descarga (y miniaturiza) en segundo plano los comprobantes que se le encolan"""
+
+    def __init__(self, cache, hilos=2):
+        self.cache = cache
+        self._cola = queue.Queue()
+        self._vistos = set()
+        self._lock = threading.Lock()
+        self._hilos = [
+            threading.Thread(target=self._bucle, name=f'precarga-medios-{i}', daemon=True)
+            for i in range(hilos)
+        ]
+
+    def iniciar(self):
+        for hilo in self._hilos:
+            hilo.start()
+        return self
+
+    def encolar(self, urls):
+        """Agrega las URLs que todavía no se encolaron (las que fallaron, una vez vencido el reintento)"""
+        with self._lock:
+            nuevas = [
+                url for url in urls
+                if url and url not in self._vistos and not self.cache.fallo_reciente(url)
+            ]
+            self._vistos.update(nuevas)
+        for url in nuevas:
+            self._cola.put(url)
+        return len(nuevas)
+
+    def al_publicar(self, snapshot):
+        """Suscriptor de ServicioSnapshot: precarga los comprobantes del snapshot nuevo"""
+        if len(snapshot.comprobantes) > 0:
+            self.encolar(snapshot.comprobantes['comprobante_url'].dropna().tolist())
+
+    def _bucle(self):
+        while True:
+            url = self._cola.get()
+            try:
+                self.cache.miniatura(url)
+            except Exception as e:
+                print(f"Error precargando comprobante {url}: {e}")
+            finally:
+                # Si la descarga falló se podrá volver a encolar cuando venza el reintento
+                if self.cache.fallo_reciente(url):
+                    with self._lock:
+                        self._vistos.discard(url)
+                self._cola.task_done()
+
+    def pendientes(self):
+        return self._cola.qsize()
@@ -0,0 +1,485 @@
+"""Tasa de escritura del bot que la base aguanta con el dashboard leyendo
+
+Reproduce en Python las escrituras de index.js por cada mensaje del webhook
+(INSERT en sesiones y en conversaciones; INSERT del pedido al confirmar y
+UPDATE por clave primaria del estado y del comprobante) sobre una base con
+todo lo que instala el dashboard: índices, contact_summary, contadores e
+índice de búsqueda, cuyos triggers corren dentro de cada escritura.
+
+Compara dos formas de escribir:
+
+- `mensaje`: un commit (y un fsync) por sentencia, como hacía el bot
+- `grupo`: la cola de index.js (ColaEscritura): un commit cada `intervalo_ms`
+  o cada `lote` sentencias
+
+Para cada tasa (mensajes por segundo, llegadas de Poisson) corre `segundos`
+con `lectores` sesiones del dashboard que cada `intervalo_lectura` segundos
+leen la página de contactos y el chat del contacto más reciente (si cambió
+PRAGMA data_version, como las cachés del dashboard), más la actualización
+periódica de rollups y embudo, que también toma el lock de escritura. Una
+tasa se sostiene si el bot la alcanza, el p99 desde que llega el mensaje
+hasta su commit queda bajo --limite-escritura-ms y el p95 de las lecturas
+bajo --limite-lectura-ms.
+
+Uso:
+
+    python carga_escritura.py [--filas 10000] [--tasas 50,100,200,400,800] [--segundos 5] \\
+        [--modos mensaje,grupo] [--intervalo-ms 5] [--lote 200] [--lectores 4] [--salida escritura.json]
+"""
+
+import json
+import os
+import queue
+import random
+import shutil
+import sqlite3
+import sys
+import tempfile
+import threading
+import time
+from datetime import datetime
+
+import busqueda_bd
+import consultas_bd
+import contadores_bd
+import embudo_bd
+import generar_datos
+import resumen_contactos
+import rollups_bd
+import sesiones_bd
+from carga_webhook import resumir_latencias
+from indices_bd import crear_indices
+from pool_bd import PoolConexiones
+
+DIRECTORIO = os.path.dirname(os.path.abspath(__file__))
+
+# Mismas sentencias que index.js
+SQL_SESION = """INSERT INTO sesiones
+  (nombre_cliente, tamaño, agregado, bebida, tipo_extra, pedido_id)
+  VALUES (?, ?, ?, ?, ?, ?)
+  ON CONFLICT DO NOTHING"""
+
+SQL_MENSAJE_SESION = """INSERT INTO conversaciones
+  (numero_telefono, mensaje_usuario, mensaje_bot, step, sesion_id)
+  VALUES (?, ?, ?, ?, (SELECT id FROM sesiones
+    WHERE nombre_cliente = ? AND tamaño = ? AND agregado = ?
+      AND bebida = ? AND tipo_extra = ? AND pedido_id = ?))"""
+
+SQL_PEDIDO = """INSERT INTO pedidos
+  (numero_telefono, nombre_cliente, tamaño, agregado, bebida, total, estado)
+  VALUES (?, ?, ?, ?, ?, ?, ?)"""
+
+CONDICION_PEDIDO = """WHERE numero_telefono = ?
+  AND id = COALESCE(?, (SELECT MAX(id) FROM pedidos WHERE numero_telefono = ?))"""
+
+SQL_ESTADO = f"UPDATE pedidos SET estado = ?, comprobante_recibido = ? {CONDICION_PEDIDO}"
+
+SQL_COMPROBANTE_URL = f"UPDATE pedidos SET comprobante_url = ? {CONDICION_PEDIDO}"
+
+# Conversaciones abiertas a la vez (los mensajes se intercalan entre ellas)
+CONVERSACIONES_ACTIVAS = 50
+
+
+# *** BASE DE PRUEBA ***
+
+def preparar_base(directorio, filas, semilla=1):
+    """Base sintética con las estructuras del dashboard instaladas; se reutiliza si ya existe"""
+    ruta = os.path.join(directorio, f"papanatas_escritura_{filas}.db")
+    if os.path.exists(ruta):
+        return ruta
+    temporal = ruta + '.tmp'
+    if os.path.exists(temporal):
+        os.remove(temporal)
+    generar_datos.generar(temporal, filas, semilla=semilla)
+    conn = sqlite3.connect(temporal, timeout=30)
+    try:
+        conn.execute("PRAGMA journal_mode = WAL")
+        crear_indices(conn)
+        if sesiones_bd.instalar(conn) == 'creada':
+            sesiones_bd.migrar(conn)
+        resumen_contactos.instalar(conn)
+        contadores_bd.instalar(conn)
+        if busqueda_bd.instalar(conn) != 'pendiente':
+            busqueda_bd.indexar(conn)
+        rollups_bd.instalar(conn)
+        rollups_bd.actualizar(conn)
+        embudo_bd.instalar(conn)
+        embudo_bd.actualizar(conn)
+        conn.execute("PRAGMA wal_checkpoint(TRUNCATE)")
+    finally:
+        conn.close()
+    os.replace(temporal, ruta)
+    return ruta
+
+
+def copiar_base(origen, destino):
+    """Copia limpia de la base (sin -wal ni -shm de una corrida anterior)"""
+    for sufijo in ('', '-wal', '-shm'):
+        if os.path.exists(destino + sufijo):
+            os.remove(destino + sufijo)
+    shutil.copyfile(origen, destino)
+    return destino
+
+
+# *** MENSAJES DEL BOT ***
+
+class Mensaje:
+    """Un mensaje del webhook: las escrituras del bot (cada una devuelve cuántas sentencias corrió) y cuándo llegó"""
+    __slots__ = ('llegada', 'operaciones')
+
+    def __init__(self, operaciones):
+        self.llegada = None
+        self.operaciones = operaciones
+
+
+def _valores_sesion(session, conversacion):
+    # Igual que valoresSesion() de index.js, con el id real del pedido
+    pedido = session['pedido']
+    agregado = pedido.get('agregado')
+    agregado = json.dumps(agregado) if isinstance(agregado, list) else (agregado or '')
+    return [pedido.get('nombre') or '', pedido.get('tamaño') or '', agregado,
+            1 if pedido.get('bebida') else 0, pedido.get('tipo_extra') or '',
+            conversacion['pedido_id'] or 0]
+
+
+def conversacion(rng, numero):
+    """Mensajes de una conversación completa (ver generar_datos._rafaga)"""
+    nombre = rng.choice(generar_datos.NOMBRES) + rng.choice(generar_datos.APELLIDOS)
+    mensajes, pedido = generar_datos._rafaga(rng, numero, nombre, datetime.now(), 0)
+    estado = {'pedido_id': None}
+
+    def insertar_pedido(conn):
+        cursor = conn.execute(SQL_PEDIDO, [
+            numero, pedido['nombre_cliente'], pedido['tamaño'], pedido['agregado'],
+            pedido['bebida'], pedido['total'], 'esperando_pago'
+        ])
+        # El bot guarda el id en la sesión: las actualizaciones van por clave primaria
+        estado['pedido_id'] = cursor.lastrowid
+        return 1
+
+    def actualizar_pedido(conn):
+        conn.execute(SQL_ESTADO, ['comprobante_recibido', 1, numero, estado['pedido_id'], numero])
+        if not pedido['comprobante_url']:
+            return 1
+        conn.execute(SQL_COMPROBANTE_URL, [pedido['comprobante_url'], numero, estado['pedido_id'], numero])
+        return 2
+
+    for _, usuario, bot, step, session_json in mensajes:
+        session = json.loads(session_json)
+
+        def guardar_mensaje(conn, usuario=usuario, bot=bot, step=step, session=session):
+            valores = _valores_sesion(session, estado)
+            conn.execute(SQL_SESION, valores)
+            conn.execute(SQL_MENSAJE_SESION, [numero, usuario, bot, step, *valores])
+            return 2
+
+        operaciones = []
+        if pedido is not None and step == 'esperando_comprobante':
+            operaciones.append(insertar_pedido)
+        elif pedido is not None and step == 'pedido_completado':
+            operaciones.append(actualizar_pedido)
+        operaciones.append(guardar_mensaje)
+        yield Mensaje(operaciones)
+
+
+class Llegadas(threading.Thread):
+    """Encola mensajes a `tasa` por segundo (Poisson) intercalando conversaciones"""
+
+    def __init__(self, cola, tasa, segundos, semilla=1):
+        super().__init__(name='llegadas', daemon=True)
+        self.cola = cola
+        self.tasa = tasa
+        self.segundos = segundos
+        self.rng = random.Random(semilla)
+        self.enviados = 0
+
+    def _nueva(self):
+        numero = f"whatsapp:+569{self.rng.randrange(10**8):08d}"
+        return conversacion(random.Random(self.rng.getrandbits(64)), numero)
+
+    def run(self):
+        activas = [self._nueva() for _ in range(CONVERSACIONES_ACTIVAS)]
+        inicio = time.perf_counter()
+        siguiente = inicio
+        while siguiente - inicio < self.segundos:
+            # Programado sobre el reloj absoluto para no acumular el retraso de sleep()
+            espera = siguiente - time.perf_counter()
+            if espera > 0:
+                time.sleep(espera)
+            indice = self.rng.randrange(len(activas))
+            mensaje = next(activas[indice], None)
+            while mensaje is None:
+                activas[indice] = self._nueva()
+                mensaje = next(activas[indice], None)
+            mensaje.llegada = time.perf_counter()
+            self.cola.put(mensaje)
+            self.enviados += 1
+            siguiente += self.rng.expovariate(self.tasa)
+        self.cola.put(None)
+
+
+# *** ESCRITOR (EL BOT) ***
+
+class Escritor(threading.Thread):
+    """Escribe los mensajes de la cola con un commit por sentencia o por lote"""
+
+    def __init__(self, ruta, cola, agrupar, intervalo=0.005, lote=200):
+        super().__init__(name='escritor', daemon=True)
+        self.ruta = ruta
+        self.cola = cola
+        self.agrupar = agrupar
+        self.intervalo = intervalo
+        self.lote = lote
+        self.latencias = []
+        self.commits = 0
+        self.sentencias = 0
+        self.errores = 0
+        self.escritos = 0
+        self.fin = None
+
+    def _juntar(self, primero):
+        """Mensajes del próximo lote: hasta `lote` sentencias o `intervalo` desde el primero"""
+        mensajes, sentencias = [primero], len(primero.operaciones)
+        limite = time.perf_counter() + self.intervalo
+        while sentencias < self.lote:
+            restante = limite - time.perf_counter()
+            if restante <= 0:
+                break
+            try:
+                mensaje = self.cola.get(timeout=restante)
+            except queue.Empty:
+                break
+            if mensaje is None:
+                return mensajes, True
+            mensajes.append(mensaje)
+            sentencias += len(mensaje.operaciones)
+        return mensajes, False
+
+    def _escribir(self, conn, mensaje):
+        for operacion in mensaje.operaciones:
+            try:
+                self.sentencias += operacion(conn)
+            except sqlite3.Error:
+                self.errores += 1
+
+    def _confirmar(self, mensajes):
+        ahora = time.perf_counter()
+        self.latencias.extend(ahora - mensaje.llegada for mensaje in mensajes)
+        self.escritos += len(mensajes)
+
+    def run(self):
+        # Autocommit: sin BEGIN explícito cada sentencia es su propia transacción.
+        # El caché de sentencias de sqlite3 reutiliza las preparadas, como la cola de index.js
+        conn = sqlite3.connect(self.ruta, timeout=30, isolation_level=None)
+        try:
+            terminado = False
+            while not terminado:
+                primero = self.cola.get()
+                if primero is None:
+                    break
+                if not self.agrupar:
+                    # Cada INSERT/UPDATE del bot hace su propio commit (sesión y mensaje incluidos)
+                    antes = self.sentencias
+                    self._escribir(conn, primero)
+                    self.commits += self.sentencias - antes
+                    self._confirmar([primero])
+                    continue
+                mensajes, terminado = self._juntar(primero)
+                conn.execute("BEGIN IMMEDIATE")
+                for mensaje in mensajes:
+                    self._escribir(conn, mensaje)
+                conn.execute("COMMIT")
+                self.commits += 1
+                self._confirmar(mensajes)
+        finally:
+            self.fin = time.perf_counter()
+            conn.close()
+
+
+# *** LECTORES (EL DASHBOARD) ***
+
+class Lector(threading.Thread):
+    """Una sesión del dashboard: contactos y chat cuando cambia la versión de datos"""
+
+    def __init__(self, pool, intervalo, detener, nombre):
+        super().__init__(name=nombre, daemon=True)
+        self.pool = pool
+        self.intervalo = intervalo
+        self.detener = detener
+        self.tiempos = []
+        self.errores = 0
+
+    @staticmethod
+    def _leer(conn):
+        contactos, _ = consultas_bd.pagina_contactos(conn, por_pagina=50)
+        if len(contactos):
+            consultas_bd.pagina_mensajes(conn, contactos['numero_telefono'].iloc[0])
+
+    def run(self):
+        version = None
+        while not self.detener.wait(self.intervalo):
+            inicio = time.perf_counter()
+            try:
+                actual = self.pool.version_datos()
+                if actual != version:
+                    self.pool.leer_consistente(self._leer)
+                    version = actual
+            except sqlite3.Error:
+                self.errores += 1
+                continue
+            self.tiempos.append(time.perf_counter() - inicio)
+
+
+class Mantenimiento(threading.Thread):
+    """Rollups y embudo incrementales del dashboard (escriben en la misma base)"""
+
+    def __init__(self, pool, intervalo, detener):
+        super().__init__(name='mantenimiento', daemon=True)
+        self.pool = pool
+        self.intervalo = intervalo
+        self.detener = detener
+        self.tiempos = []
+        self.errores = 0
+
+    def run(self):
+        while not self.detener.wait(self.intervalo):
+            inicio = time.perf_counter()
+            try:
+                with self.pool.escritura() as conn:
+                    rollups_bd.actualizar(conn)
+                    embudo_bd.actualizar(conn)
+            except sqlite3.Error:
+                self.errores += 1
+                continue
+            self.tiempos.append(time.perf_counter() - inicio)
+
+
+# *** CORRIDA ***
+
+def medir(ruta, modo, tasa, opciones):
+    """Una tasa con un modo de escritura; devuelve su resumen"""
+    cola = queue.Queue()
+    detener = threading.Event()
+    pool = PoolConexiones(ruta, max_conexiones=opciones['lectores'])
+    llegadas = Llegadas(cola, tasa, opciones['segundos'], opciones['semilla'])
+    escritor = Escritor(ruta, cola, modo == 'grupo', opciones['intervalo_ms'] / 1000, opciones['lote'])
+    lectores = [
+        Lector(pool, opciones['intervalo_lectura'], detener, f'lector-{i}')
+        for i in range(opciones['lectores'])
+    ]
+    mantenimiento = Mantenimiento(pool, opciones['intervalo_mantenimiento'], detener)
+    try:
+        for hilo in [escritor, mantenimiento, *lectores]:
+            hilo.start()
+        inicio = time.perf_counter()
+        llegadas.start()
+        llegadas.join()
+        escritor.join()
+        detener.set()
+        for hilo in [mantenimiento, *lectores]:
+            hilo.join()
+    finally:
+        pool.cerrar()
+
+    duracion = escritor.fin - inicio
+    lecturas = [t for lector in lectores for t in lector.tiempos]
+    resultado = {
+        'modo': modo,
+        'tasa_objetivo': tasa,
+        'mensajes': escritor.escritos,
+        'tasa_lograda': round(escritor.escritos / duracion, 1) if duracion else None,
+        'commits_por_s': round(escritor.commits / duracion, 1) if duracion else None,
+        'sentencias_por_commit': round(escritor.sentencias / escritor.commits, 1) if escritor.commits else None,
+        'errores_escritura': escritor.errores,
+        'escritura': resumir_latencias(escritor.latencias) if escritor.latencias else None,
+        'lectura': resumir_latencias(lecturas) if lecturas else None,
+        'errores_lectura': sum(lector.errores for lector in lectores),
+        'mantenimiento': resumir_latencias(mantenimiento.tiempos) if mantenimiento.tiempos else None,
+    }
+    # Si el bot no da abasto la cola crece y la duración se estira más allá de `segundos`
+    resultado['sostenida'] = bool(
+        resultado['escritura']
+        and duracion <= opciones['segundos'] * 1.05 + 0.5
+        and resultado['escritura']['p99_ms'] <= opciones['limite_escritura_ms']
+        and (resultado['lectura'] is None or resultado['lectura']['p95_ms'] <= opciones['limite_lectura_ms'])
+    )
+    return resultado
+
+
+def ejecutar(opciones):
+    """Todas las combinaciones de modo y tasa sobre copias de la misma base"""
+    base = preparar_base(opciones['directorio'], opciones['filas'], opciones['semilla'])
+    resultados = []
+    # Las copias van al mismo disco que la base: el costo del fsync es parte de lo que se mide
+    with tempfile.TemporaryDirectory(prefix='carga_escritura_', dir=opciones['directorio']) as temporal:
+        for modo in opciones['modos']:
+            for tasa in opciones['tasas']:
+                ruta = copiar_base(base, os.path.join(temporal, 'carga.db'))
+                resultado = medir(ruta, modo, tasa, opciones)
+                imprimir_resultado(resultado)
+                resultados.append(resultado)
+                # Las tasas siguientes no se sostendrán si esta ya no se sostuvo
+                if not resultado['sostenida'] and opciones['cortar']:
+                    break
+    maximas = {
+        modo: max((r['tasa_objetivo'] for r in resultados if r['modo'] == modo and r['sostenida']), default=0)
+        for modo in opciones['modos']
+    }
+    return {
+        'configuracion': {k: v for k, v in opciones.items() if k != 'salida'},
+        'base': base,
+        'resultados': resultados,
+        'tasa_maxima_sostenida': maximas,
+    }
+
+
+def imprimir_resultado(r):
+    escritura, lectura = r['escritura'] or {}, r['lectura'] or {}
+    print(f"{r['modo']:<8} {r['tasa_objetivo']:>7} {r['tasa_lograda'] or 0:>9.1f} {r['commits_por_s'] or 0:>9.1f} "
+          f"{escritura.get('p50_ms', 0):>9.1f} {escritura.get('p99_ms', 0):>9.1f} "
+          f"{lectura.get('p95_ms', 0):>10.1f}  {'✅' if r['sostenida'] else '❌'}", flush=True)
+
+
+def main():
+    import argparse
+
+    parser = argparse.ArgumentParser(description="Tasa de escritura del bot con el dashboard leyendo")
+    parser.add_argument('--filas', type=int, default=10_000, help="Mensajes de la base inicial")
+    parser.add_argument('--directorio', default=DIRECTORIO, help="Dónde guardar la base inicial")
+    parser.add_argument('--tasas', default='50,100,200,400,800', help="Mensajes por segundo a probar")
+    parser.add_argument('--segundos', type=float, default=5.0, help="Duración de cada tasa")
+    parser.add_argument('--modos', default='mensaje,grupo')
+    parser.add_argument('--intervalo-ms', type=float, default=5.0, help="Espera máxima de la cola (modo grupo)")
+    parser.add_argument('--lote', type=int, default=200, help="Sentencias por commit (modo grupo)")
+    parser.add_argument('--lectores', type=int, default=4, help="Sesiones del dashboard leyendo")
+    parser.add_argument('--intervalo-lectura', type=float, default=1.0)
+    parser.add_argument('--intervalo-mantenimiento', type=float, default=5.0,
+                        help="Cada cuánto se actualizan rollups y embudo")
+    parser.add_argument('--limite-escritura-ms', type=float, default=250.0)
+    parser.add_argument('--limite-lectura-ms', type=float, default=500.0)
+    parser.add_argument('--sin-cortar', dest='cortar', action='store_false',
+                        help="Probar todas las tasas aunque una no se sostenga")
+    parser.add_argument('--semilla', type=int, default=1)
+    parser.add_argument('--salida', help="Guarda el informe en JSON")
+    args = parser.parse_args()
+
+    opciones = vars(args)
+    opciones['tasas'] = [float(t) for t in args.tasas.split(',')]
+    opciones['modos'] = [m.strip() for m in args.modos.split(',')]
+    if any(modo not in ('mensaje', 'grupo') for modo in opciones['modos']):
+        parser.error("--modos acepta 'mensaje' y 'grupo'")
+
+    print(f"{'modo':<8} {'objetivo':>7} {'lograda':>9} {'commits/s':>9} {'p50 ms':>9} {'p99 ms':>9} "
+          f"{'lect. p95':>10}")
+    informe = ejecutar(opciones)
+    for modo, tasa in informe['tasa_maxima_sostenida'].items():
+        print(f"Máxima tasa sostenida ({modo}): {tasa:g} mensajes/s")
+    if args.salida:
+        with open(args.salida, 'w') as f:
+            json.dump(informe, f, indent=2, ensure_ascii=False)
+        print(f"✅ Informe guardado en {args.salida}")
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
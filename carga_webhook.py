@@ -0,0 +1,533 @@
+"""Prueba de carga del webhook del bot con un Twilio local
+
+Reproduce conversaciones completas contra `/webhook` de index.js con los
+mismos campos de formulario que envía Twilio (From, Body, NumMedia,
+MediaUrl0, MediaContentType0), recorriendo todos los `step` del bot:
+inválidos, modificación del pedido, comprobante por imagen, PDF o texto.
+
+Los envíos del bot van a un stub local de la API de mensajes de Twilio
+(index.js lo usa cuando está definida TWILIO_API_URL). Al final informa la
+latencia por paso (p50/p95/p99), el throughput y la contención de escritura
+en SQLite: cuánto espera un escritor por el lock, errores SQLITE_BUSY del bot
+y mensajes que no llegaron a la base.
+
+Uso (lanza el bot con una base aparte y el stub):
+
+    python carga_webhook.py --lanzar-bot --bd papanatas_carga.db --conversaciones 500 \\
+        --concurrencia 20 [--tasa 10] [--latencia-twilio-ms 150] [--salida carga.json]
+
+Con el bot ya corriendo, basta con --url y --bd (el bot debe tener
+TWILIO_API_URL apuntando al stub, ver --puerto-stub). El dashboard se puede
+abrir sobre la misma base con PAPANATAS_DB=papanatas_carga.db.
+"""
+
+import http.client
+import json
+import os
+import queue
+import random
+import sqlite3
+import subprocess
+import sys
+import threading
+import time
+from collections import defaultdict
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlencode, urlparse
+
+from benchmark import percentil
+from generar_datos import APELLIDOS, NOMBRES
+
+DIRECTORIO = os.path.dirname(os.path.abspath(__file__))
+
+URL_IMAGEN = "https://api.twilio.com/2010-04-01/Accounts/ACcarga/Messages/MM{0:016x}/Media/ME{0:016x}"
+
+
+# *** GUIONES DE CONVERSACIÓN ***
+
+def guion(rng):
+    """Mensajes de una conversación: lista de (step en que llega, Body, media o None)
+
+    media es (url, content_type). Sigue las mismas transiciones que index.js.
+    """
+    pasos = [('inicio', rng.choice(['hola', 'Hola', 'buenas']), None)]
+    pasos.append(('esperando_nombre', rng.choice(NOMBRES) + rng.choice(APELLIDOS), None))
+
+    if rng.random() < 0.1:
+        pasos.append(('esperando_tamaño', rng.choice(['4', 'grande', '']), None))
+    pasos.append(('esperando_tamaño', rng.choice('123'), None))
+
+    def agregado():
+        if rng.random() < 0.5:
+            pasos.append(('esperando_agregado_opcion', '2', None))
+            return
+        pasos.append(('esperando_agregado_opcion', '1', None))
+        tipo = rng.choice('123')
+        pasos.append(('esperando_tipo_agregado', tipo, None))
+        if tipo != '1':
+            pasos.append(('esperando_tipo_extra_premium', rng.choice('12'), None))
+
+    agregado()
+    pasos.append(('esperando_bebida', rng.choice('12'), None))
+
+    if rng.random() < 0.15:
+        # Modifica el tamaño antes de confirmar
+        pasos.append(('esperando_confirmacion_final', '2', None))
+        pasos.append(('modificando_pedido', '1', None))
+        pasos.append(('esperando_tamaño_modificacion', rng.choice('123'), None))
+        if rng.random() < 0.5:
+            pasos.append(('preguntando_cambio_agregado', '1', None))
+            agregado()
+            pasos.append(('esperando_bebida', rng.choice('12'), None))
+        else:
+            pasos.append(('preguntando_cambio_agregado', '2', None))
+    if rng.random() < 0.1:
+        # Abandona en el resumen
+        return pasos
+    pasos.append(('esperando_confirmacion_final', '1', None))
+
+    if rng.random() < 0.1:
+        pasos.append(('esperando_comprobante', 'ayuda', None))
+    if rng.random() < 0.05:
+        pasos.append(('esperando_comprobante', '', (URL_IMAGEN.format(rng.getrandbits(64)), 'application/pdf')))
+    if rng.random() < 0.7:
+        pasos.append(('esperando_comprobante', '', (URL_IMAGEN.format(rng.getrandbits(64)), 'image/jpeg')))
+    else:
+        pasos.append(('esperando_comprobante', rng.choice(['enviado', 'listo', 'ya pagué, transferido']), None))
+    if rng.random() < 0.3:
+        pasos.append(('pedido_completado', 'gracias', None))
+    return pasos
+
+
+def formulario(numero, body, media):
+    """Campos que Twilio envía al webhook para un mensaje de WhatsApp"""
+    campos = {
+        'From': numero,
+        'To': 'whatsapp:+14155238886',
+        'Body': body,
+        'NumMedia': '1' if media else '0',
+        'MessageSid': f"SM{random.getrandbits(128):032x}",
+        'AccountSid': 'ACcarga',
+    }
+    if media:
+        campos['MediaUrl0'], campos['MediaContentType0'] = media
+    return urlencode(campos).encode('utf-8')
+
+
+# *** STUB DE TWILIO ***
+
+def imagen_comprobante(semilla, ancho=1200, alto=1600):
+    """JPEG de un comprobante falso (requiere Pillow, que ya instala Streamlit)"""
+    from io import BytesIO
+
+    from PIL import Image, ImageDraw
+
+    rng = random.Random(semilla)
+    imagen = Image.new('RGB', (ancho, alto), (rng.randrange(200, 256), rng.randrange(200, 256), 255))
+    dibujo = ImageDraw.Draw(imagen)
+    for y in range(80, alto - 80, 60):
+        dibujo.rectangle([80, y, rng.randrange(300, ancho - 80), y + 24], fill=(60, 60, 90))
+    salida = BytesIO()
+    imagen.save(salida, 'JPEG', quality=85)
+    return salida.getvalue()
+
+
+class StubTwilio:
+    """Servidor que imita la API de Twilio que usan el bot y el dashboard
+
+    - POST /2010-04-01/Accounts/{sid}/Messages.json: envío de mensajes (index.js)
+    - GET .../Messages/{MM}/Media/{ME}: un JPEG por URL (cache_medios del dashboard)
+    """
+
+    def __init__(self, puerto=0, latencia=0.0, host='127.0.0.1'):
+        self.latencia = latencia
+        self.enviados = 0
+        self.medios_servidos = 0
+        self._lock = threading.Lock()
+        stub = self
+
+        class Manejador(BaseHTTPRequestHandler):
+            protocol_version = 'HTTP/1.1'
+            # Cabeceras y cuerpo van en dos writes: sin esto Nagle suma ~40 ms por respuesta
+            disable_nagle_algorithm = True
+
+            def do_POST(self):
+                largo = int(self.headers.get('Content-Length') or 0)
+                campos = parse_qs(self.rfile.read(largo).decode('utf-8'))
+                if not self.path.endswith('/Messages.json'):
+                    self.send_error(404)
+                    return
+                if stub.latencia:
+                    time.sleep(stub.latencia)
+                with stub._lock:
+                    stub.enviados += 1
+                cuerpo = json.dumps({
+                    'sid': f"SM{random.getrandbits(128):032x}",
+                    'status': 'queued',
+                    'to': campos.get('To', [''])[0],
+                    'from': campos.get('From', [''])[0],
+                    'body': campos.get('Body', [''])[0],
+                }).encode('utf-8')
+                self.send_response(201)
+                self.send_header('Content-Type', 'application/json')
+                self.send_header('Content-Length', str(len(cuerpo)))
+                self.end_headers()
+                self.wfile.write(cuerpo)
+
+            def do_GET(self):
+                if '/Media/' not in self.path:
+                    self.send_error(404)
+                    return
+                if stub.latencia:
+                    time.sleep(stub.latencia)
+                cuerpo = imagen_comprobante(self.path)
+                with stub._lock:
+                    stub.medios_servidos += 1
+                self.send_response(200)
+                self.send_header('Content-Type', 'image/jpeg')
+                self.send_header('Content-Length', str(len(cuerpo)))
+                self.end_headers()
+                self.wfile.write(cuerpo)
+
+            def log_message(self, *args):
+                pass
+
+        self.servidor = ThreadingHTTPServer((host, puerto), Manejador)
+        self.servidor.daemon_threads = True
+        self.url = f"http://{host}:{self.servidor.server_address[1]}"
+
+    def iniciar(self):
+        threading.Thread(target=self.servidor.serve_forever, name='stub-twilio', daemon=True).start()
+        return self
+
+    def detener(self):
+        self.servidor.shutdown()
+
+
+# *** BOT Y MEDICIÓN DE CONTENCIÓN ***
+
+class ProcesoBot:
+    """index.js lanzado con una base y un Twilio propios; cuenta los errores de SQLite en su salida"""
+
+    PATRONES_BUSY = ('SQLITE_BUSY', 'database is locked')
+    PATRONES_BD = ('Error guardando', 'Error actualizando', 'Error en base de datos')
+
+    def __init__(self, ruta_bd, url_twilio, puerto):
+        self.puerto = puerto
+        self.errores_busy = 0
+        self.errores_bd = 0
+        entorno = dict(
+            os.environ,
+            PORT=str(puerto),
+            PAPANATAS_DB=os.path.abspath(ruta_bd),
+            TWILIO_API_URL=url_twilio,
+            TWILIO_ACCOUNT_SID='ACcarga',
+            TWILIO_AUTH_TOKEN='carga',
+            TWILIO_WHATSAPP_NUMBER='whatsapp:+14155238886',
+        )
+        self.proceso = subprocess.Popen(
+            ['node', os.path.join(DIRECTORIO, 'index.js')], cwd=DIRECTORIO, env=entorno,
+            stdout=subprocess.PIPE, stderr=subprocess.STDOUT, text=True, errors='replace'
+        )
+        threading.Thread(target=self._leer_salida, name='salida-bot', daemon=True).start()
+
+    def _leer_salida(self):
+        # Hay que vaciar la salida siempre: el bot registra cada webhook
+        for linea in self.proceso.stdout:
+            if any(patron in linea for patron in self.PATRONES_BUSY):
+                self.errores_busy += 1
+            elif any(patron in linea for patron in self.PATRONES_BD):
+                self.errores_bd += 1
+
+    def esperar_listo(self, espera=20.0):
+        """Espera a que /api/estado responda"""
+        limite = time.monotonic() + espera
+        while time.monotonic() < limite:
+            if self.proceso.poll() is not None:
+                raise RuntimeError(f"index.js terminó con código {self.proceso.returncode}")
+            try:
+                conexion = http.client.HTTPConnection('127.0.0.1', self.puerto, timeout=1)
+                conexion.request('GET', '/api/estado')
+                if conexion.getresponse().status == 200:
+                    return
+            except OSError:
+                pass
+            time.sleep(0.2)
+        raise TimeoutError("index.js no respondió en /api/estado")
+
+    def detener(self):
+        self.proceso.terminate()
+        try:
+            self.proceso.wait(timeout=10)
+        except subprocess.TimeoutExpired:
+            self.proceso.kill()
+
+
+class SondaEscritura(threading.Thread):
+    """Mide cada `intervalo` cuánto tarda un escritor en obtener el lock de la base"""
+
+    def __init__(self, ruta_bd, intervalo=0.1):
+        super().__init__(name='sonda-escritura', daemon=True)
+        self.ruta_bd = ruta_bd
+        self.intervalo = intervalo
+        self.esperas = []
+        self.timeouts = 0
+        self.wal_max_bytes = 0
+        self._detener = threading.Event()
+
+    def run(self):
+        conn = sqlite3.connect(self.ruta_bd, timeout=5, isolation_level=None)
+        try:
+            while not self._detener.wait(self.intervalo):
+                inicio = time.perf_counter()
+                try:
+                    conn.execute("BEGIN IMMEDIATE")
+                    conn.execute("ROLLBACK")
+                    self.esperas.append(time.perf_counter() - inicio)
+                except sqlite3.OperationalError:
+                    self.timeouts += 1
+                try:
+                    self.wal_max_bytes = max(self.wal_max_bytes, os.path.getsize(self.ruta_bd + '-wal'))
+                except OSError:
+                    pass
+        finally:
+            conn.close()
+
+    def detener(self):
+        self._detener.set()
+        self.join()
+
+
+def contar_filas(ruta_bd):
+    """(mensajes, pedidos) en la base, o (0, 0) si el bot aún no la creó"""
+    if not os.path.exists(ruta_bd):
+        return 0, 0
+    conn = sqlite3.connect(ruta_bd, timeout=5)
+    try:
+        return tuple(
+            conn.execute(f"SELECT COUNT(*) FROM {tabla}").fetchone()[0]
+            for tabla in ('conversaciones', 'pedidos')
+        )
+    except sqlite3.OperationalError:
+        return 0, 0
+    finally:
+        conn.close()
+
+
+# *** GENERADOR DE CARGA ***
+
+def resumir_latencias(tiempos):
+    """Resumen en milisegundos con p99 (las colas importan en una prueba de carga)"""
+    ms = [t * 1000 for t in tiempos]
+    return {
+        'n': len(ms),
+        'p50_ms': round(percentil(ms, 50), 2),
+        'p95_ms': round(percentil(ms, 95), 2),
+        'p99_ms': round(percentil(ms, 99), 2),
+        'max_ms': round(max(ms), 2),
+    }
+
+
+class GeneradorCarga:
+    """Reproduce conversaciones con `concurrencia` clientes simultáneos
+
+    Con `tasa` (conversaciones nuevas por segundo, llegadas de Poisson) la
+    carga es abierta: si el bot no da abasto las conversaciones esperan en
+    cola y esa espera no cuenta en la latencia. Sin tasa, cada cliente
+    empieza otra conversación apenas termina la anterior.
+    """
+
+    def __init__(self, url, conversaciones, concurrencia=10, tasa=None, pausa=0.0, semilla=1, timeout=30):
+        destino = urlparse(url)
+        self.host, self.puerto = destino.hostname, destino.port or 80
+        self.ruta = (destino.path.rstrip('/') or '') + '/webhook'
+        self.conversaciones = conversaciones
+        self.concurrencia = concurrencia
+        self.tasa = tasa
+        self.pausa = pausa
+        self.timeout = timeout
+        self.rng = random.Random(semilla)
+        self.latencias = defaultdict(list)
+        self.errores = defaultdict(int)
+        self.completadas = 0
+        self._lock = threading.Lock()
+
+    def _llegadas(self, cola):
+        for i in range(self.conversaciones):
+            if self.tasa:
+                time.sleep(self.rng.expovariate(self.tasa))
+            numero = f"whatsapp:+569{self.rng.randrange(10**8):08d}"
+            cola.put((numero, guion(random.Random(self.rng.getrandbits(64)))))
+        for _ in range(self.concurrencia):
+            cola.put(None)
+
+    def _cliente(self, cola):
+        conexion = http.client.HTTPConnection(self.host, self.puerto, timeout=self.timeout)
+        cabeceras = {'Content-Type': 'application/x-www-form-urlencoded'}
+        while True:
+            trabajo = cola.get()
+            if trabajo is None:
+                break
+            numero, pasos = trabajo
+            for step, body, media in pasos:
+                inicio = time.perf_counter()
+                try:
+                    conexion.request('POST', self.ruta, formulario(numero, body, media), cabeceras)
+                    respuesta = conexion.getresponse()
+                    respuesta.read()
+                    estado = respuesta.status
+                except (OSError, http.client.HTTPException) as e:
+                    estado = type(e).__name__
+                    conexion.close()
+                    conexion = http.client.HTTPConnection(self.host, self.puerto, timeout=self.timeout)
+                duracion = time.perf_counter() - inicio
+                with self._lock:
+                    if estado == 200:
+                        self.latencias[step].append(duracion)
+                    else:
+                        self.errores[f"{step}: {estado}"] += 1
+                if self.pausa:
+                    time.sleep(self.pausa)
+            with self._lock:
+                self.completadas += 1
+        conexion.close()
+
+    def ejecutar(self):
+        """Corre la carga completa; devuelve la duración en segundos"""
+        cola = queue.Queue(maxsize=self.concurrencia * 2)
+        hilos = [threading.Thread(target=self._llegadas, args=(cola,), name='llegadas', daemon=True)]
+        hilos += [
+            threading.Thread(target=self._cliente, args=(cola,), name=f'cliente-{i}', daemon=True)
+            for i in range(self.concurrencia)
+        ]
+        inicio = time.perf_counter()
+        for hilo in hilos:
+            hilo.start()
+        for hilo in hilos:
+            hilo.join()
+        return time.perf_counter() - inicio
+
+
+def ejecutar_carga(opciones):
+    """Stub, bot (opcional), sonda y carga; devuelve el informe como dict"""
+    stub = StubTwilio(opciones['puerto_stub'], opciones['latencia_twilio_ms'] / 1000).iniciar()
+    bot = None
+    try:
+        if opciones['lanzar_bot']:
+            bot = ProcesoBot(opciones['bd'], stub.url, opciones['puerto_bot'])
+            bot.esperar_listo()
+            url = f"http://127.0.0.1:{opciones['puerto_bot']}"
+        else:
+            url = opciones['url']
+            print(f"Stub de Twilio en {stub.url} (el bot debe correr con TWILIO_API_URL={stub.url})")
+
+        filas_antes = contar_filas(opciones['bd'])
+        sonda = SondaEscritura(opciones['bd'])
+        sonda.start()
+        generador = GeneradorCarga(
+            url, opciones['conversaciones'], opciones['concurrencia'], opciones['tasa'],
+            opciones['pausa_ms'] / 1000, opciones['semilla']
+        )
+        duracion = generador.ejecutar()
+        # El bot guarda el mensaje sin esperar la escritura: se deja terminar la cola de SQLite
+        time.sleep(1.0)
+        sonda.detener()
+        filas_despues = contar_filas(opciones['bd'])
+    finally:
+        if bot is not None:
+            bot.detener()
+        stub.detener()
+
+    todas = [t for tiempos in generador.latencias.values() for t in tiempos]
+    peticiones = len(todas) + sum(generador.errores.values())
+    mensajes_guardados = filas_despues[0] - filas_antes[0]
+    return {
+        'configuracion': {k: v for k, v in opciones.items() if k != 'salida'},
+        'duracion_s': round(duracion, 2),
+        'conversaciones_completadas': generador.completadas,
+        'peticiones': peticiones,
+        'throughput_rps': round(peticiones / duracion, 1) if duracion else None,
+        'latencia_total': resumir_latencias(todas) if todas else None,
+        'latencia_por_paso': {
+            step: resumir_latencias(tiempos) for step, tiempos in sorted(generador.latencias.items())
+        },
+        'errores_http': dict(generador.errores),
+        'twilio_enviados': stub.enviados,
+        'sqlite': {
+            'mensajes_guardados': mensajes_guardados,
+            'mensajes_perdidos': max(0, len(todas) - mensajes_guardados),
+            'pedidos_guardados': filas_despues[1] - filas_antes[1],
+            'espera_lock_escritura': resumir_latencias(sonda.esperas) if sonda.esperas else None,
+            'timeouts_lock_escritura': sonda.timeouts,
+            'wal_max_mb': round(sonda.wal_max_bytes / 1024 / 1024, 1),
+            'errores_busy_bot': bot.errores_busy if bot else None,
+            'errores_bd_bot': bot.errores_bd if bot else None,
+        },
+    }
+
+
+def imprimir_informe(informe):
+    print(f"\n{informe['peticiones']} peticiones en {informe['duracion_s']} s "
+          f"→ {informe['throughput_rps']} req/s, "
+          f"{informe['conversaciones_completadas']} conversaciones")
+    print(f"\n{'paso':<32} {'n':>6} {'p50 ms':>9} {'p95 ms':>9} {'p99 ms':>9} {'max ms':>9}")
+    filas = list(informe['latencia_por_paso'].items())
+    if informe['latencia_total']:
+        filas.append(('TOTAL', informe['latencia_total']))
+    for step, r in filas:
+        print(f"{step:<32} {r['n']:>6} {r['p50_ms']:>9.1f} {r['p95_ms']:>9.1f} "
+              f"{r['p99_ms']:>9.1f} {r['max_ms']:>9.1f}")
+    for error, cantidad in informe['errores_http'].items():
+        print(f"⚠️ {error}: {cantidad}")
+
+    sqlite = informe['sqlite']
+    print(f"\nSQLite: {sqlite['mensajes_guardados']} mensajes y {sqlite['pedidos_guardados']} pedidos guardados, "
+          f"{sqlite['mensajes_perdidos']} mensajes perdidos, WAL máx. {sqlite['wal_max_mb']} MB")
+    espera = sqlite['espera_lock_escritura']
+    if espera:
+        print(f"Espera por el lock de escritura: p50 {espera['p50_ms']:.1f} ms, p95 {espera['p95_ms']:.1f} ms, "
+              f"máx. {espera['max_ms']:.1f} ms ({sqlite['timeouts_lock_escritura']} timeouts)")
+    if sqlite['errores_busy_bot'] is not None:
+        print(f"Errores del bot: {sqlite['errores_busy_bot']} SQLITE_BUSY, {sqlite['errores_bd_bot']} otros de BD")
+
+
+def main():
+    import argparse
+
+    parser = argparse.ArgumentParser(description="Prueba de carga del webhook del bot")
+    parser.add_argument('--url', default='http://127.0.0.1:3000', help="Bot ya en marcha (sin --lanzar-bot)")
+    parser.add_argument('--bd', default='papanatas_carga.db', help="Base que escribe el bot")
+    parser.add_argument('--lanzar-bot', action='store_true', help="Lanza index.js con --bd y el stub")
+    parser.add_argument('--puerto-bot', type=int, default=3100)
+    parser.add_argument('--puerto-stub', type=int, default=3999)
+    parser.add_argument('--conversaciones', type=int, default=200)
+    parser.add_argument('--concurrencia', type=int, default=10, help="Clientes simultáneos")
+    parser.add_argument('--tasa', type=float, help="Conversaciones nuevas por segundo (carga abierta)")
+    parser.add_argument('--pausa-ms', type=float, default=0, help="Pausa del cliente entre mensajes")
+    parser.add_argument('--latencia-twilio-ms', type=float, default=0, help="Demora simulada de la API de Twilio")
+    parser.add_argument('--semilla', type=int, default=1)
+    parser.add_argument('--salida', help="Guarda el informe en JSON")
+    parser.add_argument('--solo-stub', action='store_true',
+                        help="Solo sirve el stub de Twilio en --puerto-stub (ej. para cache_medios del dashboard)")
+    args = parser.parse_args()
+
+    if args.solo_stub:
+        stub = StubTwilio(args.puerto_stub, args.latencia_twilio_ms / 1000)
+        print(f"Stub de Twilio en {stub.url} (Ctrl+C para terminar)")
+        try:
+            stub.servidor.serve_forever()
+        except KeyboardInterrupt:
+            pass
+        return 0
+
+    informe = ejecutar_carga(vars(args))
+    imprimir_informe(informe)
+    if args.salida:
+        with open(args.salida, 'w') as f:
+            json.dump(informe, f, indent=2, ensure_ascii=False)
+        print(f"✅ Informe guardado en {args.salida}")
+    return 1 if informe['errores_http'] else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
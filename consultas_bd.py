@@ -0,0 +1,424 @@
+"""Consultas de lectura del dashboard, independientes de Streamlit
+
+Cada función recibe una conexión SQLite abierta y deja el manejo de errores y
+la caché a quien la llama (el dashboard, el servicio de snapshots o los
+benchmarks).
+"""
+
+import sqlite3
+from datetime import date, datetime
+
+import pandas as pd
+
+import archivo_bd
+from indices_bd import rango_dia
+
+# Columnas del resumen por contacto que muestran la lista y el chat
+COLUMNAS_CONTACTO = [
+    'numero_telefono', 'ultima_actividad', 'total_mensajes', 'nombre_cliente',
+    'estado', 'comprobante_recibido', 'comprobante_url', 'total'
+]
+
+SIN_PEDIDO = 'Sin pedido'
+
+# Formato de CURRENT_TIMESTAMP en SQLite (el de las columnas timestamp)
+FORMATO_FECHA = '%Y-%m-%d %H:%M:%S'
+
+# Columnas que llegan al dashboard como datetime y como category (pocos valores
+# distintos que se repiten en cada fila)
+COLUMNAS_FECHA = ('timestamp', 'ultima_actividad')
+COLUMNAS_CATEGORIA = ('numero_telefono', 'step', 'estado')
+
+# Columnas exportables por tabla (las de comprobante se omiten si el bot aún no las creó)
+COLUMNAS_EXPORTACION = {
+    'pedidos': archivo_bd.COLUMNAS_PEDIDOS,
+    'conversaciones': ['id', 'numero_telefono', 'timestamp', 'mensaje_usuario', 'mensaje_bot', 'step'],
+}
+
+_SELECT_CONTACTO = f"SELECT {', '.join(COLUMNAS_CONTACTO)} FROM contact_summary"
+
+
+def version_esquema(conn):
+    """PRAGMA schema_version: SQLite lo incrementa con cada CREATE, ALTER o DROP"""
+    return conn.execute("PRAGMA schema_version").fetchone()[0]
+
+
+def estructura_bd(conn):
+    """Columnas disponibles en pedidos (las de comprobante las agrega el bot más tarde)"""
+    columnas = [col[1] for col in conn.execute("PRAGMA table_info(pedidos)").fetchall()]
+    return {
+        'tiene_comprobante_recibido': 'comprobante_recibido' in columnas,
+        'tiene_comprobante_url': 'comprobante_url' in columnas,
+        'columnas': columnas
+    }
+
+
+def compactar(df):
+    """Fechas como datetime y columnas repetitivas como category, en el mismo DataFrame
+
+    Es idempotente: sirve también para volver a compactar tras un pd.concat
+    que mezcló categorías distintas.
+    """
+    for columna in COLUMNAS_FECHA:
+        if columna in df.columns:
+            df[columna] = pd.to_datetime(df[columna], format=FORMATO_FECHA, errors='coerce')
+    for columna in COLUMNAS_CATEGORIA:
+        if columna in df.columns:
+            df[columna] = df[columna].astype('category')
+    return df
+
+
+def clave_fecha(valor):
+    """Texto con el que se compara en SQL un timestamp de un DataFrame compactado"""
+    return valor.strftime(FORMATO_FECHA) if isinstance(valor, datetime) else valor
+
+
+def ultimo_id_conversaciones(conn):
+    """Mayor id de conversaciones (lectura directa sobre la clave primaria)"""
+    return conn.execute("SELECT COALESCE(MAX(id), 0) FROM conversaciones").fetchone()[0]
+
+
+def contactos_vacios():
+    """DataFrame vacío con las columnas del resumen por contacto"""
+    return compactar(pd.DataFrame(columns=COLUMNAS_CONTACTO))
+
+
+def conversaciones_por_numero(conn, desde_id=0):
+    """Resumen por contacto; con desde_id solo los contactos con mensajes de id mayor"""
+    query = f"""
+    {_SELECT_CONTACTO}
+    WHERE total_mensajes > 0 AND ultimo_mensaje_id > ?
+    ORDER BY ultima_actividad DESC
+    """
+    return compactar(pd.read_sql_query(query, conn, params=[desde_id]))
+
+
+def resumen_contacto(conn, numero_telefono):
+    """Fila de contact_summary de un contacto"""
+    return compactar(pd.read_sql_query(
+        f"{_SELECT_CONTACTO} WHERE numero_telefono = ?", conn, params=[numero_telefono]
+    ))
+
+
+def mensajes_numero(conn, numero_telefono, desde_id=0, hasta_id=None):
+    """Mensajes de un número con id en (desde_id, hasta_id], en orden cronológico"""
+    query = """
+    SELECT id, timestamp, mensaje_usuario, mensaje_bot, step
+    FROM conversaciones
+    WHERE numero_telefono = ? AND id > ?
+    """
+    params = [numero_telefono, desde_id]
+    if hasta_id is not None:
+        query += " AND id <= ?"
+        params.append(hasta_id)
+    query += " ORDER BY timestamp ASC, id ASC"
+    return compactar(pd.read_sql_query(query, conn, params=params))
+
+
+def _consulta_pagina(conn, tabla, numero_telefono, antes, limite, hasta_id=None):
+    """Mensajes de `tabla` anteriores a `antes`, del más reciente al más antiguo"""
+    query = f"""
+    SELECT id, timestamp, mensaje_usuario, mensaje_bot, step
+    FROM {tabla}
+    WHERE numero_telefono = ?
+    """
+    params = [numero_telefono]
+    if antes is not None:
+        query += " AND (timestamp, id) < (?, ?)"
+        params.extend(antes)
+    if hasta_id is not None:
+        query += " AND id <= ?"
+        params.append(hasta_id)
+    query += " ORDER BY timestamp DESC, id DESC LIMIT ?"
+    params.append(limite)
+    return pd.read_sql_query(query, conn, params=params)
+
+
+def pagina_mensajes(conn, numero_telefono, antes=None, limite=50, hasta_id=None):
+    """Los `limite` mensajes más recientes anteriores a `antes`, en orden cronológico
+
+    `antes` es el par (timestamp, id) del mensaje más antiguo ya cargado
+    (paginación por clave sobre el índice numero_telefono/timestamp). Cuando
+    el historial de la base principal se termina, sigue en los meses
+    archivados del contacto. Devuelve (mensajes_df, hay_anteriores).
+    """
+    if antes is not None:
+        antes = (clave_fecha(antes[0]), antes[1])
+    mensajes_df = _consulta_pagina(conn, 'conversaciones', numero_telefono, antes, limite + 1, hasta_id)
+    if len(mensajes_df) <= limite:
+        hasta_mes = antes[0][:7] if antes is not None else None
+        partes = [mensajes_df]
+        faltan = limite + 1 - len(mensajes_df)
+        for mes in archivo_bd.meses_de_contacto(conn, numero_telefono, hasta_mes):
+            with archivo_bd.adjuntar(conn, mes) as esquema:
+                if esquema is None:
+                    continue
+                archivados = _consulta_pagina(conn, f"{esquema}.conversaciones", numero_telefono, antes, faltan)
+            partes.append(archivados)
+            faltan -= len(archivados)
+            if faltan <= 0:
+                break
+        if len(partes) > 1:
+            mensajes_df = pd.concat([p for p in partes if len(p) > 0] or partes[:1], ignore_index=True)
+
+    hay_anteriores = len(mensajes_df) > limite
+    return compactar(mensajes_df.head(limite).iloc[::-1].reset_index(drop=True)), hay_anteriores
+
+
+def posicion_mensaje(conn, numero_telefono, timestamp, mensaje_id, mes=None):
+    """Mensajes del contacto desde (timestamp, mensaje_id) inclusive hasta el más reciente
+
+    Es el `limite` de pagina_mensajes que hace llegar la ventana del chat hasta
+    ese mensaje. `mes` es el archivo mensual donde está (None: base principal).
+    """
+    sql = ("SELECT COUNT(*) FROM {tabla} "
+           "WHERE numero_telefono = ? AND (timestamp, id) >= (?, ?)")
+    params = [numero_telefono, clave_fecha(timestamp), mensaje_id]
+    if mes is None:
+        return conn.execute(sql.format(tabla='conversaciones'), params).fetchone()[0]
+    # Todo lo de la base principal y de los meses archivados posteriores es más reciente
+    total = conn.execute(
+        "SELECT COUNT(*) FROM conversaciones WHERE numero_telefono = ?", [numero_telefono]
+    ).fetchone()[0]
+    total += conn.execute(
+        "SELECT COALESCE(SUM(mensajes), 0) FROM archivo_contactos WHERE numero_telefono = ? AND mes > ?",
+        [numero_telefono, mes]
+    ).fetchone()[0]
+    with archivo_bd.adjuntar(conn, mes) as esquema:
+        if esquema is not None:
+            total += conn.execute(sql.format(tabla=f"{esquema}.conversaciones"), params).fetchone()[0]
+    return total
+
+
+def _filtros_contactos(nombre, sufijo_telefono, estado, con_comprobante):
+    """Arma la cláusula WHERE de la lista de contactos a partir de los filtros"""
+    condiciones = ["total_mensajes > 0"]
+    params = []
+    if nombre:
+        condiciones.append("nombre_cliente LIKE ?")
+        params.append(f"%{nombre}%")
+    if sufijo_telefono:
+        condiciones.append("numero_telefono LIKE ?")
+        params.append(f"%{sufijo_telefono}")
+    if estado == SIN_PEDIDO:
+        condiciones.append("pedido_id IS NULL")
+    elif estado:
+        condiciones.append("estado = ?")
+        params.append(estado)
+    if con_comprobante:
+        condiciones.append("(comprobante_recibido = 1 OR comprobante_url IS NOT NULL)")
+    return " AND ".join(condiciones), params
+
+
+def pagina_contactos(conn, nombre='', sufijo_telefono='', estado=None, con_comprobante=False,
+                     pagina=0, por_pagina=50):
+    """Una página de contactos filtrada sobre contact_summary; devuelve (contactos_df, total)"""
+    where, params = _filtros_contactos(nombre, sufijo_telefono, estado, con_comprobante)
+    query = f"""
+    {_SELECT_CONTACTO}
+    WHERE {where}
+    ORDER BY ultima_actividad DESC, numero_telefono DESC
+    LIMIT ? OFFSET ?
+    """
+    contactos_df = compactar(pd.read_sql_query(query, conn, params=params + [por_pagina, pagina * por_pagina]))
+    total = conn.execute(f"SELECT COUNT(*) FROM contact_summary WHERE {where}", params).fetchone()[0]
+    return contactos_df, total
+
+
+def estados_pedido(conn):
+    """Estados de pedido presentes en contact_summary"""
+    filas = conn.execute(
+        "SELECT DISTINCT estado FROM contact_summary WHERE estado IS NOT NULL ORDER BY estado"
+    ).fetchall()
+    return [fila[0] for fila in filas]
+
+
+def estadisticas_generales(conn, tiene_comprobante_recibido, fecha=None):
+    """Estadísticas del día; devuelve (stats_df, pedidos_df)"""
+    # Los días de meses archivados se leen del archivo mensual correspondiente
+    with archivo_bd.esquema_para_fecha(conn, fecha) as esquema:
+        return _estadisticas_dia(conn, esquema, tiene_comprobante_recibido, fecha)
+
+
+def _estadisticas_dia(conn, esquema, tiene_comprobante_recibido, fecha):
+    # Rango semiabierto del día para que el filtro use el índice por timestamp
+    inicio_dia, inicio_siguiente = rango_dia(fecha)
+
+    # Estadísticas de conversaciones (siempre disponible)
+    query_stats = f"""
+    SELECT
+        COUNT(DISTINCT numero_telefono) as conversaciones_hoy,
+        COUNT(*) as mensajes_hoy
+    FROM {esquema}.conversaciones
+    WHERE timestamp >= ? AND timestamp < ?
+    """
+    stats = pd.read_sql_query(query_stats, conn, params=[inicio_dia, inicio_siguiente])
+
+    # Estadísticas de pedidos (si la tabla existe)
+    comprobantes = (
+        "COUNT(CASE WHEN comprobante_recibido = 1 THEN 1 END)"
+        if tiene_comprobante_recibido else "0"
+    )
+    query_pedidos = f"""
+    SELECT
+        COUNT(*) as pedidos_hoy,
+        COALESCE(SUM(total), 0) as ventas_hoy,
+        {comprobantes} as comprobantes_recibidos,
+        COUNT(CASE WHEN estado = 'esperando_pago' THEN 1 END) as esperando_pago
+    FROM {esquema}.pedidos
+    WHERE timestamp >= ? AND timestamp < ?
+    """
+    try:
+        pedidos = pd.read_sql_query(query_pedidos, conn, params=[inicio_dia, inicio_siguiente])
+    except Exception:
+        # Si no existe la tabla pedidos
+        pedidos = pd.DataFrame([{
+            'pedidos_hoy': 0,
+            'ventas_hoy': 0,
+            'comprobantes_recibidos': 0,
+            'esperando_pago': 0
+        }])
+
+    return stats, pedidos
+
+
+def comprobantes_recientes(conn, limite=10):
+    """Últimos pedidos con comprobante (requiere la columna comprobante_url)"""
+    query = """
+    SELECT
+        id, numero_telefono, nombre_cliente, total,
+        comprobante_url, timestamp, estado
+    FROM pedidos
+    WHERE comprobante_url IS NOT NULL
+    ORDER BY timestamp DESC
+    LIMIT ?
+    """
+    return compactar(pd.read_sql_query(query, conn, params=[limite]))
+
+
+def totales(conn, tiene_comprobante_recibido):
+    """Totales históricos del pie de página: (mensajes, comprobantes recibidos)
+
+    Lee la tabla de contadores_bd; si todavía no está instalada, cuenta las tablas.
+    """
+    try:
+        contadores = dict(conn.execute("SELECT nombre, valor FROM contadores").fetchall())
+    except sqlite3.OperationalError:
+        contadores = None
+    if contadores is not None:
+        total_mensajes = contadores.get('mensajes', 0)
+        total_comprobantes = contadores.get('comprobantes', 0) if tiene_comprobante_recibido else None
+        return total_mensajes, total_comprobantes
+
+    total_mensajes = conn.execute("SELECT COUNT(*) FROM conversaciones").fetchone()[0]
+    total_comprobantes = None
+    if tiene_comprobante_recibido:
+        total_comprobantes = conn.execute(
+            "SELECT COUNT(*) FROM pedidos WHERE comprobante_recibido = 1"
+        ).fetchone()[0]
+    return total_mensajes, total_comprobantes
+
+
+def rollup_actividad(conn, granularidad, desde, hasta):
+    """Pedidos, ingresos, mensajes y contactos únicos por periodo en [desde, hasta)
+
+    `granularidad` es 'hora' o 'dia' y las fechas van como 'YYYY-MM-DD'
+    (comparables con ambos formatos de periodo); lee las tablas de rollups_bd.
+    """
+    tabla = 'rollup_horario' if granularidad == 'hora' else 'rollup_diario'
+    query = f"""
+    SELECT periodo, pedidos, ingresos, mensajes, contactos_unicos
+    FROM {tabla}
+    WHERE periodo >= ? AND periodo < ?
+    ORDER BY periodo
+    """
+    return pd.read_sql_query(query, conn, params=[desde, hasta])
+
+
+def rollup_productos(conn, granularidad, desde, hasta):
+    """Pedidos e ingresos por tamaño, agregado y bebida, sumados sobre [desde, hasta)"""
+    query = """
+    SELECT dimension, valor, SUM(pedidos) as pedidos, SUM(ingresos) as ingresos
+    FROM rollup_productos
+    WHERE granularidad = ? AND periodo >= ? AND periodo < ?
+    GROUP BY dimension, valor
+    ORDER BY dimension, pedidos DESC
+    """
+    return pd.read_sql_query(query, conn, params=[granularidad, desde, hasta])
+
+
+def columnas_exportacion(conn, tabla):
+    """Columnas de `tabla` que se exportan, en el orden de COLUMNAS_EXPORTACION"""
+    existentes = {col[1] for col in conn.execute(f"PRAGMA table_info({tabla})").fetchall()}
+    return [col for col in COLUMNAS_EXPORTACION[tabla] if col in existentes]
+
+
+def _como_fecha(valor):
+    return valor if isinstance(valor, date) else datetime.strptime(str(valor)[:10], '%Y-%m-%d').date()
+
+
+def _filtros_exportacion(tabla, desde, hasta, estados):
+    """Cláusulas y parámetros de los filtros de exportación (fechas inclusive)"""
+    condiciones, params = [], []
+    if desde:
+        condiciones.append("timestamp >= ?")
+        params.append(rango_dia(_como_fecha(desde))[0])
+    if hasta:
+        condiciones.append("timestamp < ?")
+        params.append(rango_dia(_como_fecha(hasta))[1])
+    if estados and tabla == 'pedidos':
+        condiciones.append(f"estado IN ({', '.join('?' * len(estados))})")
+        params.extend(estados)
+    return condiciones, params
+
+
+def _lotes_por_id(conn, origen, columnas, condiciones, params, lote):
+    """Lotes de filas de `origen` paginados por id, sin dejar abierta una transacción de lectura"""
+    query = f"SELECT {', '.join(columnas)} FROM {origen} WHERE " + ' AND '.join(['id > ?'] + condiciones)
+    query += " ORDER BY id LIMIT ?"
+    ultimo_id = 0
+    while True:
+        filas = conn.execute(query, [ultimo_id] + params + [lote]).fetchall()
+        if not filas:
+            return
+        yield filas
+        ultimo_id = filas[-1][0]
+        if len(filas) < lote:
+            return
+
+
+def contar_exportacion(conn, tabla, desde=None, hasta=None, estados=None):
+    """Filas que exportaría lotes_exportacion con los mismos filtros"""
+    if 'id' not in columnas_exportacion(conn, tabla):
+        return 0
+    condiciones, params = _filtros_exportacion(tabla, desde, hasta, estados)
+    donde = f" WHERE {' AND '.join(condiciones)}" if condiciones else ''
+    total = 0
+    for mes in archivo_bd.meses_archivados(archivo_bd.ruta_principal(conn) or ''):
+        if (desde and mes < str(desde)[:7]) or (hasta and mes > str(hasta)[:7]):
+            continue
+        with archivo_bd.adjuntar(conn, mes) as esquema:
+            if esquema is not None:
+                total += conn.execute(f"SELECT COUNT(*) FROM {esquema}.{tabla}{donde}", params).fetchone()[0]
+    return total + conn.execute(f"SELECT COUNT(*) FROM {tabla}{donde}", params).fetchone()[0]
+
+
+def lotes_exportacion(conn, tabla, desde=None, hasta=None, estados=None, lote=5000):
+    """Filas de pedidos o conversaciones en listas de hasta `lote` tuplas
+
+    Recorre primero los meses archivados que cruzan el rango y después la
+    base principal, cada uno en orden de id. `desde` y `hasta` son fechas
+    (date o 'YYYY-MM-DD', ambas inclusive) y `estados` solo filtra pedidos.
+    Las columnas son las de columnas_exportacion(conn, tabla).
+    """
+    columnas = columnas_exportacion(conn, tabla)
+    if 'id' not in columnas:
+        return
+    condiciones, params = _filtros_exportacion(tabla, desde, hasta, estados)
+    for mes in archivo_bd.meses_archivados(archivo_bd.ruta_principal(conn) or ''):
+        if (desde and mes < str(desde)[:7]) or (hasta and mes > str(hasta)[:7]):
+            continue
+        with archivo_bd.adjuntar(conn, mes) as esquema:
+            if esquema is not None:
+                yield from _lotes_por_id(conn, f"{esquema}.{tabla}", columnas, condiciones, params, lote)
+    yield from _lotes_por_id(conn, tabla, columnas, condiciones, params, lote)
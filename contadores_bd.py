@@ -0,0 +1,173 @@
+"""Tabla contadores: totales históricos mantenidos por triggers
+
+El pie de página del dashboard mostraba `COUNT(*)` sobre conversaciones y
+pedidos en cada refresco, que recorre la tabla completa. Estos contadores se
+incrementan al insertar (y al marcar comprobantes), así que leerlos es una
+búsqueda por clave primaria.
+
+Como contact_summary y los rollups, reflejan todo el historial: los borrados
+(por ejemplo los de archivo_bd al mover meses a sus archivos) no restan.
+
+Uso como script (recalcula desde la base principal y los archivos mensuales):
+
+    python contadores_bd.py --backfill [papanatas_chat.db]
+"""
+
+import re
+
+import archivo_bd
+
+TABLA = 'contadores'
+
+SQL_TABLA = f"""
+CREATE TABLE IF NOT EXISTS {TABLA} (
+    nombre TEXT PRIMARY KEY,
+    valor INTEGER NOT NULL DEFAULT 0
+) WITHOUT ROWID
+"""
+
+# Contador: consulta que lo calcula desde cero sobre un esquema
+CONTADORES = {
+    'mensajes': "SELECT COUNT(*) FROM {esquema}.conversaciones",
+    'pedidos': "SELECT COUNT(*) FROM {esquema}.pedidos",
+    'comprobantes': "SELECT COUNT(*) FROM {esquema}.pedidos WHERE comprobante_recibido = 1",
+}
+
+
+def _sumar(nombre, expresion):
+    return (f"INSERT INTO {TABLA} (nombre, valor) VALUES ('{nombre}', {expresion}) "
+            f"ON CONFLICT(nombre) DO UPDATE SET valor = valor + excluded.valor;")
+
+
+def _columnas_pedidos(conn):
+    return [col[1] for col in conn.execute("PRAGMA table_info(pedidos)").fetchall()]
+
+
+def _sql_triggers(columnas):
+    """Definición de los triggers; los de comprobantes solo si la columna ya existe"""
+    triggers = {
+        f'trg_{TABLA}_mensaje': f"""CREATE TRIGGER trg_{TABLA}_mensaje
+AFTER INSERT ON conversaciones
+BEGIN
+    {_sumar('mensajes', '1')}
+END""",
+        f'trg_{TABLA}_pedido': f"""CREATE TRIGGER trg_{TABLA}_pedido
+AFTER INSERT ON pedidos
+BEGIN
+    {_sumar('pedidos', '1')}
+END""",
+    }
+    if 'comprobante_recibido' in columnas:
+        triggers[f'trg_{TABLA}_comprobante_nuevo'] = f"""CREATE TRIGGER trg_{TABLA}_comprobante_nuevo
+AFTER INSERT ON pedidos
+WHEN NEW.comprobante_recibido = 1
+BEGIN
+    {_sumar('comprobantes', '1')}
+END"""
+        triggers[f'trg_{TABLA}_comprobante'] = f"""CREATE TRIGGER trg_{TABLA}_comprobante
+AFTER UPDATE OF comprobante_recibido ON pedidos
+WHEN COALESCE(OLD.comprobante_recibido = 1, 0) <> COALESCE(NEW.comprobante_recibido = 1, 0)
+BEGIN
+    {_sumar('comprobantes', "CASE WHEN NEW.comprobante_recibido = 1 THEN 1 ELSE -1 END")}
+END"""
+    return triggers
+
+
+def _normalizar(sql):
+    return re.sub(r'\s+', ' ', sql or '').strip()
+
+
+def _contar_archivos(conn, columnas):
+    """Totales de los meses archivados (ATTACH no se puede hacer dentro de una transacción)"""
+    totales = dict.fromkeys(CONTADORES, 0)
+    for mes in archivo_bd.meses_archivados(archivo_bd.ruta_principal(conn) or ''):
+        with archivo_bd.adjuntar(conn, mes) as esquema:
+            if esquema is None:
+                continue
+            for nombre, sql in CONTADORES.items():
+                if nombre == 'comprobantes' and 'comprobante_recibido' not in columnas:
+                    continue
+                totales[nombre] += conn.execute(sql.format(esquema=esquema)).fetchone()[0]
+    return totales
+
+
+def backfill(conn, en_transaccion=False, archivados=None):
+    """Recalcula los contadores desde la base principal más los meses archivados
+
+    Con `en_transaccion` quien llama ya abrió la transacción, y debe pasar en
+    `archivados` lo que devolvió _contar_archivos antes de abrirla.
+    """
+    columnas = _columnas_pedidos(conn)
+    if archivados is None:
+        archivados = _contar_archivos(conn, columnas)
+    if not en_transaccion:
+        conn.commit()
+        conn.execute("BEGIN IMMEDIATE")
+    try:
+        conn.execute(f"DELETE FROM {TABLA}")
+        for nombre, sql in CONTADORES.items():
+            if nombre == 'comprobantes' and 'comprobante_recibido' not in columnas:
+                continue
+            valor = conn.execute(sql.format(esquema='main')).fetchone()[0] + archivados[nombre]
+            conn.execute(f"INSERT INTO {TABLA} (nombre, valor) VALUES (?, ?)", [nombre, valor])
+        if not en_transaccion:
+            conn.commit()
+    except Exception:
+        if not en_transaccion:
+            conn.rollback()
+        raise
+    return dict(conn.execute(f"SELECT nombre, valor FROM {TABLA}").fetchall())
+
+
+def instalar(conn):
+    """Crea la tabla y sus triggers (o los actualiza si aparecieron columnas en pedidos)
+
+    Devuelve 'ok', 'creada' si hubo que crearla y calcular los totales, o
+    'pendiente' si el bot todavía no creó las tablas base.
+    """
+    existentes = {
+        (fila[0], fila[1]): fila[2] for fila in conn.execute(
+            "SELECT type, name, sql FROM sqlite_master WHERE type IN ('table', 'trigger')"
+        ).fetchall()
+    }
+    if ('table', 'conversaciones') not in existentes or ('table', 'pedidos') not in existentes:
+        return 'pendiente'
+
+    columnas = _columnas_pedidos(conn)
+    triggers = _sql_triggers(columnas)
+    nueva = ('table', TABLA) not in existentes
+    cambios = {
+        nombre: sql for nombre, sql in triggers.items()
+        if _normalizar(existentes.get(('trigger', nombre))) != _normalizar(sql)
+    }
+    if not nueva and not cambios:
+        return 'ok'
+
+    # Triggers y totales en la misma transacción: ninguna escritura del bot queda sin contar
+    archivados = _contar_archivos(conn, columnas)
+    conn.commit()
+    conn.execute("BEGIN IMMEDIATE")
+    try:
+        conn.execute(SQL_TABLA)
+        for nombre, sql in cambios.items():
+            conn.execute(f"DROP TRIGGER IF EXISTS {nombre}")
+            conn.execute(sql)
+        backfill(conn, en_transaccion=True, archivados=archivados)
+        conn.commit()
+    except Exception:
+        conn.rollback()
+        raise
+    return 'creada' if nueva else 'ok'
+
+
+if __name__ == '__main__':
+    import sqlite3
+    import sys
+
+    argumentos = [a for a in sys.argv[1:] if not a.startswith('--')]
+    ruta = argumentos[0] if argumentos else 'papanatas_chat.db'
+    conexion = sqlite3.connect(ruta)
+    print(f"Instalación: {instalar(conexion)}")
+    if '--backfill' in sys.argv:
+        for nombre, valor in backfill(conexion).items():
+            print(f"✅ {nombre}: {valor}")
@@ -0,0 +1,379 @@
+"""Embudo de conversación: hasta qué paso llegan los clientes y cuánto tardan en cada uno
+
+Cada fila de `conversaciones` guarda el `step` en que quedó la sesión del bot
+después del mensaje. Un *recorrido* empieza cuando el bot pide el nombre
+(esperando_nombre) y dura hasta que el mismo cliente empieza otro. Una
+*visita* a un paso va desde el mensaje que dejó la sesión en ese paso hasta
+el primero que la dejó en otro.
+
+Se actualiza de forma incremental desde un watermark, como rollups_bd: las
+filas nuevas se ordenan por contacto y los cambios de paso se detectan con
+operaciones vectorizadas de pandas (shift/cumsum por contacto). Los resultados
+quedan en tablas compactas:
+
+- embudo_recorridos: recorridos cerrados por día de inicio y etapa máxima alcanzada
+- embudo_tiempos: visitas cerradas por día, paso y cubeta de duración
+- embudo_contactos: el recorrido abierto de cada contacto (paso actual y desde cuándo)
+
+Uso como script:
+
+    python embudo_bd.py [--reconstruir] [papanatas_chat.db]
+"""
+
+from datetime import datetime, timedelta
+
+import numpy as np
+import pandas as pd
+
+# Etapas del embudo en el orden del flujo de index.js
+ETAPAS = [
+    'esperando_nombre',
+    'esperando_tamaño',
+    'esperando_agregado_opcion',
+    'esperando_bebida',
+    'esperando_confirmacion_final',
+    'esperando_comprobante',
+    'pedido_completado',
+]
+PASO_INICIO = ETAPAS[0]
+PASO_FINAL = ETAPAS[-1]
+ETAPA_FINAL = len(ETAPAS) - 1
+
+# Etapa de cada paso: los pasos secundarios cuentan en la etapa a la que pertenecen
+ETAPA_DE_PASO = {paso: etapa for etapa, paso in enumerate(ETAPAS)}
+ETAPA_DE_PASO.update({
+    'esperando_tipo_agregado': 2,
+    'esperando_tipo_extra_premium': 2,
+    'modificando_pedido': 4,
+    'esperando_tamaño_modificacion': 4,
+    'preguntando_cambio_agregado': 4,
+})
+
+# Tope (segundos) de cada cubeta de duración; la última cubeta no tiene tope
+CUBETAS = [10, 30, 60, 120, 300, 600, 1800, 3600, 7200, 86400]
+
+# Un recorrido abierto sin actividad por más de esto cuenta como abandonado
+ABANDONO = timedelta(hours=2)
+
+FORMATO = '%Y-%m-%d %H:%M:%S'
+
+SQL_TABLAS = [
+    """CREATE TABLE IF NOT EXISTS embudo_estado (
+    tabla TEXT PRIMARY KEY,
+    ultimo_id INTEGER NOT NULL DEFAULT 0
+)""",
+    """CREATE TABLE IF NOT EXISTS embudo_contactos (
+    numero_telefono TEXT PRIMARY KEY,
+    dia TEXT NOT NULL,
+    etapa_maxima INTEGER NOT NULL,
+    step TEXT NOT NULL,
+    entrada TEXT NOT NULL,
+    ultima_actividad TEXT NOT NULL
+)""",
+    """CREATE TABLE IF NOT EXISTS embudo_recorridos (
+    dia TEXT NOT NULL,
+    etapa_maxima INTEGER NOT NULL,
+    recorridos INTEGER NOT NULL DEFAULT 0,
+    PRIMARY KEY (dia, etapa_maxima)
+)""",
+    """CREATE TABLE IF NOT EXISTS embudo_tiempos (
+    dia TEXT NOT NULL,
+    step TEXT NOT NULL,
+    cubeta INTEGER NOT NULL,
+    visitas INTEGER NOT NULL DEFAULT 0,
+    segundos INTEGER NOT NULL DEFAULT 0,
+    PRIMARY KEY (dia, step, cubeta)
+)""",
+]
+
+
+def instalar(conn):
+    """Crea las tablas del embudo; devuelve 'pendiente' si el bot aún no creó conversaciones"""
+    fila = conn.execute(
+        "SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = 'conversaciones'"
+    ).fetchone()
+    if fila is None:
+        return 'pendiente'
+    for sql in SQL_TABLAS:
+        conn.execute(sql)
+    conn.commit()
+    return 'ok'
+
+
+def _watermark(conn):
+    fila = conn.execute("SELECT ultimo_id FROM embudo_estado WHERE tabla = 'conversaciones'").fetchone()
+    return fila[0] if fila else 0
+
+
+def _texto(momentos):
+    return momentos.dt.strftime(FORMATO)
+
+
+def _leer_lote(conn, desde_id, hasta_id):
+    """Filas nuevas y el recorrido abierto de sus contactos, ordenadas por contacto
+
+    El recorrido abierto entra como una fila previa (id -1) con el paso actual
+    y la hora en que el contacto llegó a él, para cerrar bien su visita.
+    """
+    nuevos = pd.read_sql_query(
+        "SELECT id, numero_telefono, timestamp, step FROM conversaciones "
+        "WHERE id > ? AND id <= ? AND timestamp IS NOT NULL",
+        conn, params=[desde_id, hasta_id]
+    )
+    if nuevos.empty:
+        return nuevos, pd.DataFrame()
+    conn.execute("CREATE TEMP TABLE IF NOT EXISTS _embudo_numeros (numero_telefono TEXT PRIMARY KEY)")
+    conn.execute("DELETE FROM temp._embudo_numeros")
+    conn.executemany(
+        "INSERT INTO temp._embudo_numeros (numero_telefono) VALUES (?)",
+        [(numero,) for numero in nuevos['numero_telefono'].unique()]
+    )
+    estado = pd.read_sql_query(
+        "SELECT c.* FROM embudo_contactos c JOIN temp._embudo_numeros USING (numero_telefono)", conn
+    ).set_index('numero_telefono')
+    previos = pd.DataFrame({
+        'id': -1,
+        'numero_telefono': estado.index,
+        'timestamp': estado['entrada'].to_numpy(),
+        'step': estado['step'].to_numpy(),
+    })
+    filas = pd.concat([previos, nuevos], ignore_index=True)
+    filas['step'] = filas['step'].fillna('')
+    filas['momento'] = pd.to_datetime(filas['timestamp'], format=FORMATO, errors='coerce')
+    filas = filas[filas['momento'].notna()]
+    return filas.sort_values(['numero_telefono', 'id'], kind='stable', ignore_index=True), estado
+
+
+def _visitas(filas):
+    """Una fila por visita a un paso, con su inicio, su fin (NaT si sigue abierta) y su recorrido"""
+    numeros = filas['numero_telefono']
+    primera = numeros.ne(numeros.shift())
+    cambio = primera | filas['step'].ne(filas['step'].shift())
+    visitas = filas.loc[cambio, ['numero_telefono', 'id', 'step', 'momento']].reset_index(drop=True)
+    visitas['primera'] = primera[cambio].to_numpy()
+
+    siguiente_mismo = visitas['numero_telefono'].eq(visitas['numero_telefono'].shift(-1))
+    visitas['fin'] = visitas['momento'].shift(-1).where(siguiente_mismo)
+    visitas['etapa'] = visitas['step'].map(ETAPA_DE_PASO)
+
+    # Empieza un recorrido cada vez que el bot pide el nombre, y también la primera
+    # visita de un contacto sin recorrido abierto (historial anterior a la instalación)
+    nueva = visitas['id'].ne(-1)
+    visitas['inicio'] = nueva & (visitas['step'].eq(PASO_INICIO) | visitas['primera'])
+    visitas['recorrido'] = visitas['inicio'].astype(int).groupby(visitas['numero_telefono']).cumsum()
+    return visitas
+
+
+def _acumular_tiempos(conn, visitas):
+    """Suma a embudo_tiempos las visitas cerradas (la de pedido_completado no tiene duración útil)"""
+    cerradas = visitas[visitas['fin'].notna() & visitas['step'].ne(PASO_FINAL) & visitas['step'].ne('')]
+    if cerradas.empty:
+        return 0
+    segundos = (cerradas['fin'] - cerradas['momento']).dt.total_seconds().clip(lower=0)
+    tiempos = pd.DataFrame({
+        'dia': cerradas['momento'].dt.strftime('%Y-%m-%d'),
+        'step': cerradas['step'],
+        'cubeta': np.searchsorted(CUBETAS, segundos.to_numpy(), side='left'),
+        'segundos': segundos.round().astype('int64'),
+    }).groupby(['dia', 'step', 'cubeta'], as_index=False).agg(
+        visitas=('segundos', 'size'), segundos=('segundos', 'sum')
+    )
+    conn.executemany(
+        "INSERT INTO embudo_tiempos (dia, step, cubeta, visitas, segundos) VALUES (?, ?, ?, ?, ?) "
+        "ON CONFLICT(dia, step, cubeta) DO UPDATE SET "
+        "visitas = visitas + excluded.visitas, segundos = segundos + excluded.segundos",
+        tiempos[['dia', 'step', 'cubeta', 'visitas', 'segundos']].itertuples(index=False, name=None)
+    )
+    return len(cerradas)
+
+
+def _acumular_recorridos(conn, filas, visitas, estado):
+    """Cierra en embudo_recorridos los recorridos que terminaron y guarda el abierto de cada contacto"""
+    recorridos = visitas.groupby(['numero_telefono', 'recorrido'], sort=False).agg(
+        momento=('momento', 'first'), etapa_maxima=('etapa', 'max'),
+        step=('step', 'last'), entrada=('momento', 'last')
+    ).reset_index()
+    recorridos['dia'] = recorridos['momento'].dt.strftime('%Y-%m-%d')
+
+    # El recorrido 0 es el que ya estaba abierto: conserva su día y su etapa máxima
+    continua = recorridos['recorrido'].eq(0)
+    if continua.any():
+        previo = estado.loc[recorridos.loc[continua, 'numero_telefono']]
+        recorridos.loc[continua, 'dia'] = previo['dia'].to_numpy()
+        recorridos.loc[continua, 'etapa_maxima'] = np.fmax(
+            recorridos.loc[continua, 'etapa_maxima'].to_numpy(dtype=float),
+            previo['etapa_maxima'].to_numpy(dtype=float)
+        )
+    recorridos['etapa_maxima'] = recorridos['etapa_maxima'].fillna(-1).astype('int64')
+
+    ultimo = recorridos.groupby('numero_telefono')['recorrido'].transform('max')
+    cerrados = recorridos[recorridos['recorrido'] < ultimo]
+    if not cerrados.empty:
+        conteo = cerrados.groupby(['dia', 'etapa_maxima'], as_index=False).size()
+        conn.executemany(
+            "INSERT INTO embudo_recorridos (dia, etapa_maxima, recorridos) VALUES (?, ?, ?) "
+            "ON CONFLICT(dia, etapa_maxima) DO UPDATE SET recorridos = recorridos + excluded.recorridos",
+            conteo[['dia', 'etapa_maxima', 'size']].itertuples(index=False, name=None)
+        )
+
+    abiertos = recorridos[recorridos['recorrido'] == ultimo].set_index('numero_telefono')
+    ultima = filas.groupby('numero_telefono')['momento'].max()
+    if not estado.empty:
+        # Los timestamps no siempre crecen con el id: se conserva el mayor visto
+        anterior = pd.to_datetime(estado['ultima_actividad'], format=FORMATO).reindex(ultima.index)
+        ultima = ultima.where(anterior.isna() | (ultima >= anterior), anterior)
+    abiertos['ultima_actividad'] = ultima
+    conn.executemany(
+        "INSERT OR REPLACE INTO embudo_contactos "
+        "(numero_telefono, dia, etapa_maxima, step, entrada, ultima_actividad) VALUES (?, ?, ?, ?, ?, ?)",
+        zip(abiertos.index, abiertos['dia'], abiertos['etapa_maxima'].tolist(), abiertos['step'],
+            _texto(abiertos['entrada']), _texto(abiertos['ultima_actividad']))
+    )
+    return len(cerrados)
+
+
+def actualizar(conn, lote=100000):
+    """Incorpora al embudo las filas nuevas desde el último watermark, en lotes de `lote` ids
+
+    Cada lote es una transacción. Devuelve {'conversaciones': n, 'recorridos': n,
+    'visitas': n} con las filas procesadas y los recorridos y visitas cerrados.
+    """
+    resultado = {'conversaciones': 0, 'recorridos': 0, 'visitas': 0}
+    conn.commit()
+    while True:
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            desde_id = _watermark(conn)
+            # sqlite_sequence conserva el último id aunque archivo_bd haya movido las filas
+            hasta_id = conn.execute(
+                "SELECT MAX(COALESCE((SELECT seq FROM sqlite_sequence WHERE name = 'conversaciones'), 0), "
+                "COALESCE((SELECT MAX(id) FROM conversaciones), 0))"
+            ).fetchone()[0]
+            if hasta_id < desde_id:
+                # Base recreada: el embudo ya no corresponde, se reconstruye completo
+                conn.rollback()
+                return reconstruir(conn, lote)
+            tope = min(hasta_id, desde_id + lote)
+            filas, estado = _leer_lote(conn, desde_id, tope)
+            if not filas.empty:
+                visitas = _visitas(filas)
+                resultado['visitas'] += _acumular_tiempos(conn, visitas)
+                resultado['recorridos'] += _acumular_recorridos(conn, filas, visitas, estado)
+                resultado['conversaciones'] += int(filas['id'].ne(-1).sum())
+            conn.execute(
+                "INSERT INTO embudo_estado (tabla, ultimo_id) VALUES ('conversaciones', ?) "
+                "ON CONFLICT(tabla) DO UPDATE SET ultimo_id = excluded.ultimo_id",
+                [tope]
+            )
+            conn.commit()
+        except Exception:
+            conn.rollback()
+            raise
+        if tope >= hasta_id:
+            return resultado
+
+
+def reconstruir(conn, lote=100000):
+    """Vacía el embudo y lo recalcula desde cero (solo con lo que queda en la base principal)"""
+    conn.commit()
+    conn.execute("BEGIN IMMEDIATE")
+    try:
+        for tabla in ('embudo_estado', 'embudo_contactos', 'embudo_recorridos', 'embudo_tiempos'):
+            conn.execute(f"DELETE FROM {tabla}")
+        conn.commit()
+    except Exception:
+        conn.rollback()
+        raise
+    return actualizar(conn, lote)
+
+
+def embudo(conn, desde, hasta, ahora=None):
+    """Recorridos iniciados en [desde, hasta) (días 'YYYY-MM-DD'), una fila por etapa
+
+    - llegaron: recorridos que alcanzaron la etapa
+    - conversion: fracción de los que llegaron a la etapa anterior
+    - abandonos: se quedaron en esa etapa (cerrados sin completar, o abiertos y
+      sin actividad por más de ABANDONO)
+    - en_curso: abiertos, recientes y todavía en esa etapa
+    """
+    ahora = ahora or datetime.now()
+    cerrados = pd.read_sql_query(
+        "SELECT etapa_maxima, SUM(recorridos) AS recorridos FROM embudo_recorridos "
+        "WHERE dia >= ? AND dia < ? AND etapa_maxima >= 0 GROUP BY etapa_maxima",
+        conn, params=[desde, hasta]
+    ).set_index('etapa_maxima')['recorridos']
+    abiertos = pd.read_sql_query(
+        "SELECT etapa_maxima, COUNT(*) AS recorridos, "
+        "SUM(ultima_actividad >= ? AND etapa_maxima < ?) AS en_curso FROM embudo_contactos "
+        "WHERE dia >= ? AND dia < ? AND etapa_maxima >= 0 GROUP BY etapa_maxima",
+        conn, params=[(ahora - ABANDONO).strftime(FORMATO), ETAPA_FINAL, desde, hasta]
+    ).set_index('etapa_maxima')
+
+    etapas = pd.RangeIndex(len(ETAPAS))
+    # Sin filas en el rango las columnas llegan como object: se fuerzan a enteros
+    cerrados = cerrados.reindex(etapas, fill_value=0).to_numpy(dtype='int64')
+    total_abiertos = abiertos['recorridos'].reindex(etapas, fill_value=0).to_numpy(dtype='int64')
+    en_curso = abiertos['en_curso'].reindex(etapas, fill_value=0).to_numpy(dtype='int64')
+    # Cada recorrido cuenta en su etapa máxima y en todas las anteriores
+    llegaron = (cerrados + total_abiertos)[::-1].cumsum()[::-1]
+    abandonos = cerrados + total_abiertos - en_curso
+    abandonos[ETAPA_FINAL] = 0
+    anteriores = np.concatenate([[llegaron[0]], llegaron[:-1]])
+    conversion = np.divide(llegaron, anteriores, out=np.full(len(ETAPAS), np.nan), where=anteriores > 0)
+    return pd.DataFrame({
+        'etapa': etapas,
+        'step': ETAPAS,
+        'llegaron': llegaron,
+        'conversion': conversion,
+        'abandonos': abandonos,
+        'en_curso': en_curso,
+    })
+
+
+def tiempos(conn, desde, hasta, cuantiles=(0.5, 0.9)):
+    """Tiempo en cada paso de las visitas iniciadas en [desde, hasta)
+
+    Una fila por paso con visitas, media en segundos y cada cuantil como el
+    tope de la cubeta que lo contiene (inf si cae en la última, sin tope).
+    """
+    df = pd.read_sql_query(
+        "SELECT step, cubeta, SUM(visitas) AS visitas, SUM(segundos) AS segundos FROM embudo_tiempos "
+        "WHERE dia >= ? AND dia < ? GROUP BY step, cubeta",
+        conn, params=[desde, hasta]
+    )
+    columnas = ['step', 'visitas', 'media_s'] + [f"p{int(q * 100)}_s" for q in cuantiles]
+    if df.empty:
+        return pd.DataFrame(columns=columnas)
+    histograma = df.set_index(['step', 'cubeta'])['visitas'].unstack(fill_value=0)
+    histograma = histograma.reindex(columns=range(len(CUBETAS) + 1), fill_value=0)
+    acumulado = histograma.to_numpy().cumsum(axis=1)
+    visitas = acumulado[:, -1]
+    topes = np.array(CUBETAS + [np.inf], dtype=float)
+    resultado = pd.DataFrame({
+        'step': histograma.index,
+        'visitas': visitas,
+        'media_s': df.groupby('step')['segundos'].sum().to_numpy() / visitas,
+    })
+    for q in cuantiles:
+        # Primera cubeta donde el acumulado alcanza el cuantil
+        posicion = (acumulado >= q * visitas[:, None]).argmax(axis=1)
+        resultado[f"p{int(q * 100)}_s"] = topes[posicion]
+    orden = resultado['step'].map(ETAPA_DE_PASO).fillna(len(ETAPAS))
+    return resultado.assign(_orden=orden).sort_values(['_orden', 'step']).drop(columns='_orden')[columnas]
+
+
+if __name__ == '__main__':
+    import sqlite3
+    import sys
+
+    argumentos = [a for a in sys.argv[1:] if not a.startswith('--')]
+    ruta = argumentos[0] if argumentos else 'papanatas_chat.db'
+    conexion = sqlite3.connect(ruta)
+    estado = instalar(conexion)
+    print(f"Instalación: {estado}")
+    if estado == 'ok':
+        resumen = reconstruir(conexion) if '--reconstruir' in sys.argv else actualizar(conexion)
+        print(f"✅ {resumen['conversaciones']} mensajes nuevos, {resumen['recorridos']} recorridos "
+              f"y {resumen['visitas']} visitas cerradas")
+        hoy = datetime.now().date()
+        print(embudo(conexion, '0000-00-00', (hoy + timedelta(days=1)).strftime('%Y-%m-%d')).to_string(index=False))
@@ -0,0 +1,220 @@
+"""Exportación de pedidos y conversaciones a CSV o Parquet, por lotes
+
+Lee con consultas_bd.lotes_exportacion (paginación por id, incluidos los
+meses archivados) y escribe cada lote apenas llega: la memoria no depende del
+tamaño del historial y la descarga empieza enseguida.
+
+- CSV: un bloque de texto por lote
+- Parquet: un row group por lote (requiere pyarrow, que ya instala Streamlit)
+
+Uso como script:
+
+    python exportar_bd.py pedidos [--formato csv|parquet] [--desde 2025-01-01] [--hasta 2025-01-31]
+                         [--estado pagado ...] [--salida pedidos.csv] [--bd papanatas_chat.db]
+
+También sirve las exportaciones por HTTP (ver `iniciar_servidor`); el
+dashboard lo levanta solo si se define PAPANATAS_EXPORTAR_PUERTO.
+"""
+
+import csv
+import io
+import sqlite3
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlparse
+
+import consultas_bd
+
+TABLAS = tuple(consultas_bd.COLUMNAS_EXPORTACION)
+FORMATOS = ('csv', 'parquet')
+
+TIPOS_MIME = {
+    'csv': 'text/csv; charset=utf-8',
+    'parquet': 'application/vnd.apache.parquet',
+}
+
+# Filas por lote (y por row group en Parquet)
+LOTE = 5000
+
+# Columnas enteras; el resto se exporta como texto tal como está en SQLite
+COLUMNAS_ENTERAS = {'id', 'total', 'bebida', 'comprobante_recibido'}
+
+
+def nombre_archivo(tabla, formato, desde=None, hasta=None):
+    """Nombre sugerido para la descarga, ej. pedidos_2025-01-01_2025-01-31.csv"""
+    partes = [tabla] + [str(fecha)[:10] for fecha in (desde, hasta) if fecha]
+    return f"{'_'.join(partes)}.{formato}"
+
+
+def trozos_csv(conn, tabla, desde=None, hasta=None, estados=None, lote=LOTE):
+    """Genera el CSV en bloques de bytes (UTF-8 con BOM, para que Excel respete los acentos)"""
+    columnas = consultas_bd.columnas_exportacion(conn, tabla)
+    buffer = io.StringIO()
+    escritor = csv.writer(buffer)
+    buffer.write('﻿')
+    escritor.writerow(columnas)
+    for filas in consultas_bd.lotes_exportacion(conn, tabla, desde, hasta, estados, lote):
+        escritor.writerows(filas)
+        yield buffer.getvalue().encode('utf-8')
+        buffer.seek(0)
+        buffer.truncate()
+    if buffer.tell():
+        yield buffer.getvalue().encode('utf-8')
+
+
+def _esquema_parquet(columnas):
+    import pyarrow as pa
+    return pa.schema([
+        (col, pa.int64() if col in COLUMNAS_ENTERAS else pa.string()) for col in columnas
+    ])
+
+
+def escribir_parquet(conn, salida, tabla, desde=None, hasta=None, estados=None, lote=LOTE):
+    """Escribe el Parquet en `salida` (ruta o archivo binario), un row group por lote"""
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+
+    columnas = consultas_bd.columnas_exportacion(conn, tabla)
+    esquema = _esquema_parquet(columnas)
+    filas_escritas = 0
+    with pq.ParquetWriter(salida, esquema, compression='zstd') as escritor:
+        for filas in consultas_bd.lotes_exportacion(conn, tabla, desde, hasta, estados, lote):
+            valores = list(zip(*filas))
+            escritor.write_table(pa.Table.from_arrays(
+                [pa.array(valores[i], type=esquema.field(i).type) for i in range(len(columnas))],
+                schema=esquema
+            ))
+            filas_escritas += len(filas)
+    return filas_escritas
+
+
+def escribir_csv(conn, salida, tabla, desde=None, hasta=None, estados=None, lote=LOTE):
+    """Escribe el CSV en `salida` (archivo binario); devuelve los bytes escritos"""
+    escritos = 0
+    for trozo in trozos_csv(conn, tabla, desde, hasta, estados, lote):
+        salida.write(trozo)
+        escritos += len(trozo)
+    return escritos
+
+
+def exportar(ruta_bd, destino, tabla, formato='csv', desde=None, hasta=None, estados=None):
+    """Exporta `tabla` de la base `ruta_bd` al archivo `destino`"""
+    if tabla not in TABLAS:
+        raise ValueError(f"Tabla no exportable: {tabla}")
+    if formato not in FORMATOS:
+        raise ValueError(f"Formato no soportado: {formato}")
+    conn = sqlite3.connect(ruta_bd, timeout=30)
+    try:
+        with open(destino, 'wb') as salida:
+            if formato == 'parquet':
+                return escribir_parquet(conn, salida, tabla, desde, hasta, estados)
+            return escribir_csv(conn, salida, tabla, desde, hasta, estados)
+    finally:
+        conn.close()
+
+
+class _SalidaChunked(io.RawIOBase):
+    """Archivo de solo escritura que envía cada write como un chunk HTTP"""
+
+    def __init__(self, wfile):
+        self.wfile = wfile
+        self.posicion = 0
+
+    def writable(self):
+        return True
+
+    def write(self, datos):
+        datos = bytes(datos)
+        if datos:
+            self.wfile.write(f"{len(datos):X}\r\n".encode('ascii') + datos + b"\r\n")
+            self.posicion += len(datos)
+        return len(datos)
+
+    def tell(self):
+        return self.posicion
+
+
+def iniciar_servidor(ruta_bd, puerto, host='127.0.0.1'):
+    """Sirve /exportar en un hilo de fondo; devuelve el servidor
+
+    No autentica: cualquiera que llegue al puerto descarga todo el historial.
+
+    Parámetros de la URL: tabla, formato, desde, hasta y estado (repetible),
+    ej. /exportar?tabla=pedidos&formato=csv&desde=2025-01-01&estado=pagado
+    """
+
+    class Manejador(BaseHTTPRequestHandler):
+        protocol_version = 'HTTP/1.1'
+
+        def do_GET(self):
+            url = urlparse(self.path)
+            if url.path != '/exportar':
+                self.send_error(404)
+                return
+            parametros = parse_qs(url.query)
+
+            def valor(nombre, defecto=None):
+                return parametros.get(nombre, [defecto])[0] or defecto
+
+            tabla, formato = valor('tabla', 'pedidos'), valor('formato', 'csv')
+            desde, hasta, estados = valor('desde'), valor('hasta'), parametros.get('estado')
+            if tabla not in TABLAS or formato not in FORMATOS:
+                self.send_error(400, "tabla o formato inválido")
+                return
+
+            conn = sqlite3.connect(ruta_bd, timeout=30)
+            try:
+                self.send_response(200)
+                self.send_header('Content-Type', TIPOS_MIME[formato])
+                self.send_header('Content-Disposition',
+                                 f'attachment; filename="{nombre_archivo(tabla, formato, desde, hasta)}"')
+                self.send_header('Transfer-Encoding', 'chunked')
+                self.send_header('Connection', 'close')
+                self.end_headers()
+                salida = _SalidaChunked(self.wfile)
+                if formato == 'parquet':
+                    escribir_parquet(conn, salida, tabla, desde, hasta, estados)
+                else:
+                    escribir_csv(conn, salida, tabla, desde, hasta, estados)
+                self.wfile.write(b"0\r\n\r\n")
+            except (BrokenPipeError, ConnectionResetError):
+                # El cliente canceló la descarga
+                pass
+            except Exception as e:
+                print(f"Error exportando {tabla}: {e}")
+            finally:
+                conn.close()
+                self.close_connection = True
+
+        def log_message(self, *args):
+            pass
+
+    servidor = ThreadingHTTPServer((host, puerto), Manejador)
+    threading.Thread(target=servidor.serve_forever, name='exportacion', daemon=True).start()
+    return servidor
+
+
+if __name__ == '__main__':
+    import argparse
+    import sys
+
+    parser = argparse.ArgumentParser(description="Exporta pedidos o conversaciones a CSV o Parquet")
+    parser.add_argument('tabla', choices=TABLAS)
+    parser.add_argument('--formato', choices=FORMATOS, default='csv')
+    parser.add_argument('--desde', help="Fecha inicial AAAA-MM-DD (inclusive)")
+    parser.add_argument('--hasta', help="Fecha final AAAA-MM-DD (inclusive)")
+    parser.add_argument('--estado', action='append', help="Estado de pedido (repetible)")
+    parser.add_argument('--salida', help="Archivo de salida ('-' para stdout, solo CSV)")
+    parser.add_argument('--bd', default='papanatas_chat.db')
+    args = parser.parse_args()
+
+    salida = args.salida or nombre_archivo(args.tabla, args.formato, args.desde, args.hasta)
+    if salida == '-':
+        if args.formato != 'csv':
+            parser.error("stdout solo está disponible para CSV")
+        conexion = sqlite3.connect(args.bd, timeout=30)
+        escribir_csv(conexion, sys.stdout.buffer, args.tabla, args.desde, args.hasta, args.estado)
+    else:
+        resultado = exportar(args.bd, salida, args.tabla, args.formato, args.desde, args.hasta, args.estado)
+        unidad = 'filas' if args.formato == 'parquet' else 'bytes'
+        print(f"✅ {args.tabla} exportado a {salida} ({resultado} {unidad})")
@@ -0,0 +1,343 @@
+"""Generador de bases sintéticas con el esquema del bot (index.js)
+
+Simula clientes que conversan con el bot en ráfagas de mensajes siguiendo
+los mismos pasos (`step`) que index.js, con el `session_data` que guarda el
+bot y un pedido por cada confirmación (en estado esperando_pago o
+comprobante_recibido). Se usa para medir el dashboard con volúmenes reales.
+
+Uso como script:
+
+    python generar_datos.py 100000 [--salida papanatas_bench.db] [--dias 90] [--semilla 1]
+"""
+
+import json
+import os
+import random
+import sqlite3
+import time
+from datetime import datetime, timedelta, timezone
+
+# Esquema tal como lo deja index.js (tablas base + columnas de comprobante)
+SQL_ESQUEMA = [
+    """CREATE TABLE IF NOT EXISTS conversaciones (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    numero_telefono TEXT NOT NULL,
+    timestamp DATETIME DEFAULT CURRENT_TIMESTAMP,
+    mensaje_usuario TEXT,
+    mensaje_bot TEXT,
+    step TEXT,
+    session_data TEXT
+  )""",
+    """CREATE TABLE IF NOT EXISTS pedidos (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    numero_telefono TEXT NOT NULL,
+    nombre_cliente TEXT,
+    tamaño TEXT,
+    agregado TEXT,
+    bebida BOOLEAN,
+    total INTEGER,
+    timestamp DATETIME DEFAULT CURRENT_TIMESTAMP,
+    estado TEXT DEFAULT 'esperando_pago'
+  )""",
+    "ALTER TABLE pedidos ADD COLUMN comprobante_recibido BOOLEAN DEFAULT 0",
+    "ALTER TABLE pedidos ADD COLUMN comprobante_url TEXT",
+]
+
+# Datos del negocio (mismos precios que index.js)
+PRECIOS_PAPAS = {'M': 2500, 'L': 3000, 'XL': 3400}
+PRECIOS_AGREGADO = {
+    'premium': {'M': 800, 'L': 1000, 'XL': 1200},
+    'extra_premium': {'M': 1100, 'L': 1300, 'XL': 1500},
+}
+PRECIO_BEBIDA = 1200
+
+NOMBRES = [
+    'Camila', 'Benjamín', 'Valentina', 'Matías', 'Sofía', 'Vicente', 'Isidora', 'Agustín',
+    'Martina', 'Tomás', 'Florencia', 'Joaquín', 'Antonella', 'Cristóbal', 'Javiera', 'Diego',
+    'Catalina', 'Felipe', 'Fernanda', 'Sebastián', 'Constanza', 'Nicolás', 'Josefa', 'Ignacio'
+]
+APELLIDOS = ['', '', ' González', ' Muñoz', ' Rojas', ' Díaz', ' Pérez', ' Soto', ' Contreras']
+
+MENSAJE_BEBIDA = "¿Deseas bebida en lata (350cc) por $1200? 🥤\n\n1️⃣ Sí\n2️⃣ No\n\nResponde con *1* o *2*"
+MENSAJE_AGREGADO = "¿Deseas un agregado? 🧀🥓\n\n1️⃣ Sí\n2️⃣ No\n\nResponde con *1* o *2*"
+
+# Probabilidad de abandonar la conversación en cada paso
+ABANDONO = {
+    'esperando_nombre': 0.08,
+    'esperando_tamaño': 0.06,
+    'esperando_agregado_opcion': 0.04,
+    'esperando_bebida': 0.04,
+    'esperando_confirmacion_final': 0.08,
+    'esperando_comprobante': 0.25,
+}
+
+
+def calcular_total(pedido):
+    """Igual que calcularTotal() del bot (la combinación de agregados no suma precio)"""
+    total = PRECIOS_PAPAS.get(pedido['tamaño'], 0)
+    agregado = pedido.get('agregado')
+    if isinstance(agregado, str):
+        total += PRECIOS_AGREGADO[agregado][pedido['tamaño']]
+    if pedido['bebida']:
+        total += PRECIO_BEBIDA
+    return total
+
+
+def _texto_agregado(agregado):
+    # node-sqlite3 guarda los arreglos como su texto separado por comas
+    return ','.join(agregado) if isinstance(agregado, list) else agregado
+
+
+def _rafaga(rng, numero, nombre, inicio, siguiente_pedido):
+    """Una conversación completa (o abandonada) de un cliente
+
+    Devuelve (mensajes, pedido) con mensajes como lista de
+    (timestamp, mensaje_usuario, mensaje_bot, step, session) y el pedido
+    como dict o None si no llegó a confirmarse.
+    """
+    # Cada ráfaga parte con la sesión inicial del bot
+    sesion = {
+        'step': 'inicio',
+        'pedido': {'nombre': '', 'tamaño': None, 'agregado': None, 'bebida': False},
+        'pedidoId': None
+    }
+    pedido = sesion['pedido']
+    momento = inicio
+    mensajes = []
+    pedido_creado = None
+
+    def responder(usuario, bot, step):
+        nonlocal momento
+        sesion['step'] = step
+        mensajes.append((momento, usuario, bot, step, json.dumps(sesion, ensure_ascii=False, separators=(',', ':'))))
+        # El cliente tarda entre unos segundos y un par de minutos en contestar
+        momento += timedelta(seconds=rng.randint(4, 120))
+
+    responder(rng.choice(['hola', 'Hola', 'buenas', 'hola!']),
+              "👋 Hola, somos *Papanatas SPA* 🍟\n\n¿Cómo te llamas?\n✍️ Escribe tu nombre:",
+              'esperando_nombre')
+
+    while True:
+        step = sesion['step']
+        if rng.random() < ABANDONO.get(step, 0):
+            break
+        # De vez en cuando el cliente responde algo inválido
+        if step not in ('esperando_nombre', 'esperando_comprobante') and rng.random() < 0.05:
+            responder('no sé', "❌ Opción no válida. Responde con *1* o *2*", step)
+            continue
+
+        if step == 'esperando_nombre':
+            pedido['nombre'] = nombre
+            responder(nombre,
+                      f"¡Hola {nombre}! 😊\n\nSelecciona el tamaño de tus papas:\n"
+                      "1️⃣ M (200 grs - $2.500)\n2️⃣ L (250 grs - $3.000)\n3️⃣ XL (300 grs - $3.400)\n\n"
+                      "Responde con *1*, *2* o *3*",
+                      'esperando_tamaño')
+        elif step == 'esperando_tamaño':
+            opcion = rng.choices(['1', '2', '3'], weights=[3, 4, 2])[0]
+            pedido['tamaño'] = {'1': 'M', '2': 'L', '3': 'XL'}[opcion]
+            responder(opcion, MENSAJE_AGREGADO, 'esperando_agregado_opcion')
+        elif step == 'esperando_agregado_opcion':
+            if rng.random() < 0.55:
+                responder('1', "Selecciona el agregado:\n\n1️⃣ Premium\n2️⃣ Extra Premium\n\n"
+                               "3️⃣ Premium + Extra Premium\n\nResponde con 1, 2 o 3",
+                          'esperando_tipo_agregado')
+            else:
+                pedido['agregado'] = None
+                responder('2', MENSAJE_BEBIDA, 'esperando_bebida')
+        elif step == 'esperando_tipo_agregado':
+            opcion = rng.choices(['1', '2', '3'], weights=[5, 3, 2])[0]
+            if opcion == '1':
+                pedido['agregado'] = 'premium'
+                responder(opcion, MENSAJE_BEBIDA, 'esperando_bebida')
+            else:
+                pedido['agregado'] = 'extra_premium' if opcion == '2' else ['premium', 'extra_premium']
+                responder(opcion, "¿Qué agregado Extra Premium prefieres?\n\n1️⃣ Carne mechada\n"
+                                  "2️⃣ Pulled Pork\n\nResponde con 1 o 2",
+                          'esperando_tipo_extra_premium')
+        elif step == 'esperando_tipo_extra_premium':
+            opcion = rng.choice(['1', '2'])
+            pedido['tipo_extra'] = 'Carne mechada' if opcion == '1' else 'Pulled Pork'
+            responder(opcion, MENSAJE_BEBIDA, 'esperando_bebida')
+        elif step == 'esperando_bebida':
+            opcion = rng.choice(['1', '2'])
+            pedido['bebida'] = opcion == '1'
+            responder(opcion, f"📋 *Resumen de tu pedido*\n\n🍟 Papas {pedido['tamaño']}\n"
+                              f"💰 *Total: ${calcular_total(pedido)}*\n\n1️⃣ Confirmar\n2️⃣ Modificar",
+                      'esperando_confirmacion_final')
+        elif step == 'esperando_confirmacion_final':
+            sesion['pedidoId'] = siguiente_pedido
+            pedido_creado = {
+                'id': siguiente_pedido,
+                'timestamp': momento,
+                'nombre_cliente': pedido['nombre'],
+                'tamaño': pedido['tamaño'],
+                'agregado': _texto_agregado(pedido['agregado']),
+                'bebida': 1 if pedido['bebida'] else 0,
+                'total': calcular_total(pedido),
+                'estado': 'esperando_pago',
+                'comprobante_recibido': 0,
+                'comprobante_url': None,
+            }
+            responder('1', f"💳 *Datos para transferencia*\n\nTotal: ${pedido_creado['total']}\n\n"
+                           "📸 Envía una foto del comprobante", 'esperando_comprobante')
+        elif step == 'esperando_comprobante':
+            pedido_creado['estado'] = 'comprobante_recibido'
+            pedido_creado['comprobante_recibido'] = 1
+            if rng.random() < 0.7:
+                pedido_creado['comprobante_url'] = (
+                    f"https://api.twilio.com/2010-04-01/Accounts/AC{rng.getrandbits(64):016x}"
+                    f"/Messages/MM{rng.getrandbits(64):016x}/Media/ME{rng.getrandbits(64):016x}"
+                )
+                usuario = ''
+            else:
+                usuario = 'enviado'
+            responder(usuario, f"✅ *¡Comprobante recibido!*\n\nGracias {pedido['nombre']} 🙌",
+                      'pedido_completado')
+            break
+        else:
+            break
+
+    return mensajes, pedido_creado
+
+
+def generar(ruta, filas, dias=90, semilla=1, lote=50_000):
+    """Crea `ruta` con aproximadamente `filas` mensajes repartidos en los últimos `dias`
+
+    Devuelve {'conversaciones', 'pedidos', 'contactos', 'segundos'}.
+    """
+    inicio_generacion = time.perf_counter()
+    if os.path.exists(ruta):
+        os.remove(ruta)
+    for sufijo in ('-wal', '-shm'):
+        if os.path.exists(ruta + sufijo):
+            os.remove(ruta + sufijo)
+
+    rng = random.Random(semilla)
+    conn = sqlite3.connect(ruta)
+    conn.execute("PRAGMA journal_mode = WAL")
+    conn.execute("PRAGMA synchronous = OFF")
+    for sql in SQL_ESQUEMA:
+        conn.execute(sql)
+
+    # ~40 mensajes por cliente en promedio; unos pocos clientes concentran muchas visitas
+    clientes = [
+        (f"whatsapp:+569{rng.randint(10_000_000, 99_999_999)}",
+         rng.choice(NOMBRES) + rng.choice(APELLIDOS))
+        for _ in range(max(1, filas // 40))
+    ]
+    pesos = [1 / (i + 1) ** 0.8 for i in range(len(clientes))]
+
+    ahora = datetime.now(timezone.utc).replace(tzinfo=None, microsecond=0)
+    primer_dia = (ahora - timedelta(days=dias - 1)).replace(hour=0, minute=0, second=0)
+    # Mensajes por ráfaga observados hasta ahora (se ajusta para repartir las filas en todos los días)
+    mensajes_por_rafaga = 8.0
+    total_rafagas = 0
+
+    total_mensajes = 0
+    total_pedidos = 0
+    contactos = set()
+    siguiente_mensaje = 1
+    siguiente_pedido = 1
+    dia = 0
+    while total_mensajes < filas:
+        # Si al llegar a hoy todavía faltan filas, el resto se agrega en el día actual
+        inicio_dia = primer_dia + timedelta(days=min(dia, dias - 1))
+        limite_dia = ahora if dia >= dias - 1 else inicio_dia + timedelta(days=1)
+        segundos_dia = max(1, int((limite_dia - inicio_dia).total_seconds()))
+        # Hoy solo cuenta la fracción del día ya transcurrida
+        fraccion_hoy = max(0.05, (ahora - ahora.replace(hour=0, minute=0, second=0)).total_seconds() / 86400)
+        fraccion_dia = 1.0 if dia < dias - 1 else fraccion_hoy
+        dias_restantes = max(0, dias - 1 - dia) + fraccion_hoy
+        rafagas_por_dia = (filas - total_mensajes) / mensajes_por_rafaga * fraccion_dia / dias_restantes
+        cantidad = max(1, int(rng.gauss(rafagas_por_dia, rafagas_por_dia * 0.2)))
+
+        mensajes_dia = []
+        pedidos_dia = []
+        for numero, nombre in rng.choices(clientes, weights=pesos, k=cantidad):
+            inicio = inicio_dia + timedelta(seconds=rng.randrange(segundos_dia))
+            # Id provisorio (único en el día): el definitivo se asigna por timestamp más abajo
+            provisorio = siguiente_pedido + len(pedidos_dia)
+            mensajes, pedido = _rafaga(rng, numero, nombre, inicio, provisorio)
+            for momento, usuario, bot, step, sesion in mensajes:
+                mensajes_dia.append((momento, numero, usuario, bot, step, sesion))
+            if pedido is not None:
+                pedido['numero_telefono'] = numero
+                pedidos_dia.append(pedido)
+            contactos.add(numero)
+
+        # El bot inserta en orden de llegada: ids crecientes con el timestamp,
+        # también en pedidos (el último pedido por id es el más reciente)
+        pedidos_dia.sort(key=lambda pedido: pedido['timestamp'])
+        # pedidoId es la última clave de cada sesión: se reemplaza el final '"pedidoId":N}'
+        finales = {}
+        for pedido in pedidos_dia:
+            finales[f'"pedidoId":{pedido["id"]}}}'] = f'"pedidoId":{siguiente_pedido}}}'
+            pedido['id'] = siguiente_pedido
+            siguiente_pedido += 1
+        for i, (momento, numero, usuario, bot, step, sesion) in enumerate(mensajes_dia):
+            final = sesion[sesion.rfind('"pedidoId":'):]
+            if final in finales:
+                mensajes_dia[i] = (momento, numero, usuario, bot, step, sesion[:-len(final)] + finales[final])
+        mensajes_dia.sort(key=lambda fila: fila[0])
+        mensajes_dia = mensajes_dia[:filas - total_mensajes]
+        for inicio_lote in range(0, len(mensajes_dia), lote):
+            conn.executemany(
+                "INSERT INTO conversaciones (id, timestamp, numero_telefono, mensaje_usuario, "
+                "mensaje_bot, step, session_data) VALUES (?, ?, ?, ?, ?, ?, ?)",
+                [
+                    (siguiente_mensaje + i, momento.strftime('%Y-%m-%d %H:%M:%S'), *resto)
+                    for i, (momento, *resto) in enumerate(
+                        mensajes_dia[inicio_lote:inicio_lote + lote]
+                    )
+                ]
+            )
+            siguiente_mensaje += len(mensajes_dia[inicio_lote:inicio_lote + lote])
+        conn.executemany(
+            "INSERT INTO pedidos (id, numero_telefono, nombre_cliente, tamaño, agregado, bebida, "
+            "total, timestamp, estado, comprobante_recibido, comprobante_url) "
+            "VALUES (:id, :numero_telefono, :nombre_cliente, :tamaño, :agregado, :bebida, "
+            ":total, :timestamp, :estado, :comprobante_recibido, :comprobante_url)",
+            [
+                dict(pedido, timestamp=pedido['timestamp'].strftime('%Y-%m-%d %H:%M:%S'))
+                for pedido in pedidos_dia
+            ]
+        )
+        conn.commit()
+        total_rafagas += cantidad
+        mensajes_por_rafaga = (total_mensajes + len(mensajes_dia)) / total_rafagas
+        total_mensajes += len(mensajes_dia)
+        total_pedidos += len(pedidos_dia)
+        dia += 1
+
+    conn.close()
+    return {
+        'conversaciones': total_mensajes,
+        'pedidos': total_pedidos,
+        'contactos': len(contactos),
+        'segundos': time.perf_counter() - inicio_generacion,
+    }
+
+
+def interpretar_tamano(texto):
+    """'10k' -> 10000, '1m' -> 1000000"""
+    texto = str(texto).strip().lower().replace('_', '')
+    multiplicadores = {'k': 1_000, 'm': 1_000_000}
+    if texto and texto[-1] in multiplicadores:
+        return int(float(texto[:-1]) * multiplicadores[texto[-1]])
+    return int(texto)
+
+
+if __name__ == '__main__':
+    import argparse
+
+    parser = argparse.ArgumentParser(description="Genera una base sintética con el esquema del bot")
+    parser.add_argument('filas', help="Cantidad de mensajes (ej. 10k, 1m)")
+    parser.add_argument('--salida', default='papanatas_bench.db')
+    parser.add_argument('--dias', type=int, default=90)
+    parser.add_argument('--semilla', type=int, default=1)
+    args = parser.parse_args()
+
+    resumen = generar(args.salida, interpretar_tamano(args.filas), args.dias, args.semilla)
+    print(f"✅ {args.salida}: {resumen['conversaciones']} mensajes, {resumen['pedidos']} pedidos, "
+          f"{resumen['contactos']} contactos en {resumen['segundos']:.1f}s")
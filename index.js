@@ -8,20 +8,57 @@ const path = require("path");
 const app = express();
 app.use(bodyParser.urlencoded({ extended: false }));
 
-const client = twilio(
-  process.env.TWILIO_ACCOUNT_SID,
-  process.env.TWILIO_AUTH_TOKEN
-);
+// Cliente mínimo para un servidor compatible con la API REST de Twilio
+// (ej. el stub de carga_webhook.py para pruebas de carga)
+function clienteTwilioLocal(baseUrl, accountSid, authToken) {
+  if (typeof fetch !== 'function') {
+    throw new Error(`TWILIO_API_URL requiere Node.js 18 o superior (fetch global); versión actual ${process.version}`);
+  }
+  const url = `${baseUrl.replace(/\/$/, '')}/2010-04-01/Accounts/${accountSid}/Messages.json`;
+  const autorizacion = 'Basic ' + Buffer.from(`${accountSid}:${authToken}`).toString('base64');
+  return {
+    messages: {
+      create: async ({ body, from, to }) => {
+        const respuesta = await fetch(url, {
+          method: 'POST',
+          headers: { 'Authorization': autorizacion },
+          body: new URLSearchParams({ Body: body, From: from, To: to })
+        });
+        if (!respuesta.ok) {
+          throw new Error(`Twilio local respondió ${respuesta.status}`);
+        }
+        return respuesta.json();
+      }
+    }
+  };
+}
 
-// Configurar base de datos SQLite
-const dbPath = path.join(__dirname, 'papanatas_chat.db');
+const client = process.env.TWILIO_API_URL
+  ? clienteTwilioLocal(
+      process.env.TWILIO_API_URL,
+      process.env.TWILIO_ACCOUNT_SID || 'ACcarga',
+      process.env.TWILIO_AUTH_TOKEN || 'carga'
+    )
+  : twilio(
+      process.env.TWILIO_ACCOUNT_SID,
+      process.env.TWILIO_AUTH_TOKEN
+    );
+
+// Configurar base de datos SQLite (PAPANATAS_DB permite usar otra, ej. en pruebas de carga)
+const dbPath = process.env.PAPANATAS_DB || path.join(__dirname, 'papanatas_chat.db');
 const db = new sqlite3.Database(dbPath);
+// Esperar en vez de fallar si el dashboard está leyendo o creando índices
+db.configure("busyTimeout", 5000);
 
 // Variable para verificar si las columnas existen
 let tieneColumnasComprobante = false;
+let tieneSesionId = false;
 
 // *** INICIALIZACIÓN MEJORADA DE LA BASE DE DATOS ***
 db.serialize(() => {
+  // WAL: los lectores del dashboard no bloquean las escrituras del bot
+  db.run("PRAGMA journal_mode = WAL");
+
   // Crear tabla de conversaciones
   db.run(`CREATE TABLE IF NOT EXISTS conversaciones (
     id INTEGER PRIMARY KEY AUTOINCREMENT,
@@ -46,6 +83,35 @@ db.serialize(() => {
     estado TEXT DEFAULT 'esperando_pago'
   )`);
 
+  // Estado de la sesión normalizado: una fila por combinación distinta (ver sesiones_bd.py)
+  db.run(`CREATE TABLE IF NOT EXISTS sesiones (
+    id INTEGER PRIMARY KEY,
+    nombre_cliente TEXT NOT NULL DEFAULT '',
+    tamaño TEXT NOT NULL DEFAULT '',
+    agregado TEXT NOT NULL DEFAULT '',
+    bebida INTEGER NOT NULL DEFAULT 0,
+    tipo_extra TEXT NOT NULL DEFAULT '',
+    pedido_id INTEGER NOT NULL DEFAULT 0,
+    UNIQUE (nombre_cliente, tamaño, agregado, bebida, tipo_extra, pedido_id)
+  )`);
+
+  db.all("PRAGMA table_info(conversaciones)", (err, columns) => {
+    if (!err && columns) {
+      if (columns.some(col => col.name === 'sesion_id')) {
+        tieneSesionId = true;
+      } else {
+        db.run(`ALTER TABLE conversaciones ADD COLUMN sesion_id INTEGER`, (alterErr) => {
+          if (!alterErr) {
+            console.log('✅ Columna sesion_id agregada');
+            tieneSesionId = true;
+          } else {
+            console.log('⚠️ Error agregando sesion_id:', alterErr.message);
+          }
+        });
+      }
+    }
+  });
+
   // Verificar y agregar columnas faltantes
   db.all("PRAGMA table_info(pedidos)", (err, columns) => {
     if (!err && columns) {
@@ -98,138 +164,273 @@ db.serialize(() => {
   });
 });
 
-// *** FUNCIONES DE BASE DE DATOS COMPATIBLES ***
+// *** COLA DE ESCRITURA (GROUP COMMIT) ***
+// Cada escritura del bot (mensajes, pedidos, estados) entra a una cola que se
+// guarda en una sola transacción cada PAPANATAS_ESCRITURA_MS milisegundos o
+// al juntar PAPANATAS_ESCRITURA_LOTE filas: un fsync por lote en vez de uno por
+// mensaje, y el lock de escritura se toma una vez por lote. Las sentencias se
+// preparan una sola vez y se reutilizan. Cada escritura devuelve una promesa
+// que se resuelve cuando su lote hizo COMMIT (ver carga_escritura.py).
+class ColaEscritura {
+  constructor(db, { intervaloMs = 5, maxFilas = 200 } = {}) {
+    this.db = db;
+    this.intervaloMs = intervaloMs;
+    this.maxFilas = maxFilas;
+    this.pendientes = [];
+    this.sentencias = new Map();
+    this.temporizador = null;
+    this.escribiendo = false;
+    this.esperandoVaciado = [];
+    this.estadisticas = { lotes: 0, filas: 0, errores: 0, filasMaxLote: 0, ultimoLoteMs: 0 };
+  }
 
-function guardarMensaje(numeroTelefono, mensajeUsuario, mensajeBot, step, sessionData = null) {
-  const stmt = db.prepare(`INSERT INTO conversaciones 
-    (numero_telefono, mensaje_usuario, mensaje_bot, step, session_data) 
-    VALUES (?, ?, ?, ?, ?)`);
-  
-  stmt.run(
-    numeroTelefono, 
-    mensajeUsuario, 
-    mensajeBot, 
-    step, 
-    sessionData ? JSON.stringify(sessionData) : null,
-    (err) => {
-      if (err) {
-        console.error('Error guardando mensaje:', err.message);
+  // Sentencia preparada por SQL (se prepara la primera vez que se usa)
+  sentencia(sql) {
+    let stmt = this.sentencias.get(sql);
+    if (!stmt) {
+      stmt = this.db.prepare(sql);
+      this.sentencias.set(sql, stmt);
+    }
+    return stmt;
+  }
+
+  // Encola una escritura; resuelve { lastID, changes } cuando su lote hizo COMMIT
+  encolar(sql, params) {
+    return new Promise((resolve, reject) => {
+      this.pendientes.push({ sql, params, resolve, reject });
+      if (this.pendientes.length >= this.maxFilas) {
+        this.vaciar();
+      } else if (!this.temporizador && !this.escribiendo) {
+        this.temporizador = setTimeout(() => this.vaciar(), this.intervaloMs);
       }
+    });
+  }
+
+  // Escribe lo pendiente en una transacción (si hay un lote en curso, sigue al terminar)
+  vaciar() {
+    clearTimeout(this.temporizador);
+    this.temporizador = null;
+    if (this.escribiendo || this.pendientes.length === 0) {
+      if (!this.escribiendo) this.avisarVaciado();
+      return;
     }
-  );
-  stmt.finalize();
-}
+    this.escribiendo = true;
+    const lote = this.pendientes.splice(0, this.maxFilas);
+    const inicio = Date.now();
+    let errorBegin = null;
+
+    // Cada sentencia corre en el callback de la anterior: el orden de la cola se
+    // respeta aunque sean sentencias preparadas distintas
+    const ejecutar = (indice) => {
+      if (indice === lote.length) {
+        this.db.run("COMMIT", terminar);
+        return;
+      }
+      const op = lote[indice];
+      this.sentencia(op.sql).run(op.params, function (err) {
+        op.error = err;
+        op.resultado = err ? null : { lastID: this.lastID, changes: this.changes };
+        ejecutar(indice + 1);
+      });
+    };
 
-function guardarPedido(numeroTelefono, pedido) {
-  return new Promise((resolve, reject) => {
-    // Usar la estructura básica que siempre existe
-    const stmt = db.prepare(`INSERT INTO pedidos 
-      (numero_telefono, nombre_cliente, tamaño, agregado, bebida, total, estado) 
-      VALUES (?, ?, ?, ?, ?, ?, ?)`);
-    
-    stmt.run(
-      numeroTelefono,
-      pedido.nombre,
-      pedido.tamaño,
-      pedido.agregado,
-      pedido.bebida ? 1 : 0,
-      calcularTotal(pedido),
-      'esperando_pago',
-      function(err) {
-        if (err) {
-          console.error('Error guardando pedido:', err.message);
-          reject(err);
+    const terminar = (err) => {
+      // Sin BEGIN cada sentencia ya se guardó por su cuenta y el COMMIT falla sin importar
+      const errorCommit = errorBegin ? null : err;
+      if (errorCommit) {
+        this.db.run("ROLLBACK", () => {});
+      }
+      for (const op of lote) {
+        const error = errorCommit || op.error;
+        if (error) {
+          this.estadisticas.errores++;
+          op.reject(error);
         } else {
-          console.log('✅ Pedido guardado con ID:', this.lastID);
-          resolve(this.lastID);
+          op.resolve(op.resultado);
         }
       }
-    );
-    stmt.finalize();
+      this.estadisticas.lotes++;
+      this.estadisticas.filas += lote.length;
+      this.estadisticas.filasMaxLote = Math.max(this.estadisticas.filasMaxLote, lote.length);
+      this.estadisticas.ultimoLoteMs = Date.now() - inicio;
+      this.escribiendo = false;
+
+      if (this.pendientes.length >= this.maxFilas || this.esperandoVaciado.length) {
+        this.vaciar();
+      } else if (this.pendientes.length) {
+        this.temporizador = setTimeout(() => this.vaciar(), this.intervaloMs);
+      }
+    };
+
+    this.db.run("BEGIN IMMEDIATE", (err) => {
+      errorBegin = err;
+      ejecutar(0);
+    });
+  }
+
+  avisarVaciado() {
+    const esperando = this.esperandoVaciado.splice(0);
+    esperando.forEach((resolve) => resolve());
+  }
+
+  // Escribe todo lo pendiente y libera las sentencias (al cerrar el proceso)
+  cerrar() {
+    return new Promise((resolve) => {
+      this.esperandoVaciado.push(resolve);
+      this.vaciar();
+    }).then(() => Promise.all(
+      [...this.sentencias.values()].map((stmt) => new Promise((resolve) => stmt.finalize(resolve)))
+    )).then(() => {
+      this.sentencias.clear();
+    });
+  }
+}
+
+const colaEscritura = new ColaEscritura(db, {
+  intervaloMs: parseInt(process.env.PAPANATAS_ESCRITURA_MS) || 5,
+  maxFilas: parseInt(process.env.PAPANATAS_ESCRITURA_LOTE) || 200
+});
+
+// *** FUNCIONES DE BASE DE DATOS COMPATIBLES ***
+
+// Valores de la sesión tal como se guardan en la tabla sesiones
+function valoresSesion(sessionData) {
+  const pedido = sessionData.pedido || {};
+  const agregado = Array.isArray(pedido.agregado) ? JSON.stringify(pedido.agregado) : (pedido.agregado || '');
+  return [
+    pedido.nombre || '',
+    pedido.tamaño || '',
+    agregado,
+    pedido.bebida ? 1 : 0,
+    pedido.tipo_extra || '',
+    sessionData.pedidoId || 0
+  ];
+}
+
+const SQL_MENSAJE_JSON = `INSERT INTO conversaciones 
+  (numero_telefono, mensaje_usuario, mensaje_bot, step, session_data) 
+  VALUES (?, ?, ?, ?, ?)`;
+
+const SQL_SESION = `INSERT INTO sesiones 
+  (nombre_cliente, tamaño, agregado, bebida, tipo_extra, pedido_id) 
+  VALUES (?, ?, ?, ?, ?, ?) 
+  ON CONFLICT DO NOTHING`;
+
+const SQL_MENSAJE_SESION = `INSERT INTO conversaciones 
+  (numero_telefono, mensaje_usuario, mensaje_bot, step, sesion_id) 
+  VALUES (?, ?, ?, ?, (SELECT id FROM sesiones 
+    WHERE nombre_cliente = ? AND tamaño = ? AND agregado = ? 
+      AND bebida = ? AND tipo_extra = ? AND pedido_id = ?))`;
+
+const SQL_PEDIDO = `INSERT INTO pedidos 
+  (numero_telefono, nombre_cliente, tamaño, agregado, bebida, total, estado) 
+  VALUES (?, ?, ?, ?, ?, ?, ?)`;
+
+// Con el id del pedido de la sesión se actualiza por clave primaria; sin él
+// (ej. el INSERT del pedido falló) se busca el último pedido del número
+const CONDICION_PEDIDO = `WHERE numero_telefono = ? 
+  AND id = COALESCE(?, (
+    SELECT MAX(id) FROM pedidos 
+    WHERE numero_telefono = ?
+  ))`;
+
+const SQL_ESTADO_COMPLETO = `UPDATE pedidos 
+  SET estado = ?, comprobante_recibido = ? 
+  ${CONDICION_PEDIDO}`;
+
+const SQL_ESTADO_BASICO = `UPDATE pedidos 
+  SET estado = ? 
+  ${CONDICION_PEDIDO}`;
+
+const SQL_COMPROBANTE_URL = `UPDATE pedidos 
+  SET comprobante_url = ? 
+  ${CONDICION_PEDIDO}`;
+
+function guardarMensaje(numeroTelefono, mensajeUsuario, mensajeBot, step, sessionData = null) {
+  if (!sessionData || !tieneSesionId) {
+    // Sin sesión o columna sesion_id aún no disponible: JSON completo como antes
+    colaEscritura.encolar(SQL_MENSAJE_JSON, [
+      numeroTelefono,
+      mensajeUsuario,
+      mensajeBot,
+      step,
+      sessionData ? JSON.stringify(sessionData) : null
+    ]).catch((err) => {
+      console.error('Error guardando mensaje:', err.message);
+    });
+    return;
+  }
+
+  // Sesión normalizada: se reutiliza la fila si la combinación ya existe.
+  // La cola mantiene el orden, así que la sesión se inserta antes que el mensaje
+  const valores = valoresSesion(sessionData);
+  colaEscritura.encolar(SQL_SESION, valores).catch((err) => {
+    console.error('Error guardando sesión:', err.message);
+  });
+  colaEscritura.encolar(SQL_MENSAJE_SESION, [numeroTelefono, mensajeUsuario, mensajeBot, step, ...valores])
+    .catch((err) => {
+      console.error('Error guardando mensaje:', err.message);
+    });
+}
+
+function guardarPedido(numeroTelefono, pedido) {
+  // Usar la estructura básica que siempre existe
+  return colaEscritura.encolar(SQL_PEDIDO, [
+    numeroTelefono,
+    pedido.nombre,
+    pedido.tamaño,
+    pedido.agregado,
+    pedido.bebida ? 1 : 0,
+    calcularTotal(pedido),
+    'esperando_pago'
+  ]).then(({ lastID }) => {
+    console.log('✅ Pedido guardado con ID:', lastID);
+    return lastID;
+  }, (err) => {
+    console.error('Error guardando pedido:', err.message);
+    throw err;
   });
 }
 
 // *** FUNCIÓN COMPATIBLE PARA ACTUALIZAR ESTADO ***
-function actualizarEstadoPedido(numeroTelefono, estado, comprobanteRecibido = false) {
-  return new Promise((resolve, reject) => {
-    if (tieneColumnasComprobante) {
-      // Usar versión completa si las columnas existen
-      const stmt = db.prepare(`UPDATE pedidos 
-        SET estado = ?, comprobante_recibido = ? 
-        WHERE numero_telefono = ? 
-        AND id = (
-          SELECT MAX(id) FROM pedidos 
-          WHERE numero_telefono = ?
-        )`);
-      
-      stmt.run(estado, comprobanteRecibido ? 1 : 0, numeroTelefono, numeroTelefono, (err) => {
-        if (err) {
-          console.error('Error actualizando estado completo:', err.message);
-          // Fallback a versión básica
-          actualizarEstadoBasico(numeroTelefono, estado).then(resolve).catch(reject);
-        } else {
-          console.log(`✅ Estado actualizado (completo): ${estado}, Comprobante: ${comprobanteRecibido}`);
-          resolve();
-        }
-      });
-      stmt.finalize();
-    } else {
-      // Usar solo estado básico
-      actualizarEstadoBasico(numeroTelefono, estado).then(resolve).catch(reject);
-    }
+function actualizarEstadoPedido(numeroTelefono, pedidoId, estado, comprobanteRecibido = false) {
+  if (!tieneColumnasComprobante) {
+    // Usar solo estado básico
+    return actualizarEstadoBasico(numeroTelefono, pedidoId, estado);
+  }
+  // Usar versión completa si las columnas existen
+  return colaEscritura.encolar(
+    SQL_ESTADO_COMPLETO, [estado, comprobanteRecibido ? 1 : 0, numeroTelefono, pedidoId || null, numeroTelefono]
+  ).then(() => {
+    console.log(`✅ Estado actualizado (completo): ${estado}, Comprobante: ${comprobanteRecibido}`);
+  }, (err) => {
+    console.error('Error actualizando estado completo:', err.message);
+    // Fallback a versión básica
+    return actualizarEstadoBasico(numeroTelefono, pedidoId, estado);
   });
 }
 
-function actualizarEstadoBasico(numeroTelefono, estado) {
-  return new Promise((resolve, reject) => {
-    const stmt = db.prepare(`UPDATE pedidos 
-      SET estado = ? 
-      WHERE numero_telefono = ? 
-      AND id = (
-        SELECT MAX(id) FROM pedidos 
-        WHERE numero_telefono = ?
-      )`);
-    
-    stmt.run(estado, numeroTelefono, numeroTelefono, (err) => {
-      if (err) {
-        console.error('Error actualizando estado básico:', err.message);
-        reject(err);
-      } else {
-        console.log(`✅ Estado actualizado (básico): ${estado}`);
-        resolve();
-      }
-    });
-    stmt.finalize();
+function actualizarEstadoBasico(numeroTelefono, pedidoId, estado) {
+  return colaEscritura.encolar(SQL_ESTADO_BASICO, [estado, numeroTelefono, pedidoId || null, numeroTelefono]).then(() => {
+    console.log(`✅ Estado actualizado (básico): ${estado}`);
+  }, (err) => {
+    console.error('Error actualizando estado básico:', err.message);
+    throw err;
   });
 }
 
 // *** FUNCIÓN COMPATIBLE PARA GUARDAR URL ***
-function guardarComprobanteUrl(numeroTelefono, mediaUrl) {
-  return new Promise((resolve, reject) => {
-    if (tieneColumnasComprobante) {
-      const stmt = db.prepare(`UPDATE pedidos 
-        SET comprobante_url = ? 
-        WHERE numero_telefono = ? 
-        AND id = (
-          SELECT MAX(id) FROM pedidos 
-          WHERE numero_telefono = ?
-        )`);
-      
-      stmt.run(mediaUrl, numeroTelefono, numeroTelefono, (err) => {
-        if (err) {
-          console.error('Error guardando URL del comprobante:', err.message);
-          reject(err);
-        } else {
-          console.log('✅ URL del comprobante guardada:', mediaUrl);
-          resolve();
-        }
-      });
-      stmt.finalize();
-    } else {
-      // Si no tiene la columna, solo lo loguea y continúa
-      console.log('⚠️ URL del comprobante no guardada (columna no existe):', mediaUrl);
-      resolve();
-    }
+function guardarComprobanteUrl(numeroTelefono, pedidoId, mediaUrl) {
+  if (!tieneColumnasComprobante) {
+    // Si no tiene la columna, solo lo loguea y continúa
+    console.log('⚠️ URL del comprobante no guardada (columna no existe):', mediaUrl);
+    return Promise.resolve();
+  }
+  return colaEscritura.encolar(SQL_COMPROBANTE_URL, [mediaUrl, numeroTelefono, pedidoId || null, numeroTelefono]).then(() => {
+    console.log('✅ URL del comprobante guardada:', mediaUrl);
+  }, (err) => {
+    console.error('Error guardando URL del comprobante:', err.message);
+    throw err;
   });
 }
 
@@ -494,10 +695,12 @@ case "esperando_tipo_extra_premium":
             
             try {
               // Actualizar estado (compatible con ambas versiones de BD)
-              await actualizarEstadoPedido(from, 'comprobante_recibido', true);
-              
-              // Guardar URL si es posible
-              await guardarComprobanteUrl(from, mediaUrls[0]);
+              // Ambas van en el mismo lote de la cola: se esperan juntas
+              await Promise.all([
+                actualizarEstadoPedido(from, session.pedidoId, 'comprobante_recibido', true),
+                // Guardar URL si es posible
+                guardarComprobanteUrl(from, session.pedidoId, mediaUrls[0])
+              ]);
               
               response = mensajeComprobanteRecibido(pedido.nombre);
               session.step = "pedido_completado";
@@ -529,7 +732,7 @@ case "esperando_tipo_extra_premium":
               msgLower.includes('transferido') || msgLower.includes('pagado')) {
             // Confirmación por texto
             try {
-              await actualizarEstadoPedido(from, 'comprobante_recibido', true);
+              await actualizarEstadoPedido(from, session.pedidoId, 'comprobante_recibido', true);
               response = mensajeComprobanteRecibido(pedido.nombre);
               session.step = "pedido_completado";
             } catch (dbError) {
@@ -716,6 +919,7 @@ app.get("/api/estado", (req, res) => {
     estado: "activo",
     base_datos: "conectada",
     columnas_comprobante: tieneColumnasComprobante,
+    cola_escritura: { ...colaEscritura.estadisticas, pendientes: colaEscritura.pendientes.length },
     timestamp: new Date().toISOString()
   });
 });
@@ -743,24 +947,36 @@ app.get("/", (req, res) => {
 });
 
 const PORT = process.env.PORT || 3000;
-app.listen(PORT, () => {
+const servidor = app.listen(PORT, () => {
   console.log(`✅ Servidor Papanatas SPA activo en puerto ${PORT}`);
   console.log(`📱 Webhook: http://localhost:${PORT}/webhook`);
   console.log(`📊 Dashboard: http://localhost:8501`);
   console.log(`🌍 Para ngrok: ngrok http ${PORT}`);
   console.log(`🔧 Compatibilidad: ACTIVADA`);
   console.log(`📸 Columnas comprobante: ${tieneColumnasComprobante ? 'DISPONIBLES' : 'PENDIENTES'}`);
+  console.log(`💾 Cola de escritura: commit cada ${colaEscritura.intervaloMs} ms o ${colaEscritura.maxFilas} filas`);
 });
 
-// Cerrar BD al terminar proceso
-process.on('SIGINT', () => {
-  console.log('🔄 Cerrando conexión a la base de datos...');
-  db.close((err) => {
-    if (err) {
-      console.error('Error cerrando la base de datos:', err.message);
-    } else {
-      console.log('✅ Base de datos cerrada correctamente');
-    }
+// Cerrar BD al terminar proceso: antes se guarda lo que quedó en la cola de escritura
+let cerrando = false;
+function cerrarProceso(senal) {
+  if (cerrando) {
+    return;
+  }
+  cerrando = true;
+  console.log(`🔄 ${senal}: guardando escrituras pendientes y cerrando la base de datos...`);
+  servidor.close();
+  colaEscritura.cerrar().then(() => {
+    db.close((err) => {
+      if (err) {
+        console.error('Error cerrando la base de datos:', err.message);
+      } else {
+        console.log(`✅ Base de datos cerrada correctamente (${colaEscritura.estadisticas.filas} escrituras en ${colaEscritura.estadisticas.lotes} lotes)`);
+      }
+      process.exit(err ? 1 : 0);
+    });
   });
-  process.exit();
-});
\ No newline at end of file
+}
+
+process.on('SIGINT', () => cerrarProceso('SIGINT'));
+process.on('SIGTERM', () => cerrarProceso('SIGTERM'));
@@ -0,0 +1,109 @@
+"""Índices administrados por el dashboard y verificación de planes de consulta"""
+
+from datetime import datetime, timedelta
+
+# (nombre, tabla, columnas) de cada índice que el dashboard mantiene
+INDICES = [
+    ('idx_conversaciones_numero_timestamp', 'conversaciones', ('numero_telefono', 'timestamp')),
+    ('idx_conversaciones_timestamp', 'conversaciones', ('timestamp',)),
+    ('idx_pedidos_numero_timestamp', 'pedidos', ('numero_telefono', 'timestamp')),
+    ('idx_pedidos_timestamp', 'pedidos', ('timestamp',)),
+]
+
+# Consultas de las rutas calientes del dashboard y del bot que deben usar índice
+CONSULTAS_CRITICAS = {
+    'Estadísticas de conversaciones hoy': (
+        "SELECT COUNT(DISTINCT numero_telefono), COUNT(*) FROM conversaciones "
+        "WHERE timestamp >= ? AND timestamp < ?",
+        ['2000-01-01 00:00:00', '2000-01-02 00:00:00']
+    ),
+    'Estadísticas de pedidos hoy': (
+        "SELECT COUNT(*), COALESCE(SUM(total), 0) FROM pedidos "
+        "WHERE timestamp >= ? AND timestamp < ?",
+        ['2000-01-01 00:00:00', '2000-01-02 00:00:00']
+    ),
+    'Página de mensajes de un contacto': (
+        "SELECT id, timestamp, mensaje_usuario, mensaje_bot, step FROM conversaciones "
+        "WHERE numero_telefono = ? AND (timestamp, id) < (?, ?) "
+        "ORDER BY timestamp DESC, id DESC LIMIT ?",
+        ['whatsapp:+0', '2000-01-01 00:00:00', 0, 51]
+    ),
+    'Último pedido de un contacto (bot)': (
+        "SELECT MAX(id) FROM pedidos WHERE numero_telefono = ?",
+        ['whatsapp:+0']
+    ),
+}
+
+
+def rango_dia(fecha=None):
+    """Devuelve el rango semiabierto [inicio, fin) de un día como strings comparables con timestamp"""
+    fecha = fecha or datetime.now().date()
+    inicio = datetime(fecha.year, fecha.month, fecha.day)
+    fin = inicio + timedelta(days=1)
+    return inicio.strftime('%Y-%m-%d %H:%M:%S'), fin.strftime('%Y-%m-%d %H:%M:%S')
+
+
+def tablas_existentes(conn):
+    """Nombres de las tablas presentes en la base de datos"""
+    cursor = conn.cursor()
+    cursor.execute("SELECT name FROM sqlite_master WHERE type = 'table'")
+    return {fila[0] for fila in cursor.fetchall()}
+
+
+def crear_indices(conn):
+    """Crea los índices administrados que falten; devuelve {nombre: estado}
+
+    Las tablas las crea el bot (index.js); si todavía no existen el índice
+    queda como 'pendiente' y se vuelve a intentar en la siguiente verificación.
+    """
+    tablas = tablas_existentes(conn)
+    resultado = {}
+    for nombre, tabla, columnas in INDICES:
+        if tabla not in tablas:
+            resultado[nombre] = 'pendiente'
+            continue
+        try:
+            conn.execute(
+                f"CREATE INDEX IF NOT EXISTS {nombre} ON {tabla} ({', '.join(columnas)})"
+            )
+            resultado[nombre] = 'ok'
+        except Exception as e:
+            resultado[nombre] = f'error: {e}'
+    conn.commit()
+    return resultado
+
+
+def verificar_planes(conn):
+    """Ejecuta EXPLAIN QUERY PLAN sobre las consultas críticas
+
+    Devuelve una lista de (consulta, detalle) con las que recorren una tabla
+    completa sin usar ningún índice.
+    """
+    tablas = tablas_existentes(conn)
+    recorridos = []
+    for nombre, (query, params) in CONSULTAS_CRITICAS.items():
+        try:
+            cursor = conn.cursor()
+            cursor.execute(f"EXPLAIN QUERY PLAN {query}", params)
+            plan = [fila[-1] for fila in cursor.fetchall()]
+        except Exception:
+            # Tabla aún no creada por el bot
+            continue
+        for detalle in plan:
+            # 'SCAN tabla' (o 'SCAN TABLE tabla' en SQLite antiguos) sin índice
+            partes = [p for p in detalle.split() if p != 'TABLE']
+            if len(partes) == 2 and partes[0] == 'SCAN' and partes[1] in tablas:
+                recorridos.append((nombre, detalle))
+    return recorridos
+
+
+if __name__ == '__main__':
+    import sqlite3
+    import sys
+
+    ruta = sys.argv[1] if len(sys.argv) > 1 else 'papanatas_chat.db'
+    conexion = sqlite3.connect(ruta)
+    for nombre, estado in crear_indices(conexion).items():
+        print(f"{nombre}: {estado}")
+    for nombre, detalle in verificar_planes(conexion):
+        print(f"⚠️ {nombre}: {detalle}")
@@ -0,0 +1,246 @@
+"""Métricas de rendimiento del dashboard: consultas, caché y secciones de la página
+
+Un único RegistroMetricas por proceso acumula, para cada función de acceso a
+datos, el tiempo de pared, las filas devueltas y los aciertos/fallos de caché,
+y para cada sección de la página su tiempo de render. Guarda una ventana de
+las últimas observaciones (para los histogramas del panel "⏱️ Rendimiento") y
+acumulados con buckets al estilo Prometheus que se pueden escribir a un
+archivo de texto (textfile collector de node_exporter) o servir por HTTP.
+"""
+
+import functools
+import os
+import threading
+import time
+from collections import deque
+from contextlib import contextmanager
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+# Límites superiores (segundos) de los buckets de los histogramas
+BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+# Observaciones recientes que se conservan por función o sección
+VENTANA = 500
+
+
+def contar_filas(resultado):
+    """Filas de un resultado: DataFrame, lista, o tupla cuyo primer elemento es uno de ellos"""
+    if isinstance(resultado, tuple) and resultado:
+        resultado = resultado[0]
+    if resultado is None:
+        return 0
+    if hasattr(resultado, '__len__') and not isinstance(resultado, (str, dict)):
+        return len(resultado)
+    return 1
+
+
+class _Histograma:
+    """Acumulado de un histograma Prometheus más la ventana de observaciones recientes"""
+
+    __slots__ = ('cuentas', 'suma', 'total', 'recientes')
+
+    def __init__(self):
+        self.cuentas = [0] * len(BUCKETS)
+        self.suma = 0.0
+        self.total = 0
+        self.recientes = deque(maxlen=VENTANA)
+
+    def observar(self, segundos):
+        self.suma += segundos
+        self.total += 1
+        self.recientes.append(segundos)
+        for i, limite in enumerate(BUCKETS):
+            if segundos <= limite:
+                self.cuentas[i] += 1
+
+
+def _etiquetas(**valores):
+    """Etiquetas Prometheus con los valores escapados"""
+    def escapar(valor):
+        return str(valor).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+    return '{' + ','.join(f'{k}="{escapar(v)}"' for k, v in valores.items()) + '}'
+
+
+class RegistroMetricas:
+    """Registro de métricas compartido por todas las sesiones del proceso"""
+
+    def __init__(self, archivo=None, intervalo_archivo=5.0):
+        self.archivo = archivo
+        self.intervalo_archivo = intervalo_archivo
+        self._lock = threading.Lock()
+        self._funciones = {}
+        self._filas = {}
+        self._cache = {}
+        self._secciones = {}
+        self._servidor = None
+        self._ultima_escritura = 0.0
+
+    def observar_funcion(self, funcion, segundos, filas, acierto_cache=None):
+        """Registra una llamada; acierto_cache es True/False, o None si la función no se cachea"""
+        with self._lock:
+            self._funciones.setdefault(funcion, _Histograma()).observar(segundos)
+            self._filas[funcion] = self._filas.get(funcion, 0) + filas
+            if acierto_cache is not None:
+                aciertos, fallos = self._cache.get(funcion, (0, 0))
+                self._cache[funcion] = (aciertos + 1, fallos) if acierto_cache else (aciertos, fallos + 1)
+
+    def observar_seccion(self, seccion, segundos):
+        """Registra el tiempo de render de una sección de la página"""
+        with self._lock:
+            self._secciones.setdefault(seccion, _Histograma()).observar(segundos)
+        if self.archivo:
+            try:
+                self.escribir_archivo(self.archivo, self.intervalo_archivo)
+            except OSError as e:
+                print(f"Error escribiendo métricas en {self.archivo}: {e}")
+
+    @contextmanager
+    def seccion(self, nombre):
+        """Mide el bloque como una sección de la página"""
+        inicio = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observar_seccion(nombre, time.perf_counter() - inicio)
+
+    def medir_seccion(self, nombre):
+        """Decorador equivalente a `seccion` para los paneles"""
+        def decorador(funcion):
+            @functools.wraps(funcion)
+            def medida(*args, **kwargs):
+                with self.seccion(nombre):
+                    return funcion(*args, **kwargs)
+            return medida
+        return decorador
+
+    def instrumentar(self, nombre, cache=None):
+        """Decorador de funciones de datos: tiempo, filas y acierto de caché
+
+        `cache` es el decorador de caché de la función (ej. st.cache_data(ttl=2)).
+        La función original se envuelve antes de cachearla: si no llega a
+        ejecutarse durante la llamada, el resultado vino de la caché.
+        """
+        local = threading.local()
+
+        def decorador(funcion):
+            @functools.wraps(funcion)
+            def ejecutada(*args, **kwargs):
+                local.ejecuciones = getattr(local, 'ejecuciones', 0) + 1
+                return funcion(*args, **kwargs)
+
+            llamable = cache(ejecutada) if cache is not None else funcion
+
+            @functools.wraps(funcion)
+            def medida(*args, **kwargs):
+                ejecuciones = getattr(local, 'ejecuciones', 0)
+                inicio = time.perf_counter()
+                resultado = llamable(*args, **kwargs)
+                acierto = None
+                if cache is not None:
+                    acierto = getattr(local, 'ejecuciones', 0) == ejecuciones
+                self.observar_funcion(nombre, time.perf_counter() - inicio,
+                                      contar_filas(resultado), acierto)
+                return resultado
+
+            # Se mantiene el acceso a .clear() de la caché de Streamlit
+            if cache is not None and hasattr(llamable, 'clear'):
+                medida.clear = llamable.clear
+            return medida
+        return decorador
+
+    def resumen(self):
+        """Filas (tipo, nombre, llamadas, p50_ms, p95_ms, filas, aciertos_cache) con la ventana reciente"""
+        with self._lock:
+            filas = []
+            for tipo, histogramas in (('funcion', self._funciones), ('seccion', self._secciones)):
+                for nombre, histograma in histogramas.items():
+                    recientes = sorted(histograma.recientes)
+                    aciertos, fallos = self._cache.get(nombre, (0, 0)) if tipo == 'funcion' else (0, 0)
+                    filas.append({
+                        'tipo': tipo,
+                        'nombre': nombre,
+                        'llamadas': histograma.total,
+                        'p50_ms': recientes[len(recientes) // 2] * 1000,
+                        'p95_ms': recientes[min(len(recientes) - 1, int(len(recientes) * 0.95))] * 1000,
+                        'filas': self._filas.get(nombre, 0) if tipo == 'funcion' else None,
+                        'aciertos_cache': aciertos / (aciertos + fallos) if aciertos + fallos else None,
+                    })
+            return filas
+
+    def recientes(self, nombre):
+        """Últimas duraciones (segundos) de una función o sección"""
+        with self._lock:
+            histograma = self._funciones.get(nombre) or self._secciones.get(nombre)
+            return list(histograma.recientes) if histograma else []
+
+    def prometheus(self):
+        """Métricas en formato de texto de Prometheus"""
+        lineas = []
+
+        def histograma(metrica, ayuda, etiqueta, histogramas):
+            lineas.append(f"# HELP {metrica} {ayuda}")
+            lineas.append(f"# TYPE {metrica} histogram")
+            for nombre, h in sorted(histogramas.items()):
+                for limite, cuenta in zip(BUCKETS, h.cuentas):
+                    lineas.append(f"{metrica}_bucket{_etiquetas(**{etiqueta: nombre, 'le': limite})} {cuenta}")
+                lineas.append(f"{metrica}_bucket{_etiquetas(**{etiqueta: nombre, 'le': '+Inf'})} {h.total}")
+                lineas.append(f"{metrica}_sum{_etiquetas(**{etiqueta: nombre})} {h.suma:.6f}")
+                lineas.append(f"{metrica}_count{_etiquetas(**{etiqueta: nombre})} {h.total}")
+
+        with self._lock:
+            histograma('papanatas_dashboard_funcion_segundos',
+                       'Tiempo de pared de las funciones de acceso a datos',
+                       'funcion', self._funciones)
+            lineas.append("# HELP papanatas_dashboard_funcion_filas_total Filas devueltas por función")
+            lineas.append("# TYPE papanatas_dashboard_funcion_filas_total counter")
+            for nombre, filas in sorted(self._filas.items()):
+                lineas.append(f"papanatas_dashboard_funcion_filas_total{_etiquetas(funcion=nombre)} {filas}")
+            lineas.append("# HELP papanatas_dashboard_cache_total Llamadas servidas desde la caché (hit) o no (miss)")
+            lineas.append("# TYPE papanatas_dashboard_cache_total counter")
+            for nombre, (aciertos, fallos) in sorted(self._cache.items()):
+                lineas.append(f"papanatas_dashboard_cache_total{_etiquetas(funcion=nombre, resultado='hit')} {aciertos}")
+                lineas.append(f"papanatas_dashboard_cache_total{_etiquetas(funcion=nombre, resultado='miss')} {fallos}")
+            histograma('papanatas_dashboard_seccion_segundos',
+                       'Tiempo de render de cada sección de la página',
+                       'seccion', self._secciones)
+        return '\n'.join(lineas) + '\n'
+
+    def escribir_archivo(self, ruta, cada=5.0):
+        """Escribe las métricas en `ruta` de forma atómica, como mucho una vez cada `cada` segundos"""
+        ahora = time.monotonic()
+        with self._lock:
+            if ahora - self._ultima_escritura < cada:
+                return False
+            self._ultima_escritura = ahora
+        temporal = f"{ruta}.{os.getpid()}.tmp"
+        with open(temporal, 'w') as f:
+            f.write(self.prometheus())
+        os.replace(temporal, ruta)
+        return True
+
+    def iniciar_servidor(self, puerto, host='127.0.0.1'):
+        """Sirve /metrics en un hilo de fondo (una sola vez por proceso)"""
+        if self._servidor is not None:
+            return self._servidor
+        registro = self
+
+        class Manejador(BaseHTTPRequestHandler):
+            def do_GET(self):
+                if self.path.split('?')[0] not in ('/metrics', '/'):
+                    self.send_error(404)
+                    return
+                cuerpo = registro.prometheus().encode('utf-8')
+                self.send_response(200)
+                self.send_header('Content-Type', 'text/plain; version=0.0.4; charset=utf-8')
+                self.send_header('Content-Length', str(len(cuerpo)))
+                self.end_headers()
+                self.wfile.write(cuerpo)
+
+            def log_message(self, *args):
+                pass
+
+        self._servidor = ThreadingHTTPServer((host, puerto), Manejador)
+        threading.Thread(
+            target=self._servidor.serve_forever, name='metricas-dashboard', daemon=True
+        ).start()
+        return self._servidor
@@ -0,0 +1,206 @@
+"""Pool de conexiones SQLite de solo lectura para el dashboard
+
+Cada hilo que necesita leer toma una conexión propia del pool (abierta con
+`mode=ro`, caché de páginas y mmap dimensionados) y la devuelve al terminar,
+de modo que varios operadores leen en paralelo en vez de serializarse sobre
+una sola conexión compartida. Las escrituras de mantenimiento (índices,
+triggers) usan una única conexión de escritura protegida por un lock.
+
+`version_datos` es una sonda barata de cambios: PRAGMA data_version sobre una
+conexión dedicada. Las cachés del dashboard se indexan por ese valor, así
+una consulta solo se repite después de un commit real (del bot o de otro
+proceso) y no cada vez que vence un TTL.
+"""
+
+import os
+import sqlite3
+import threading
+import time
+from contextlib import contextmanager
+from urllib.parse import quote
+
+
+def es_error_ocupado(error):
+    """True si el error corresponde a SQLITE_BUSY / SQLITE_LOCKED"""
+    mensaje = str(error).lower()
+    return 'locked' in mensaje or 'busy' in mensaje
+
+
+class PoolConexiones:
+    """Pool de conexiones de solo lectura con reintentos ante SQLITE_BUSY"""
+
+    def __init__(self, ruta, max_conexiones=8, cache_kib=16384, mmap_bytes=256 * 1024 * 1024,
+                 busy_timeout_ms=2000, reintentos_busy=3, espera_reintento=0.05):
+        self.ruta = os.path.abspath(ruta)
+        self.max_conexiones = max_conexiones
+        self.cache_kib = cache_kib
+        self.mmap_bytes = mmap_bytes
+        self.busy_timeout_ms = busy_timeout_ms
+        self.reintentos_busy = reintentos_busy
+        self.espera_reintento = espera_reintento
+
+        self._condicion = threading.Condition()
+        self._libres = []
+        self._abiertas = 0
+        self._lock_escritura = threading.Lock()
+        self._conexion_escritura = None
+        self._lock_sonda = threading.Lock()
+        self._conexion_sonda = None
+        self._version_datos = None
+        self._ultimo_cambio = self._hora_archivo()
+        self._estadisticas = {
+            'checkouts': 0,
+            'esperas': 0,
+            'reintentos_busy': 0,
+            'errores_busy': 0,
+            'conexiones_abiertas': 0,
+        }
+
+    def _configurar(self, conn):
+        conn.execute(f"PRAGMA busy_timeout = {int(self.busy_timeout_ms)}")
+        conn.execute(f"PRAGMA cache_size = -{int(self.cache_kib)}")
+        conn.execute(f"PRAGMA mmap_size = {int(self.mmap_bytes)}")
+
+    def _abrir_lectura(self):
+        conn = sqlite3.connect(
+            f"file:{quote(self.ruta)}?mode=ro",
+            uri=True,
+            check_same_thread=False,
+            timeout=self.busy_timeout_ms / 1000
+        )
+        self._configurar(conn)
+        return conn
+
+    @contextmanager
+    def conexion(self):
+        """Presta una conexión de lectura al hilo actual mientras dure el bloque"""
+        conn = None
+        with self._condicion:
+            self._estadisticas['checkouts'] += 1
+            if not self._libres and self._abiertas >= self.max_conexiones:
+                self._estadisticas['esperas'] += 1
+                while not self._libres and self._abiertas >= self.max_conexiones:
+                    self._condicion.wait()
+            if self._libres:
+                conn = self._libres.pop()
+            else:
+                self._abiertas += 1
+                self._estadisticas['conexiones_abiertas'] += 1
+
+        if conn is None:
+            try:
+                conn = self._abrir_lectura()
+            except Exception:
+                with self._condicion:
+                    self._abiertas -= 1
+                    self._condicion.notify()
+                raise
+
+        try:
+            yield conn
+        finally:
+            with self._condicion:
+                self._libres.append(conn)
+                self._condicion.notify()
+
+    def leer(self, funcion):
+        """Ejecuta funcion(conn) con una conexión del pool, reintentando ante SQLITE_BUSY"""
+        for intento in range(self.reintentos_busy + 1):
+            try:
+                with self.conexion() as conn:
+                    return funcion(conn)
+            except sqlite3.OperationalError as e:
+                if not es_error_ocupado(e):
+                    raise
+                with self._condicion:
+                    if intento == self.reintentos_busy:
+                        self._estadisticas['errores_busy'] += 1
+                        raise
+                    self._estadisticas['reintentos_busy'] += 1
+                time.sleep(self.espera_reintento * (2 ** intento))
+
+    def leer_consistente(self, funcion):
+        """Como `leer`, pero todas las consultas de `funcion` ven la misma versión de la base
+
+        Corre dentro de una transacción de lectura (en WAL, una foto fija de la
+        base). Dentro no se puede adjuntar otra base con ATTACH.
+        """
+        def en_transaccion(conn):
+            conn.execute("BEGIN")
+            try:
+                return funcion(conn)
+            finally:
+                conn.rollback()
+        return self.leer(en_transaccion)
+
+    @contextmanager
+    def escritura(self):
+        """Conexión de escritura compartida (modo WAL) para tareas de mantenimiento"""
+        with self._lock_escritura:
+            if self._conexion_escritura is None:
+                conn = sqlite3.connect(
+                    self.ruta, check_same_thread=False, timeout=self.busy_timeout_ms / 1000
+                )
+                # WAL es persistente en el archivo: lectores y el bot dejan de bloquearse entre sí
+                conn.execute("PRAGMA journal_mode = WAL")
+                self._configurar(conn)
+                self._conexion_escritura = conn
+            yield self._conexion_escritura
+
+    def _hora_archivo(self):
+        """Última modificación de la base o de su WAL (epoch), o None si no existe"""
+        horas = []
+        for ruta in (self.ruta, self.ruta + '-wal'):
+            try:
+                horas.append(os.path.getmtime(ruta))
+            except OSError:
+                pass
+        return max(horas) if horas else None
+
+    def version_datos(self):
+        """Valor que cambia con cada commit en la base, de cualquier conexión o proceso
+
+        PRAGMA data_version es propio de cada conexión, por eso se consulta
+        siempre la misma conexión de sonda (que nunca escribe). Lee el
+        encabezado del WAL en memoria compartida: no toca ninguna tabla.
+        """
+        with self._lock_sonda:
+            if self._conexion_sonda is None:
+                self._conexion_sonda = self._abrir_lectura()
+            version = self._conexion_sonda.execute("PRAGMA data_version").fetchone()[0]
+            if version != self._version_datos:
+                if self._version_datos is not None:
+                    self._ultimo_cambio = time.time()
+                self._version_datos = version
+        return version
+
+    def ultimo_cambio(self):
+        """Hora (epoch) del último cambio que vio la sonda
+
+        Antes del primer cambio es la hora de modificación del archivo (o del WAL).
+        """
+        return self._ultimo_cambio
+
+    def estadisticas(self):
+        """Copia de los contadores del pool"""
+        with self._condicion:
+            datos = dict(self._estadisticas)
+            datos['conexiones_libres'] = len(self._libres)
+            datos['conexiones_en_uso'] = self._abiertas - len(self._libres)
+        return datos
+
+    def cerrar(self):
+        """Cierra las conexiones libres, la de escritura y la de sonda"""
+        with self._condicion:
+            for conn in self._libres:
+                conn.close()
+            self._abiertas -= len(self._libres)
+            self._libres = []
+        with self._lock_escritura:
+            if self._conexion_escritura is not None:
+                self._conexion_escritura.close()
+                self._conexion_escritura = None
+        with self._lock_sonda:
+            if self._conexion_sonda is not None:
+                self._conexion_sonda.close()
+                self._conexion_sonda = None
@@ -0,0 +1,225 @@
+"""Tabla contact_summary: una fila por contacto mantenida por triggers
+
+La lista de contactos del dashboard lee esta tabla en vez de agregar todo el
+historial de conversaciones y pedidos en cada refresco.
+
+Uso como script (backfill de una base existente):
+
+    python resumen_contactos.py --backfill [papanatas_chat.db]
+"""
+
+import re
+
+TABLA = 'contact_summary'
+
+SQL_TABLA = f"""
+CREATE TABLE IF NOT EXISTS {TABLA} (
+    numero_telefono TEXT PRIMARY KEY,
+    ultima_actividad DATETIME,
+    total_mensajes INTEGER NOT NULL DEFAULT 0,
+    nombre_cliente TEXT,
+    ultimo_mensaje_id INTEGER NOT NULL DEFAULT 0,
+    pedido_id INTEGER,
+    estado TEXT,
+    total INTEGER,
+    comprobante_recibido INTEGER DEFAULT 0,
+    comprobante_url TEXT
+)
+"""
+
+# Índices de la tabla: (nombre, columnas)
+INDICES = [
+    (f'idx_{TABLA}_actividad_numero', 'ultima_actividad, numero_telefono'),
+    (f'idx_{TABLA}_ultimo_mensaje', 'ultimo_mensaje_id'),
+]
+
+# Columnas del pedido que se copian al resumen (las de comprobante pueden no existir aún)
+COLUMNAS_PEDIDO = ['estado', 'total', 'comprobante_recibido', 'comprobante_url']
+
+
+def _columnas_pedidos(conn):
+    cursor = conn.cursor()
+    cursor.execute("PRAGMA table_info(pedidos)")
+    return [col[1] for col in cursor.fetchall()]
+
+
+def _expresiones_pedido(columnas, alias):
+    """Expresión SQL de cada columna del pedido, o un valor neutro si no existe"""
+    neutros = {'comprobante_recibido': '0'}
+    return [
+        f"{alias}.{col}" if col in columnas else neutros.get(col, 'NULL')
+        for col in COLUMNAS_PEDIDO
+    ]
+
+
+def _con_sesiones(conn):
+    """True si el bot ya creó la tabla sesiones y conversaciones.sesion_id (ver sesiones_bd)"""
+    cursor = conn.cursor()
+    cursor.execute("SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = 'sesiones'")
+    if cursor.fetchone() is None:
+        return False
+    cursor.execute("PRAGMA table_info(conversaciones)")
+    return any(col[1] == 'sesion_id' for col in cursor.fetchall())
+
+
+def _expresion_nombre(alias, con_sesiones):
+    """Nombre del cliente de un mensaje: desde sesiones o, en filas sin normalizar, desde el JSON"""
+    desde_json = f"NULLIF(json_extract({alias}.session_data, '$.pedido.nombre'), '')"
+    if not con_sesiones:
+        return desde_json
+    return (f"COALESCE(NULLIF((SELECT s.nombre_cliente FROM sesiones s "
+            f"WHERE s.id = {alias}.sesion_id), ''), {desde_json})")
+
+
+def _sql_triggers(columnas, con_sesiones=False):
+    """Definición de los triggers según las columnas disponibles en pedidos"""
+    nuevo = _expresiones_pedido(columnas, 'NEW')
+    asignaciones = ',\n        '.join(
+        f"{col} = {expr}" for col, expr in zip(COLUMNAS_PEDIDO, nuevo)
+    )
+    return {
+        f'trg_{TABLA}_mensaje': f"""CREATE TRIGGER trg_{TABLA}_mensaje
+AFTER INSERT ON conversaciones
+WHEN NEW.mensaje_usuario IS NOT NULL OR NEW.mensaje_bot IS NOT NULL
+BEGIN
+    INSERT INTO {TABLA} (numero_telefono, ultima_actividad, total_mensajes, nombre_cliente, ultimo_mensaje_id)
+    VALUES (
+        NEW.numero_telefono, NEW.timestamp, 1,
+        {_expresion_nombre('NEW', con_sesiones)}, NEW.id
+    )
+    ON CONFLICT(numero_telefono) DO UPDATE SET
+        ultima_actividad = MAX(COALESCE(ultima_actividad, ''), excluded.ultima_actividad),
+        total_mensajes = total_mensajes + 1,
+        nombre_cliente = COALESCE(excluded.nombre_cliente, nombre_cliente),
+        ultimo_mensaje_id = MAX(ultimo_mensaje_id, excluded.ultimo_mensaje_id);
+END""",
+        f'trg_{TABLA}_pedido_nuevo': f"""CREATE TRIGGER trg_{TABLA}_pedido_nuevo
+AFTER INSERT ON pedidos
+BEGIN
+    INSERT INTO {TABLA} (numero_telefono, pedido_id, {', '.join(COLUMNAS_PEDIDO)})
+    VALUES (NEW.numero_telefono, NEW.id, {', '.join(nuevo)})
+    ON CONFLICT(numero_telefono) DO UPDATE SET
+        pedido_id = excluded.pedido_id,
+        {asignaciones.replace('NEW.', 'excluded.')}
+    WHERE pedido_id IS NULL OR excluded.pedido_id >= pedido_id;
+END""",
+        f'trg_{TABLA}_pedido_actualizado': f"""CREATE TRIGGER trg_{TABLA}_pedido_actualizado
+AFTER UPDATE ON pedidos
+BEGIN
+    UPDATE {TABLA} SET
+        {asignaciones}
+    WHERE numero_telefono = NEW.numero_telefono AND pedido_id = NEW.id;
+END""",
+    }
+
+
+def _normalizar(sql):
+    return re.sub(r'\s+', ' ', sql or '').strip()
+
+
+def backfill(conn, en_transaccion=False):
+    """Reconstruye contact_summary completo a partir de conversaciones y pedidos"""
+    columnas = _columnas_pedidos(conn)
+    nombre = _expresion_nombre('u', _con_sesiones(conn))
+    if not en_transaccion:
+        conn.commit()
+        conn.execute("BEGIN IMMEDIATE")
+    try:
+        conn.execute(f"DELETE FROM {TABLA}")
+        conn.execute(f"""
+        INSERT INTO {TABLA} (numero_telefono, ultima_actividad, total_mensajes, nombre_cliente, ultimo_mensaje_id)
+        SELECT
+            c.numero_telefono,
+            MAX(c.timestamp),
+            COUNT(*),
+            (SELECT {nombre}
+             FROM conversaciones u
+             WHERE u.numero_telefono = c.numero_telefono
+               AND (u.mensaje_usuario IS NOT NULL OR u.mensaje_bot IS NOT NULL)
+               AND {nombre} IS NOT NULL
+             ORDER BY u.id DESC LIMIT 1),
+            MAX(c.id)
+        FROM conversaciones c
+        WHERE c.mensaje_usuario IS NOT NULL OR c.mensaje_bot IS NOT NULL
+        GROUP BY c.numero_telefono
+        """)
+        conn.execute(f"""
+        INSERT OR IGNORE INTO {TABLA} (numero_telefono)
+        SELECT DISTINCT numero_telefono FROM pedidos
+        """)
+        conn.execute(f"""
+        UPDATE {TABLA} SET (pedido_id, {', '.join(COLUMNAS_PEDIDO)}) = (
+            SELECT p.id, {', '.join(_expresiones_pedido(columnas, 'p'))}
+            FROM pedidos p
+            WHERE p.numero_telefono = {TABLA}.numero_telefono
+            ORDER BY p.id DESC LIMIT 1
+        )
+        WHERE numero_telefono IN (SELECT numero_telefono FROM pedidos)
+        """)
+        if not en_transaccion:
+            conn.commit()
+    except Exception:
+        if not en_transaccion:
+            conn.rollback()
+        raise
+    cursor = conn.cursor()
+    cursor.execute(f"SELECT COUNT(*) FROM {TABLA}")
+    return cursor.fetchone()[0]
+
+
+def instalar(conn):
+    """Crea la tabla y sus triggers (o los actualiza si cambiaron las columnas de pedidos)
+
+    Si hubo que crear la tabla o cambiar algún trigger la rellena desde cero:
+    las filas escritas con la definición anterior no tienen las columnas
+    nuevas. Devuelve 'ok', 'creada' si hubo que crearla y rellenarla, o
+    'pendiente' si el bot todavía no creó las tablas base.
+    """
+    cursor = conn.cursor()
+    cursor.execute("SELECT type, name, sql FROM sqlite_master WHERE type IN ('table', 'trigger', 'index')")
+    existentes = {(fila[0], fila[1]): fila[2] for fila in cursor.fetchall()}
+    if ('table', 'conversaciones') not in existentes or ('table', 'pedidos') not in existentes:
+        return 'pendiente'
+
+    nueva = ('table', TABLA) not in existentes
+    triggers = _sql_triggers(_columnas_pedidos(conn), _con_sesiones(conn))
+    cambios = {
+        nombre: sql for nombre, sql in triggers.items()
+        if _normalizar(existentes.get(('trigger', nombre))) != _normalizar(sql)
+    }
+    indices_faltantes = [
+        (nombre, columnas) for nombre, columnas in INDICES
+        if ('index', nombre) not in existentes
+    ]
+    if not nueva and not cambios and not indices_faltantes:
+        return 'ok'
+
+    # Tabla, triggers y backfill en una sola transacción para no perder escrituras del bot
+    conn.commit()
+    conn.execute("BEGIN IMMEDIATE")
+    try:
+        conn.execute(SQL_TABLA)
+        for nombre, columnas in indices_faltantes:
+            conn.execute(f"CREATE INDEX IF NOT EXISTS {nombre} ON {TABLA} ({columnas})")
+        for nombre, sql in cambios.items():
+            conn.execute(f"DROP TRIGGER IF EXISTS {nombre}")
+            conn.execute(sql)
+        if nueva or cambios:
+            backfill(conn, en_transaccion=True)
+        conn.commit()
+    except Exception:
+        conn.rollback()
+        raise
+    return 'creada' if nueva else 'ok'
+
+
+if __name__ == '__main__':
+    import sqlite3
+    import sys
+
+    argumentos = [a for a in sys.argv[1:] if not a.startswith('--')]
+    ruta = argumentos[0] if argumentos else 'papanatas_chat.db'
+    conexion = sqlite3.connect(ruta)
+    print(f"Instalación: {instalar(conexion)}")
+    if '--backfill' in sys.argv:
+        print(f"✅ {backfill(conexion)} contactos reconstruidos en {TABLA}")
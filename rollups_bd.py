@@ -0,0 +1,244 @@
+"""Rollups de ventas y actividad por hora y por día
+
+Tablas de agregados que alimentan las vistas de análisis del dashboard, para
+que un mes de gráficos lea cientos de filas en vez de millones:
+
+- rollup_horario / rollup_diario: pedidos, ingresos, mensajes y contactos únicos
+- rollup_productos: pedidos e ingresos por tamaño, agregado y bebida (por hora y por día)
+
+Se actualizan de forma incremental desde un watermark (último id procesado de
+conversaciones y pedidos): solo se recalculan las horas y días que tocan las
+filas nuevas, lo que mantiene exactos los contactos únicos.
+
+Uso como script:
+
+    python rollups_bd.py [--reconstruir] [papanatas_chat.db]
+"""
+
+from datetime import datetime, timedelta
+
+# Formato de periodo por granularidad (mismo formato de texto que timestamp)
+FORMATOS = {
+    'hora': '%Y-%m-%d %H:00:00',
+    'dia': '%Y-%m-%d',
+}
+
+TABLAS_ACTIVIDAD = {
+    'hora': 'rollup_horario',
+    'dia': 'rollup_diario',
+}
+
+SQL_TABLAS = [
+    """CREATE TABLE IF NOT EXISTS rollup_estado (
+    tabla TEXT PRIMARY KEY,
+    ultimo_id INTEGER NOT NULL DEFAULT 0
+)""",
+    """CREATE TABLE IF NOT EXISTS rollup_horario (
+    periodo TEXT PRIMARY KEY,
+    pedidos INTEGER NOT NULL DEFAULT 0,
+    ingresos INTEGER NOT NULL DEFAULT 0,
+    mensajes INTEGER NOT NULL DEFAULT 0,
+    contactos_unicos INTEGER NOT NULL DEFAULT 0
+)""",
+    """CREATE TABLE IF NOT EXISTS rollup_diario (
+    periodo TEXT PRIMARY KEY,
+    pedidos INTEGER NOT NULL DEFAULT 0,
+    ingresos INTEGER NOT NULL DEFAULT 0,
+    mensajes INTEGER NOT NULL DEFAULT 0,
+    contactos_unicos INTEGER NOT NULL DEFAULT 0
+)""",
+    """CREATE TABLE IF NOT EXISTS rollup_productos (
+    granularidad TEXT NOT NULL,
+    periodo TEXT NOT NULL,
+    dimension TEXT NOT NULL,
+    valor TEXT NOT NULL,
+    pedidos INTEGER NOT NULL DEFAULT 0,
+    ingresos INTEGER NOT NULL DEFAULT 0,
+    PRIMARY KEY (granularidad, periodo, dimension, valor)
+)""",
+]
+
+# Columnas de pedidos que se desglosan en rollup_productos: (dimension, expresión SQL)
+DIMENSIONES = [
+    ('tamaño', "COALESCE(tamaño, '')"),
+    ('agregado', "COALESCE(agregado, '')"),
+    ('bebida', "CAST(COALESCE(bebida, 0) AS TEXT)"),
+]
+
+
+def instalar(conn):
+    """Crea las tablas de rollup; devuelve 'pendiente' si el bot aún no creó las tablas base"""
+    cursor = conn.cursor()
+    cursor.execute("SELECT name FROM sqlite_master WHERE type = 'table'")
+    tablas = {fila[0] for fila in cursor.fetchall()}
+    if 'conversaciones' not in tablas or 'pedidos' not in tablas:
+        return 'pendiente'
+    for sql in SQL_TABLAS:
+        conn.execute(sql)
+    conn.commit()
+    return 'ok'
+
+
+def _watermark(conn, tabla):
+    fila = conn.execute("SELECT ultimo_id FROM rollup_estado WHERE tabla = ?", [tabla]).fetchone()
+    return fila[0] if fila else 0
+
+
+def _periodos_afectados(conn, tabla, desde_id, hasta_id):
+    """Horas tocadas por las filas con id en (desde_id, hasta_id]"""
+    cursor = conn.execute(
+        f"SELECT DISTINCT strftime('{FORMATOS['hora']}', timestamp) FROM {tabla} "
+        "WHERE id > ? AND id <= ? AND timestamp IS NOT NULL",
+        [desde_id, hasta_id]
+    )
+    return {fila[0] for fila in cursor.fetchall() if fila[0]}
+
+
+def _tramos_de_dias(dias):
+    """Agrupa los días en tramos consecutivos, para que una fila atrasada no obligue
+    a recorrer todo el intervalo hasta hoy"""
+    tramos = []
+    anterior = None
+    for dia in sorted(dias):
+        fecha = datetime.strptime(dia, FORMATOS['dia'])
+        if anterior is None or fecha - anterior > timedelta(days=1):
+            tramos.append(set())
+        tramos[-1].add(dia)
+        anterior = fecha
+    return tramos
+
+
+def _rango(periodos, granularidad):
+    """Rango semiabierto [inicio, fin) que cubre los periodos, comparable con timestamp"""
+    formato = FORMATOS[granularidad]
+    inicio = datetime.strptime(min(periodos), formato)
+    fin = datetime.strptime(max(periodos), formato)
+    fin += timedelta(hours=1) if granularidad == 'hora' else timedelta(days=1)
+    return inicio.strftime('%Y-%m-%d %H:%M:%S'), fin.strftime('%Y-%m-%d %H:%M:%S')
+
+
+def _recalcular(conn, granularidad, periodos):
+    """Recalcula desde las tablas base los periodos indicados de una granularidad"""
+    formato = FORMATOS[granularidad]
+    tabla = TABLAS_ACTIVIDAD[granularidad]
+    inicio, fin = _rango(periodos, granularidad)
+
+    conn.execute("DELETE FROM temp._rollup_periodos")
+    conn.executemany("INSERT INTO temp._rollup_periodos (periodo) VALUES (?)", [(p,) for p in periodos])
+
+    conn.execute(f"DELETE FROM {tabla} WHERE periodo IN (SELECT periodo FROM temp._rollup_periodos)")
+    conn.execute(f"""
+    INSERT INTO {tabla} (periodo, pedidos, ingresos, mensajes, contactos_unicos)
+    SELECT periodo, SUM(pedidos), SUM(ingresos), SUM(mensajes), SUM(contactos_unicos)
+    FROM (
+        SELECT strftime('{formato}', timestamp) AS periodo,
+               COUNT(*) AS pedidos, COALESCE(SUM(total), 0) AS ingresos,
+               0 AS mensajes, 0 AS contactos_unicos
+        FROM pedidos
+        WHERE timestamp >= ? AND timestamp < ?
+        GROUP BY 1
+        UNION ALL
+        SELECT strftime('{formato}', timestamp), 0, 0, COUNT(*), COUNT(DISTINCT numero_telefono)
+        FROM conversaciones
+        WHERE timestamp >= ? AND timestamp < ?
+        GROUP BY 1
+    )
+    WHERE periodo IN (SELECT periodo FROM temp._rollup_periodos)
+    GROUP BY periodo
+    """, [inicio, fin, inicio, fin])
+
+    conn.execute(
+        "DELETE FROM rollup_productos WHERE granularidad = ? "
+        "AND periodo IN (SELECT periodo FROM temp._rollup_periodos)",
+        [granularidad]
+    )
+    desgloses = '\n        UNION ALL\n        '.join(
+        f"SELECT strftime('{formato}', timestamp) AS periodo, '{dimension}' AS dimension, "
+        f"{expresion} AS valor, total FROM pedidos WHERE timestamp >= ? AND timestamp < ?"
+        for dimension, expresion in DIMENSIONES
+    )
+    conn.execute(f"""
+    INSERT INTO rollup_productos (granularidad, periodo, dimension, valor, pedidos, ingresos)
+    SELECT ?, periodo, dimension, valor, COUNT(*), COALESCE(SUM(total), 0)
+    FROM (
+        {desgloses}
+    )
+    WHERE periodo IN (SELECT periodo FROM temp._rollup_periodos)
+    GROUP BY periodo, dimension, valor
+    """, [granularidad] + [inicio, fin] * len(DIMENSIONES))
+
+
+def actualizar(conn):
+    """Incorpora a los rollups las filas nuevas desde el último watermark
+
+    Devuelve {'conversaciones': n, 'pedidos': n, 'horas': n} con las filas
+    nuevas procesadas y las horas recalculadas.
+    """
+    conn.commit()
+    conn.execute("BEGIN IMMEDIATE")
+    try:
+        conn.execute("CREATE TEMP TABLE IF NOT EXISTS _rollup_periodos (periodo TEXT PRIMARY KEY)")
+        resultado = {}
+        horas = set()
+        for tabla in ('conversaciones', 'pedidos'):
+            desde_id = _watermark(conn, tabla)
+            # sqlite_sequence conserva el último id aunque archivo_bd haya movido las filas
+            hasta_id = conn.execute(
+                f"SELECT MAX(COALESCE((SELECT seq FROM sqlite_sequence WHERE name = ?), 0), "
+                f"COALESCE((SELECT MAX(id) FROM {tabla}), 0))",
+                [tabla]
+            ).fetchone()[0]
+            if hasta_id < desde_id:
+                # Base recreada: los rollups ya no corresponden, se reconstruyen completos
+                conn.rollback()
+                return reconstruir(conn)
+            horas |= _periodos_afectados(conn, tabla, desde_id, hasta_id)
+            conn.execute(
+                "INSERT INTO rollup_estado (tabla, ultimo_id) VALUES (?, ?) "
+                "ON CONFLICT(tabla) DO UPDATE SET ultimo_id = excluded.ultimo_id",
+                [tabla, hasta_id]
+            )
+            resultado[tabla] = hasta_id - desde_id
+
+        for dias in _tramos_de_dias({hora[:10] for hora in horas}):
+            _recalcular(conn, 'hora', {hora for hora in horas if hora[:10] in dias})
+            _recalcular(conn, 'dia', dias)
+        resultado['horas'] = len(horas)
+        conn.commit()
+    except Exception:
+        conn.rollback()
+        raise
+    return resultado
+
+
+def reconstruir(conn):
+    """Vacía los rollups y los recalcula desde cero
+
+    Solo ve la base principal: los meses ya movidos por archivo_bd dejan de
+    figurar en los rollups después de reconstruir.
+    """
+    conn.commit()
+    conn.execute("BEGIN IMMEDIATE")
+    try:
+        for tabla in ('rollup_estado', 'rollup_horario', 'rollup_diario', 'rollup_productos'):
+            conn.execute(f"DELETE FROM {tabla}")
+        conn.commit()
+    except Exception:
+        conn.rollback()
+        raise
+    return actualizar(conn)
+
+
+if __name__ == '__main__':
+    import sqlite3
+    import sys
+
+    argumentos = [a for a in sys.argv[1:] if not a.startswith('--')]
+    ruta = argumentos[0] if argumentos else 'papanatas_chat.db'
+    conexion = sqlite3.connect(ruta)
+    estado = instalar(conexion)
+    print(f"Instalación: {estado}")
+    if estado == 'ok':
+        resumen = reconstruir(conexion) if '--reconstruir' in sys.argv else actualizar(conexion)
+        print(f"✅ {resumen['conversaciones']} mensajes y {resumen['pedidos']} pedidos nuevos, "
+              f"{resumen['horas']} horas recalculadas")
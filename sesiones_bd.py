@@ -0,0 +1,241 @@
+"""Sesiones normalizadas: el session_data del bot en columnas, sin duplicados
+
+El bot guardaba `JSON.stringify(session)` completo en cada mensaje. Ahora el
+estado del pedido de la sesión (nombre, tamaño, agregado, bebida, tipo de
+extra e id de pedido) vive en la tabla `sesiones`, una fila por combinación
+distinta de valores, y cada mensaje solo guarda `conversaciones.sesion_id`.
+El `step` ya está en su propia columna, así que el JSON se puede reconstruir
+completo con la vista `conversaciones_sesion`.
+
+- index.js escribe directamente sesion_id (session_data queda NULL)
+- un trigger completa sesion_id en los mensajes que todavía lleguen con
+  session_data (bot sin actualizar), sin tocar el JSON
+- `migrar()` normaliza el historial existente por lotes y borra el JSON de
+  cada mensaje normalizado; no tiene vuelta atrás, así que solo corre como
+  paso explícito desde la línea de comandos (con respaldo previo). El
+  dashboard no instala nada de esto: lee `sesiones` si el bot ya la creó.
+
+Uso como script:
+
+    python sesiones_bd.py [papanatas_chat.db]                      # cuántos mensajes se normalizarían
+    python sesiones_bd.py --migrar [--sin-respaldo] [--vacuum] [papanatas_chat.db]
+"""
+
+import os
+import sqlite3
+from datetime import datetime
+
+TABLA = 'sesiones'
+
+# Misma definición que crea index.js al arrancar
+SQL_TABLA = f"""
+CREATE TABLE IF NOT EXISTS {TABLA} (
+    id INTEGER PRIMARY KEY,
+    nombre_cliente TEXT NOT NULL DEFAULT '',
+    tamaño TEXT NOT NULL DEFAULT '',
+    agregado TEXT NOT NULL DEFAULT '',
+    bebida INTEGER NOT NULL DEFAULT 0,
+    tipo_extra TEXT NOT NULL DEFAULT '',
+    pedido_id INTEGER NOT NULL DEFAULT 0,
+    UNIQUE (nombre_cliente, tamaño, agregado, bebida, tipo_extra, pedido_id)
+)
+"""
+
+INDICES = [
+    (f'idx_{TABLA}_nombre', TABLA, 'nombre_cliente'),
+    ('idx_conversaciones_sesion', 'conversaciones', 'sesion_id'),
+]
+
+# Columnas de sesiones y su expresión a partir del JSON del bot
+CAMPOS = [
+    ('nombre_cliente', "COALESCE(json_extract({json}, '$.pedido.nombre'), '')"),
+    ('tamaño', "COALESCE(json_extract({json}, '$.pedido.tamaño'), '')"),
+    ('agregado', "COALESCE(json_extract({json}, '$.pedido.agregado'), '')"),
+    ('bebida', "COALESCE(json_extract({json}, '$.pedido.bebida'), 0)"),
+    ('tipo_extra', "COALESCE(json_extract({json}, '$.pedido.tipo_extra'), '')"),
+    ('pedido_id', "COALESCE(json_extract({json}, '$.pedidoId'), 0)"),
+]
+
+NOMBRES_CAMPOS = ', '.join(nombre for nombre, _ in CAMPOS)
+
+
+def _expresiones(json):
+    return ', '.join(expresion.format(json=json) for _, expresion in CAMPOS)
+
+
+def _busqueda(json):
+    """Subconsulta que devuelve el id de la fila de sesiones para un JSON"""
+    condiciones = ' AND '.join(
+        f"s.{nombre} = {expresion.format(json=json)}" for nombre, expresion in CAMPOS
+    )
+    return f"(SELECT s.id FROM {TABLA} s WHERE {condiciones})"
+
+
+def sql_session_data(alias_conversacion='c', alias_sesion='s'):
+    """Expresión SQL que reconstruye el JSON original del bot"""
+    c, s = alias_conversacion, alias_sesion
+    return f"""COALESCE({c}.session_data, CASE WHEN {s}.id IS NOT NULL THEN json_object(
+        'step', {c}.step,
+        'pedido', json_object(
+            'nombre', {s}.nombre_cliente,
+            'tamaño', NULLIF({s}.tamaño, ''),
+            'agregado', CASE WHEN {s}.agregado LIKE '[%' THEN json({s}.agregado)
+                             ELSE NULLIF({s}.agregado, '') END,
+            'bebida', json(CASE WHEN {s}.bebida THEN 'true' ELSE 'false' END),
+            'tipo_extra', NULLIF({s}.tipo_extra, '')
+        ),
+        'pedidoId', NULLIF({s}.pedido_id, 0)
+    ) END)"""
+
+
+SQL_VISTA = f"""CREATE VIEW conversaciones_sesion AS
+SELECT c.id, c.numero_telefono, c.timestamp, c.mensaje_usuario, c.mensaje_bot, c.step,
+       {sql_session_data()} AS session_data
+FROM conversaciones c
+LEFT JOIN {TABLA} s ON s.id = c.sesion_id"""
+
+SQL_TRIGGER = f"""CREATE TRIGGER trg_{TABLA}_normalizar
+AFTER INSERT ON conversaciones
+WHEN NEW.session_data IS NOT NULL
+BEGIN
+    INSERT INTO {TABLA} ({NOMBRES_CAMPOS})
+    VALUES ({_expresiones('NEW.session_data')})
+    ON CONFLICT DO NOTHING;
+    UPDATE conversaciones
+    SET sesion_id = {_busqueda('NEW.session_data')}
+    WHERE id = NEW.id;
+END"""
+
+
+def _normalizar(sql):
+    return ' '.join((sql or '').split())
+
+
+def instalado(conn):
+    """True si conversaciones ya tiene la columna sesion_id"""
+    columnas = [col[1] for col in conn.execute("PRAGMA table_info(conversaciones)").fetchall()]
+    return 'sesion_id' in columnas
+
+
+def instalar(conn):
+    """Crea sesiones, la columna sesion_id, la vista y el trigger de normalización
+
+    Devuelve 'pendiente' si el bot aún no creó conversaciones, 'ok' si ya
+    estaba todo y 'creada' si hubo cambios.
+    """
+    existentes = {
+        (fila[0], fila[1]): fila[2] for fila in conn.execute(
+            "SELECT type, name, sql FROM sqlite_master WHERE type IN ('table', 'view', 'trigger', 'index')"
+        ).fetchall()
+    }
+    if ('table', 'conversaciones') not in existentes:
+        return 'pendiente'
+    cambios = (
+        ('table', TABLA) not in existentes
+        or not instalado(conn)
+        or _normalizar(existentes.get(('view', 'conversaciones_sesion'))) != _normalizar(SQL_VISTA)
+        or _normalizar(existentes.get(('trigger', f'trg_{TABLA}_normalizar'))) != _normalizar(SQL_TRIGGER)
+        or any(('index', nombre) not in existentes for nombre, _, _ in INDICES)
+    )
+    if not cambios:
+        return 'ok'
+
+    conn.commit()
+    conn.execute("BEGIN IMMEDIATE")
+    try:
+        conn.execute(SQL_TABLA)
+        if not instalado(conn):
+            conn.execute("ALTER TABLE conversaciones ADD COLUMN sesion_id INTEGER")
+        for nombre, tabla, columnas in INDICES:
+            conn.execute(f"CREATE INDEX IF NOT EXISTS {nombre} ON {tabla} ({columnas})")
+        conn.execute("DROP VIEW IF EXISTS conversaciones_sesion")
+        conn.execute(SQL_VISTA)
+        conn.execute(f"DROP TRIGGER IF EXISTS trg_{TABLA}_normalizar")
+        conn.execute(SQL_TRIGGER)
+        conn.commit()
+    except Exception:
+        conn.rollback()
+        raise
+    return 'creada'
+
+
+def pendientes(conn):
+    """Mensajes que todavía guardan el JSON completo"""
+    return conn.execute(
+        "SELECT COUNT(*) FROM conversaciones WHERE session_data IS NOT NULL"
+    ).fetchone()[0]
+
+
+def simular(conn):
+    """Lo que haría migrar() sin escribir nada: (mensajes a normalizar, combinaciones distintas)"""
+    return conn.execute(f"""
+    SELECT COUNT(*), COUNT(DISTINCT json_array({_expresiones('session_data')}))
+    FROM conversaciones WHERE session_data IS NOT NULL
+    """).fetchone()
+
+
+def respaldar(conn, ruta):
+    """Copia consistente de la base en `ruta` (API de backup de SQLite, sin frenar al bot)"""
+    destino = sqlite3.connect(ruta)
+    try:
+        conn.backup(destino)
+    finally:
+        destino.close()
+    return ruta
+
+
+def migrar(conn, lote=50_000):
+    """Normaliza el historial por lotes de ids (cada lote en su propia transacción)
+
+    Borra el session_data de cada mensaje normalizado (queda en sesiones y se
+    reconstruye con la vista conversaciones_sesion): respaldar antes.
+    Devuelve la cantidad de mensajes normalizados.
+    """
+    ultimo_id = conn.execute("SELECT COALESCE(MAX(id), 0) FROM conversaciones").fetchone()[0]
+    total = 0
+    for desde in range(0, ultimo_id, lote):
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            conn.execute(f"""
+            INSERT INTO {TABLA} ({NOMBRES_CAMPOS})
+            SELECT DISTINCT {_expresiones('session_data')}
+            FROM conversaciones
+            WHERE id > ? AND id <= ? AND session_data IS NOT NULL
+            ON CONFLICT DO NOTHING
+            """, [desde, desde + lote])
+            total += conn.execute(f"""
+            UPDATE conversaciones
+            SET sesion_id = {_busqueda('conversaciones.session_data')}, session_data = NULL
+            WHERE id > ? AND id <= ? AND session_data IS NOT NULL
+            """, [desde, desde + lote]).rowcount
+            conn.commit()
+        except Exception:
+            conn.rollback()
+            raise
+    return total
+
+
+if __name__ == '__main__':
+    import sys
+
+    argumentos = [a for a in sys.argv[1:] if not a.startswith('--')]
+    ruta = argumentos[0] if argumentos else 'papanatas_chat.db'
+    conexion = sqlite3.connect(ruta, timeout=30)
+    if ('table', 'conversaciones') not in {
+        (fila[0], fila[1]) for fila in conexion.execute("SELECT type, name FROM sqlite_master")
+    }:
+        sys.exit(f"❌ {ruta} no tiene la tabla conversaciones")
+    mensajes, combinaciones = simular(conexion)
+    print(f"{mensajes} mensajes con session_data ({combinaciones} combinaciones distintas)")
+    if '--migrar' not in sys.argv:
+        print("Nada modificado. Para normalizar (borra el JSON de esos mensajes): --migrar")
+        sys.exit(0)
+    if '--sin-respaldo' not in sys.argv:
+        base, extension = os.path.splitext(ruta)
+        respaldo = f"{base}.antes-sesiones-{datetime.now():%Y%m%d-%H%M%S}{extension or '.db'}"
+        print(f"✅ Respaldo en {respaldar(conexion, respaldo)}")
+    print(f"Instalación: {instalar(conexion)}")
+    print(f"✅ {migrar(conexion)} mensajes normalizados")
+    if '--vacuum' in sys.argv:
+        conexion.execute("VACUUM")
+        print("✅ Espacio recuperado (VACUUM)")
@@ -0,0 +1,201 @@
+"""Servicio de snapshots compartido por todas las sesiones del dashboard
+
+Un único hilo en segundo plano consulta la base cada `intervalo` segundos y
+publica una foto inmutable con los contactos recientes, las estadísticas del
+día, los comprobantes recientes y los totales del pie de página. Las sesiones
+leen esa foto sin tocar SQLite, así que N operadores cuestan un solo juego de
+consultas. Todas las consultas de una foto corren en la misma transacción de
+lectura, así que sus números coinciden entre sí. La versión solo aumenta
+cuando los datos cambian; en ese momento se avisa a los suscriptores (ej. el
+precargador de comprobantes de cache_medios).
+
+Antes de consultar se mira la sonda de cambios del pool (PRAGMA
+data_version): si nadie escribió desde la foto anterior y sigue siendo el
+mismo día, no se repite ninguna consulta.
+
+El mismo hilo vigila PRAGMA schema_version: al arrancar y cada vez que el
+bot crea tablas o agrega columnas corre `preparar` (índices, triggers y
+tablas derivadas del dashboard), sin esperar a que una sesión haga un rerun
+completo de la página.
+"""
+
+import threading
+from dataclasses import dataclass, field
+from datetime import date, datetime
+from typing import Optional
+
+import pandas as pd
+
+import consultas_bd
+
+
+@dataclass(frozen=True, eq=False)
+class Snapshot:
+    """Foto de los datos compartidos; los DataFrames no deben modificarse"""
+    version: int
+    generado: datetime
+    ultimo_id: int = 0
+    estructura: dict = field(default_factory=lambda: {
+        'tiene_comprobante_recibido': False,
+        'tiene_comprobante_url': False,
+        'columnas': []
+    })
+    contactos: pd.DataFrame = field(default_factory=consultas_bd.contactos_vacios)
+    total_contactos: int = 0
+    estadisticas: pd.DataFrame = field(default_factory=pd.DataFrame)
+    pedidos_hoy: pd.DataFrame = field(default_factory=pd.DataFrame)
+    comprobantes: pd.DataFrame = field(default_factory=pd.DataFrame)
+    total_mensajes: int = 0
+    total_comprobantes: Optional[int] = None
+    error: Optional[str] = None
+    # Último commit visto en la base (no la hora de la consulta)
+    cambiado: Optional[datetime] = None
+
+    def mismos_datos(self, otro):
+        """True si el contenido coincide con otro snapshot (sin mirar versión ni hora)"""
+        if otro is None:
+            return False
+        simples = ('ultimo_id', 'estructura', 'total_contactos', 'total_mensajes',
+                   'total_comprobantes', 'error')
+        tablas = ('contactos', 'estadisticas', 'pedidos_hoy', 'comprobantes')
+        return (
+            all(getattr(self, nombre) == getattr(otro, nombre) for nombre in simples)
+            and all(getattr(self, nombre).equals(getattr(otro, nombre)) for nombre in tablas)
+        )
+
+
+class ServicioSnapshot:
+    """Refresca periódicamente un Snapshot en un hilo de fondo"""
+
+    def __init__(self, pool, intervalo=2.0, contactos_por_pagina=50, limite_comprobantes=10, preparar=None):
+        """`preparar(version_esquema)` devuelve un dict que queda en `preparacion`;
+        si trae 'errores' no vacío se reintenta en la vuelta siguiente"""
+        self.pool = pool
+        self.preparar = preparar
+        self.preparacion = {}
+        self._version_preparada = None
+        self.intervalo = intervalo
+        self.contactos_por_pagina = contactos_por_pagina
+        self.limite_comprobantes = limite_comprobantes
+        self._snapshot = Snapshot(version=0, generado=datetime.now())
+        self._lock = threading.Lock()
+        self._detener = threading.Event()
+        self._hilo = None
+        self._suscriptores = []
+        self._clave_datos = None
+        self.revisado = self._snapshot.generado
+        self.consultas_evitadas = 0
+
+    def suscribir(self, funcion):
+        """Llama a `funcion(snapshot)` con cada versión nueva (desde el hilo de refresco)"""
+        self._suscriptores.append(funcion)
+        if self._snapshot.version:
+            funcion(self._snapshot)
+
+    def actual(self):
+        """Último snapshot publicado (lectura atómica de la referencia)"""
+        return self._snapshot
+
+    def _consultar(self, conn):
+        # Corre dentro de leer_consistente: el día de hoy nunca está archivado, así
+        # que estadisticas_generales no necesita ATTACH
+        estructura = consultas_bd.estructura_bd(conn)
+        contactos, total_contactos = consultas_bd.pagina_contactos(
+            conn, por_pagina=self.contactos_por_pagina
+        )
+        estadisticas, pedidos_hoy = consultas_bd.estadisticas_generales(
+            conn, estructura['tiene_comprobante_recibido']
+        )
+        comprobantes = pd.DataFrame()
+        if estructura['tiene_comprobante_url']:
+            comprobantes = consultas_bd.comprobantes_recientes(conn, self.limite_comprobantes)
+        total_mensajes, total_comprobantes = consultas_bd.totales(
+            conn, estructura['tiene_comprobante_recibido']
+        )
+        return {
+            'ultimo_id': consultas_bd.ultimo_id_conversaciones(conn),
+            'estructura': estructura,
+            'contactos': contactos,
+            'total_contactos': total_contactos,
+            'estadisticas': estadisticas,
+            'pedidos_hoy': pedidos_hoy,
+            'comprobantes': comprobantes,
+            'total_mensajes': total_mensajes,
+            'total_comprobantes': total_comprobantes,
+        }
+
+    def _preparar_esquema(self):
+        """Corre `preparar` si el esquema cambió desde la última preparación completa"""
+        if self.preparar is None:
+            return
+        try:
+            version = self.pool.leer(consultas_bd.version_esquema)
+        except Exception as e:
+            print(f"Error leyendo versión del esquema: {e}")
+            return
+        if version == self._version_preparada:
+            return
+        try:
+            self.preparacion = self.preparar(version)
+        except Exception as e:
+            print(f"Error preparando esquema: {e}")
+            return
+        # La preparación crea índices y triggers, lo que vuelve a cambiar la
+        # versión: la vuelta siguiente la repite una vez (sin cambios) y se estabiliza
+        if not self.preparacion.get('errores'):
+            self._version_preparada = version
+
+    def refrescar(self):
+        """Prepara el esquema si cambió, consulta la base y publica un snapshot nuevo si los datos cambiaron"""
+        with self._lock:
+            self._preparar_esquema()
+            anterior = self._snapshot
+            self.revisado = datetime.now()
+            try:
+                # Las estadísticas son "de hoy": al cambiar el día se consulta aunque nadie escriba
+                clave = (self.pool.version_datos(), date.today())
+            except Exception as e:
+                print(f"Error leyendo versión de datos: {e}")
+                clave = None
+            if clave is not None and clave == self._clave_datos and anterior.error is None:
+                self.consultas_evitadas += 1
+                return anterior
+            try:
+                datos = self.pool.leer_consistente(self._consultar)
+            except Exception as e:
+                print(f"Error refrescando snapshot: {e}")
+                datos = {'error': str(e)}
+                clave = None
+            self._clave_datos = clave
+            ultimo_cambio = self.pool.ultimo_cambio()
+            datos['cambiado'] = datetime.fromtimestamp(ultimo_cambio) if ultimo_cambio else None
+            nuevo = Snapshot(version=anterior.version, generado=self.revisado, **datos)
+            if nuevo.mismos_datos(anterior):
+                return anterior
+            nuevo = Snapshot(version=anterior.version + 1, generado=nuevo.generado, **datos)
+            self._snapshot = nuevo
+        for funcion in self._suscriptores:
+            try:
+                funcion(nuevo)
+            except Exception as e:
+                print(f"Error notificando snapshot: {e}")
+        return nuevo
+
+    def _bucle(self):
+        while not self._detener.wait(self.intervalo):
+            self.refrescar()
+
+    def iniciar(self):
+        """Publica el primer snapshot y arranca el hilo de refresco"""
+        if self._hilo is not None and self._hilo.is_alive():
+            return
+        self.refrescar()
+        self._detener.clear()
+        self._hilo = threading.Thread(target=self._bucle, name='snapshot-dashboard', daemon=True)
+        self._hilo.start()
+
+    def detener(self):
+        """Detiene el hilo de refresco"""
+        self._detener.set()
+        if self._hilo is not None:
+            self._hilo.join()
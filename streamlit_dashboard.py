@@ -1,9 +1,30 @@
 import streamlit as st
-import sqlite3
 import pandas as pd
-import json
-from datetime import datetime, timedelta
+import numpy as np
+import os
+import base64
+import html
+import io
 import time
+from datetime import datetime, timedelta
+from urllib.parse import urlencode
+from indices_bd import crear_indices, verificar_planes
+import resumen_contactos
+import contadores_bd
+import busqueda_bd
+import rollups_bd
+import embudo_bd
+import archivo_bd
+import sucursales_bd
+from pool_bd import PoolConexiones
+from snapshot_bd import ServicioSnapshot
+from cache_medios import CacheMedios, Precargador
+from metricas_rendimiento import RegistroMetricas, BUCKETS
+import consultas_bd
+import exportar_bd
+
+# Inicio del rerun completo (los fragmentos se miden por separado)
+inicio_pagina = time.perf_counter()
 
 # Configuración de la página
 st.set_page_config(
@@ -47,6 +68,15 @@ st.markdown("""
         word-wrap: break-word;
     }
     
+    .message-destacado {
+        outline: 3px solid #f5c518;
+    }
+    
+    .resultado-busqueda mark {
+        background-color: #f5c518;
+        padding: 0 2px;
+    }
+    
     .message-time {
         font-size: 0.8em;
         color: #888;
@@ -81,239 +111,565 @@ st.markdown("""
 
 # *** FUNCIONES COMPATIBLES PARA BASE DE DATOS ***
 
+# PAPANATAS_SUCURSALES lista las bases de cada sucursal ("Centro=/datos/centro.db;Norte=...")
+try:
+    SUCURSALES = sucursales_bd.leer_configuracion(os.environ.get('PAPANATAS_SUCURSALES', ''))
+except ValueError as e:
+    st.error(f"PAPANATAS_SUCURSALES inválida: {e}")
+    SUCURSALES = []
+
+# PAPANATAS_DB permite apuntar el dashboard a otra base (ej. las de benchmark.py);
+# con sucursales, el detalle de chats y análisis usa la primera
+RUTA_BD = os.environ.get('PAPANATAS_DB') or (SUCURSALES[0].ruta if SUCURSALES else 'papanatas_chat.db')
+
 @st.cache_resource
-def init_connection():
-    return sqlite3.connect('papanatas_chat.db', check_same_thread=False)
+def init_registro_metricas():
+    """Métricas de rendimiento del proceso, exportables a archivo o por HTTP"""
+    registro = RegistroMetricas(archivo=os.environ.get('PAPANATAS_METRICAS_ARCHIVO'))
+    puerto = os.environ.get('PAPANATAS_METRICAS_PUERTO')
+    if puerto:
+        try:
+            registro.iniciar_servidor(int(puerto))
+        except Exception as e:
+            print(f"Error iniciando endpoint de métricas: {e}")
+    return registro
 
-conn = init_connection()
+metricas = init_registro_metricas()
 
-def verificar_estructura_bd():
-    """Verifica qué columnas están disponibles en la base de datos"""
+# Puerto del servidor de exportaciones por streaming. Desactivado si no se define:
+# no pasa por el control de acceso de Streamlit y entrega todo el historial
+PUERTO_EXPORTACION = int(os.environ.get('PAPANATAS_EXPORTAR_PUERTO') or 0)
+# Sin servidor la descarga va por st.download_button, que la arma en memoria:
+# más filas que esto se rechazan
+MAX_FILAS_DESCARGA = int(os.environ.get('PAPANATAS_EXPORTAR_MAX_FILAS') or 200_000)
+
+@st.cache_resource
+def init_servidor_exportacion():
+    """Servidor de exportaciones por streaming (opcional); devuelve su URL base o None si está desactivado o no arrancó"""
+    puerto = PUERTO_EXPORTACION
+    if not puerto:
+        return None
     try:
-        cursor = conn.cursor()
-        cursor.execute("PRAGMA table_info(pedidos)")
-        columns = cursor.fetchall()
-        
-        column_names = [col[1] for col in columns]
-        
-        tiene_comprobante_recibido = 'comprobante_recibido' in column_names
-        tiene_comprobante_url = 'comprobante_url' in column_names
-        
-        return {
-            'tiene_comprobante_recibido': tiene_comprobante_recibido,
-            'tiene_comprobante_url': tiene_comprobante_url,
-            'columnas': column_names
-        }
+        exportar_bd.iniciar_servidor(RUTA_BD, puerto, os.environ.get('PAPANATAS_EXPORTAR_HOST', '127.0.0.1'))
     except Exception as e:
-        st.error(f"Error verificando estructura: {e}")
-        return {
-            'tiene_comprobante_recibido': False,
-            'tiene_comprobante_url': False,
-            'columnas': []
-        }
+        print(f"Error iniciando servidor de exportación: {e}")
+        return None
+    # URL con la que el navegador llega al servidor (puede pasar por un proxy)
+    return os.environ.get('PAPANATAS_EXPORTAR_URL', f"http://localhost:{puerto}").rstrip('/')
+
+url_exportacion = init_servidor_exportacion()
+
+@st.cache_resource
+def init_pool():
+    pool = PoolConexiones(RUTA_BD)
+    # Abrir la conexión de escritura crea el archivo si falta y activa WAL
+    with pool.escritura():
+        pass
+    return pool
+
+pool = init_pool()
+
+@st.cache_resource
+def init_servicio_snapshot():
+    """Poller compartido por todas las sesiones del proceso"""
+    servicio = ServicioSnapshot(pool, intervalo=2.0, contactos_por_pagina=CONTACTOS_POR_PAGINA,
+                                preparar=preparar_esquema)
+    servicio.iniciar()
+    return servicio
+
+# Cantidad de mensajes por página del chat (los más recientes se muestran primero)
+MENSAJES_POR_PAGINA = 50
+# Contactos por página en la lista (el resto se navega con los botones de página)
+CONTACTOS_POR_PAGINA = 50
+
+@metricas.instrumentar('get_version_esquema')
+def get_version_esquema():
+    """Versión del esquema (lectura del encabezado de la base, sin recorrer tablas)"""
+    try:
+        return pool.leer(consultas_bd.version_esquema)
+    except Exception as e:
+        print(f"Error leyendo versión del esquema: {e}")
+        return None
+
+# Todo lo que depende del esquema se cachea por versión: se recalcula solo
+# cuando el bot o el dashboard crean o modifican tablas, índices o triggers
+version_esquema = get_version_esquema()
+
+@metricas.instrumentar('verificar_estructura_bd', cache=st.cache_data(max_entries=4))
+def verificar_estructura_bd(version_esquema):
+    """Verifica qué columnas están disponibles en la base de datos"""
+    return pool.leer(consultas_bd.estructura_bd)
 
 # Verificar estructura al inicio
-estructura_bd = verificar_estructura_bd()
+try:
+    estructura_bd = verificar_estructura_bd(version_esquema)
+except Exception as e:
+    st.error(f"Error verificando estructura: {e}")
+    estructura_bd = {
+        'tiene_comprobante_recibido': False,
+        'tiene_comprobante_url': False,
+        'columnas': []
+    }
+
+# Las preparaciones dependen solo del esquema. Las corre el hilo del servicio
+# de snapshots al arrancar y cada vez que cambia PRAGMA schema_version, así
+# que también se aplican mientras la página solo refresca fragmentos.
+@metricas.instrumentar('preparar_indices')
+def preparar_indices():
+    """Crea los índices administrados y revisa los planes de las consultas críticas"""
+    with pool.escritura() as conn:
+        return crear_indices(conn), verificar_planes(conn)
+
+@metricas.instrumentar('preparar_resumen_contactos')
+def preparar_resumen_contactos():
+    """Instala contact_summary y sus triggers (con backfill la primera vez)"""
+    with pool.escritura() as conn:
+        return resumen_contactos.instalar(conn)
+
+@metricas.instrumentar('preparar_contadores')
+def preparar_contadores():
+    """Instala los contadores de totales y sus triggers (con recálculo la primera vez)"""
+    with pool.escritura() as conn:
+        return contadores_bd.instalar(conn)
 
-@st.cache_data(ttl=2)
-def get_conversaciones_por_numero():
-    """Obtiene conversaciones con compatibilidad para diferentes estructuras de BD"""
+@metricas.instrumentar('preparar_busqueda')
+def preparar_busqueda():
+    """Instala el índice de búsqueda y sus triggers; indexa por lotes lo que falte del historial"""
+    with pool.escritura() as conn:
+        estado = busqueda_bd.instalar(conn)
+        if estado != 'pendiente':
+            if busqueda_bd.pendientes(conn):
+                busqueda_bd.indexar(conn)
+            busqueda_bd.indexar_archivos(conn)
+        return estado
+
+def preparar_esquema(version_esquema):
+    """Todas las preparaciones para `version_esquema` (ver ServicioSnapshot)
+
+    Un paso que falla queda como 'error: ...' en su estado y en 'errores', y el
+    servicio vuelve a intentarlo en su próxima vuelta.
+    """
+    preparacion = {'version_esquema': version_esquema, 'errores': []}
     try:
-        # Método más simple y robusto: consultas separadas
-        
-        # 1. Obtener conversaciones básicas
-        query_conversaciones = """
-        SELECT 
-            numero_telefono,
-            MAX(timestamp) as ultima_actividad,
-            COUNT(id) as total_mensajes,
-            MAX(CASE WHEN session_data IS NOT NULL THEN 
-                json_extract(session_data, '$.pedido.nombre') 
-            END) as nombre_cliente
-        FROM conversaciones
-        WHERE mensaje_usuario IS NOT NULL OR mensaje_bot IS NOT NULL
-        GROUP BY numero_telefono 
-        ORDER BY MAX(timestamp) DESC
-        """
-        
-        conversaciones_df = pd.read_sql_query(query_conversaciones, conn)
-        
-        # 2. Si tenemos la tabla pedidos, obtener información adicional
-        if 'estado' in estructura_bd['columnas']:
-            try:
-                # Construir query de pedidos según columnas disponibles
-                pedidos_columns = ['numero_telefono', 'estado', 'total']
-                if estructura_bd['tiene_comprobante_recibido']:
-                    pedidos_columns.append('comprobante_recibido')
-                if estructura_bd['tiene_comprobante_url']:
-                    pedidos_columns.append('comprobante_url')
-                
-                query_pedidos = f"""
-                SELECT {', '.join(pedidos_columns)},
-                       ROW_NUMBER() OVER (PARTITION BY numero_telefono ORDER BY timestamp DESC) as rn
-                FROM pedidos
-                """
-                
-                pedidos_df = pd.read_sql_query(query_pedidos, conn)
-                pedidos_df = pedidos_df[pedidos_df['rn'] == 1].drop('rn', axis=1)
-                
-                # Merge con conversaciones
-                conversaciones_df = conversaciones_df.merge(
-                    pedidos_df, 
-                    on='numero_telefono', 
-                    how='left'
-                )
-                
-            except Exception as e:
-                print(f"Error cargando pedidos: {e}")
-                # Si falla, agregar columnas vacías
-                pass
-        
-        # 3. Asegurar que todas las columnas esperadas existen
-        if 'estado' not in conversaciones_df.columns:
-            conversaciones_df['estado'] = None
-        if 'comprobante_recibido' not in conversaciones_df.columns:
-            conversaciones_df['comprobante_recibido'] = 0
-        if 'comprobante_url' not in conversaciones_df.columns:
-            conversaciones_df['comprobante_url'] = None
-        if 'total' not in conversaciones_df.columns:
-            conversaciones_df['total'] = None
-        
-        return conversaciones_df
-        
+        preparacion['indices'], preparacion['recorridos_completos'] = preparar_indices()
+    except Exception as e:
+        print(f"Error preparando índices: {e}")
+        preparacion['indices'], preparacion['recorridos_completos'] = {}, []
+        preparacion['errores'].append('indices')
+    # La tabla sesiones la crea el bot y el historial se normaliza a mano
+    # (python sesiones_bd.py --migrar): el dashboard solo la lee si existe
+    pasos = [('resumen', preparar_resumen_contactos), ('contadores', preparar_contadores),
+             ('busqueda', preparar_busqueda)]
+    for nombre, paso in pasos:
+        try:
+            preparacion[nombre] = paso()
+        except Exception as e:
+            print(f"Error preparando {nombre}: {e}")
+            preparacion[nombre] = f"error: {e}"
+            preparacion['errores'].append(nombre)
+    return preparacion
+
+@metricas.instrumentar('actualizar_rollups', cache=st.cache_data(ttl=30))
+def actualizar_rollups():
+    """Incorpora a los rollups de ventas las filas nuevas (como mucho cada 30 s por proceso)"""
+    try:
+        with pool.escritura() as conn:
+            if rollups_bd.instalar(conn) == 'pendiente':
+                return 'pendiente'
+            rollups_bd.actualizar(conn)
+            return 'ok'
     except Exception as e:
-        st.error(f"Error cargando conversaciones: {e}")
-        # Devolver DataFrame vacío con la estructura esperada
-        return pd.DataFrame(columns=[
-            'numero_telefono', 'ultima_actividad', 'total_mensajes', 
-            'nombre_cliente', 'estado', 'comprobante_recibido', 
-            'comprobante_url', 'total'
-        ])
-
-@st.cache_data(ttl=2)
-def get_mensajes_numero(numero_telefono):
-    """Obtiene mensajes de un número específico"""
+        print(f"Error actualizando rollups: {e}")
+        return f"error: {e}"
+
+@metricas.instrumentar('actualizar_embudo', cache=st.cache_data(ttl=30))
+def actualizar_embudo():
+    """Incorpora al embudo de conversación los mensajes nuevos (como mucho cada 30 s por proceso)"""
+    try:
+        with pool.escritura() as conn:
+            if embudo_bd.instalar(conn) == 'pendiente':
+                return 'pendiente'
+            embudo_bd.actualizar(conn)
+            return 'ok'
+    except Exception as e:
+        print(f"Error actualizando embudo: {e}")
+        return f"error: {e}"
+
+servicio_snapshot = init_servicio_snapshot()
+preparacion = servicio_snapshot.preparacion
+indices_bd = preparacion.get('indices', {})
+recorridos_completos = preparacion.get('recorridos_completos', [])
+estado_resumen = preparacion.get('resumen', 'pendiente')
+estado_contadores = preparacion.get('contadores', 'pendiente')
+estado_busqueda = preparacion.get('busqueda', 'pendiente')
+
+@st.cache_resource
+def init_cache_medios(_servicio):
+    """Caché en disco de los comprobantes; el precargador descarga los nuevos de cada snapshot"""
+    directorio = os.environ.get(
+        'PAPANATAS_MEDIOS_DIR', os.path.join(os.path.dirname(os.path.abspath(RUTA_BD)), 'cache_medios')
+    )
+    sid, token = os.environ.get('TWILIO_ACCOUNT_SID'), os.environ.get('TWILIO_AUTH_TOKEN')
+    cache = CacheMedios(
+        directorio,
+        max_bytes=int(os.environ.get('PAPANATAS_MEDIOS_MAX_MB', '200')) * 1024 * 1024,
+        credenciales=(sid, token) if sid and token else None,
+        # Mismo servidor alternativo de la API de Twilio que usa index.js (ej. el stub de carga_webhook.py)
+        base_api=os.environ.get('TWILIO_API_URL'),
+    )
+    precargador = Precargador(cache).iniciar()
+    _servicio.suscribir(precargador.al_publicar)
+    return cache, precargador
+
+try:
+    cache_medios, precargador_medios = init_cache_medios(servicio_snapshot)
+except Exception as e:
+    print(f"Error iniciando caché de comprobantes: {e}")
+    cache_medios, precargador_medios = None, None
+
+@metricas.instrumentar('get_version_datos')
+def get_version_datos():
+    """Versión de los datos (PRAGMA data_version): cambia solo cuando alguien hace commit
+
+    Es la clave de las cachés de abajo: mientras no cambie, se sirven sin
+    consultar la base. Si la sonda falla se usa un valor que cambia cada 2 s,
+    como el TTL que había antes.
+    """
     try:
-        query = """
-        SELECT timestamp, mensaje_usuario, mensaje_bot, step
-        FROM conversaciones 
-        WHERE numero_telefono = ?
-        ORDER BY timestamp ASC
-        """
-        return pd.read_sql_query(query, conn, params=[numero_telefono])
+        return pool.version_datos()
+    except Exception as e:
+        print(f"Error leyendo versión de datos: {e}")
+        return -int(time.time() // 2)
+
+# Los TTL de las cachés indexadas por versión son solo un respaldo: los errores
+# se devuelven como tablas vacías y no deben quedar fijos hasta el próximo commit
+@metricas.instrumentar('get_ultimo_id_conversaciones', cache=st.cache_data(ttl=60, max_entries=4))
+def get_ultimo_id_conversaciones(version=0):
+    """Obtiene el mayor id de conversaciones (lectura directa sobre la clave primaria)"""
+    try:
+        return pool.leer(consultas_bd.ultimo_id_conversaciones)
+    except Exception as e:
+        print(f"Error leyendo último id: {e}")
+        return 0
+
+@metricas.instrumentar('get_resumen_contacto', cache=st.cache_data(ttl=60, max_entries=50))
+def get_resumen_contacto(numero_telefono, version=0):
+    """Obtiene la fila de contact_summary de un contacto"""
+    try:
+        return pool.leer(lambda conn: consultas_bd.resumen_contacto(conn, numero_telefono))
+    except Exception as e:
+        st.error(f"Error cargando contacto: {e}")
+        return consultas_bd.contactos_vacios()
+
+@metricas.instrumentar('get_mensajes_numero', cache=st.cache_data(ttl=60, max_entries=50))
+def get_mensajes_numero(numero_telefono, desde_id=0, hasta_id=None):
+    """Obtiene mensajes de un número específico (opcionalmente solo los de id en (desde_id, hasta_id])
+
+    Con `hasta_id` el resultado ya no cambia: no hace falta la versión de datos.
+    """
+    try:
+        return pool.leer(
+            lambda conn: consultas_bd.mensajes_numero(conn, numero_telefono, desde_id, hasta_id)
+        )
     except Exception as e:
         st.error(f"Error cargando mensajes: {e}")
         return pd.DataFrame()
 
-@st.cache_data(ttl=10)
-def get_estadisticas_generales():
-    """Obtiene estadísticas generales con compatibilidad"""
+@metricas.instrumentar('get_pagina_mensajes', cache=st.cache_data(ttl=60, max_entries=100))
+def get_pagina_mensajes(numero_telefono, antes=None, limite=MENSAJES_POR_PAGINA, hasta_id=None, version=0):
+    """Obtiene una página de mensajes por clave (timestamp, id); devuelve (mensajes_df, hay_anteriores)
+
+    La página más reciente sin `hasta_id` cambia con cada mensaje: se pide con la versión de datos.
+    """
     try:
-        hoy = datetime.now().strftime('%Y-%m-%d')
-        
-        # Estadísticas de conversaciones (siempre disponible)
-        query_stats = f"""
-        SELECT 
-            COUNT(DISTINCT numero_telefono) as conversaciones_hoy,
-            COUNT(*) as mensajes_hoy
-        FROM conversaciones 
-        WHERE DATE(timestamp) = '{hoy}'
-        """
-        stats = pd.read_sql_query(query_stats, conn)
-        
-        # Estadísticas de pedidos (si la tabla existe)
-        try:
-            if estructura_bd['tiene_comprobante_recibido']:
-                query_pedidos = f"""
-                SELECT 
-                    COUNT(*) as pedidos_hoy,
-                    COALESCE(SUM(total), 0) as ventas_hoy,
-                    COUNT(CASE WHEN comprobante_recibido = 1 THEN 1 END) as comprobantes_recibidos,
-                    COUNT(CASE WHEN estado = 'esperando_pago' THEN 1 END) as esperando_pago
-                FROM pedidos 
-                WHERE DATE(timestamp) = '{hoy}'
-                """
-            else:
-                query_pedidos = f"""
-                SELECT 
-                    COUNT(*) as pedidos_hoy,
-                    COALESCE(SUM(total), 0) as ventas_hoy,
-                    0 as comprobantes_recibidos,
-                    COUNT(CASE WHEN estado = 'esperando_pago' THEN 1 END) as esperando_pago
-                FROM pedidos 
-                WHERE DATE(timestamp) = '{hoy}'
-                """
-            
-            pedidos = pd.read_sql_query(query_pedidos, conn)
-        except:
-            # Si no existe la tabla pedidos
-            pedidos = pd.DataFrame([{
-                'pedidos_hoy': 0,
-                'ventas_hoy': 0,
-                'comprobantes_recibidos': 0,
-                'esperando_pago': 0
-            }])
-        
-        return stats, pedidos
-        
+        return pool.leer(
+            lambda conn: consultas_bd.pagina_mensajes(conn, numero_telefono, antes, limite, hasta_id)
+        )
     except Exception as e:
-        st.error(f"Error cargando estadísticas: {e}")
-        return pd.DataFrame(), pd.DataFrame()
+        st.error(f"Error cargando mensajes: {e}")
+        return pd.DataFrame(), False
 
-@st.cache_data(ttl=2)
-def get_comprobantes_recientes():
-    """Obtiene comprobantes recientes si están disponibles"""
-    if estructura_bd['tiene_comprobante_url']:
-        try:
-            query = """
-            SELECT 
-                id, numero_telefono, nombre_cliente, total, 
-                comprobante_url, timestamp, estado
-            FROM pedidos 
-            WHERE comprobante_url IS NOT NULL 
-            ORDER BY timestamp DESC 
-            LIMIT 10
-            """
-            return pd.read_sql_query(query, conn)
-        except Exception as e:
-            st.error(f"Error cargando comprobantes: {e}")
-            return pd.DataFrame()
-    else:
+@metricas.instrumentar('get_pagina_contactos', cache=st.cache_data(ttl=60, max_entries=200))
+def get_pagina_contactos(nombre='', sufijo_telefono='', estado=None, con_comprobante=False,
+                         pagina=0, version=0):
+    """Obtiene una página de contactos filtrada en SQL sobre contact_summary
+
+    `version` es la versión de datos: mientras no cambie, la página se sirve
+    desde la caché sin consultar la base. Devuelve (contactos_df, total).
+    """
+    try:
+        return pool.leer(lambda conn: consultas_bd.pagina_contactos(
+            conn, nombre, sufijo_telefono, estado, con_comprobante, pagina, CONTACTOS_POR_PAGINA
+        ))
+    except Exception as e:
+        st.error(f"Error cargando contactos: {e}")
+        return consultas_bd.contactos_vacios(), 0
+
+@metricas.instrumentar('get_rollup_actividad', cache=st.cache_data(ttl=60, max_entries=20))
+def get_rollup_actividad(granularidad, desde, hasta, version=0):
+    """Actividad y ventas por hora o por día desde las tablas de rollup"""
+    try:
+        return pool.leer(lambda conn: consultas_bd.rollup_actividad(conn, granularidad, desde, hasta))
+    except Exception as e:
+        print(f"Error cargando rollups: {e}")
+        return pd.DataFrame(columns=['periodo', 'pedidos', 'ingresos', 'mensajes', 'contactos_unicos'])
+
+@metricas.instrumentar('get_rollup_productos', cache=st.cache_data(ttl=60, max_entries=20))
+def get_rollup_productos(granularidad, desde, hasta, version=0):
+    """Pedidos por tamaño, agregado y bebida desde las tablas de rollup"""
+    try:
+        return pool.leer(lambda conn: consultas_bd.rollup_productos(conn, granularidad, desde, hasta))
+    except Exception as e:
+        print(f"Error cargando rollups de productos: {e}")
+        return pd.DataFrame(columns=['dimension', 'valor', 'pedidos', 'ingresos'])
+
+@metricas.instrumentar('get_embudo', cache=st.cache_data(ttl=60, max_entries=20))
+def get_embudo(desde, hasta, version=0):
+    """Embudo por etapa con el tiempo mediano y p90 en cada paso, para los recorridos del periodo"""
+    try:
+        def consultar(conn):
+            tiempos_df = embudo_bd.tiempos(conn, desde, hasta)
+            return embudo_bd.embudo(conn, desde, hasta).merge(tiempos_df, on='step', how='left')
+        return pool.leer_consistente(consultar)
+    except Exception as e:
+        print(f"Error cargando embudo: {e}")
+        return pd.DataFrame()
+
+@metricas.instrumentar('get_estados_pedido', cache=st.cache_data(ttl=60, max_entries=4))
+def get_estados_pedido(version=0):
+    """Estados de pedido presentes en contact_summary (para el filtro de la lista)"""
+    try:
+        return pool.leer(consultas_bd.estados_pedido)
+    except Exception as e:
+        print(f"Error cargando estados: {e}")
+        return []
+
+@metricas.instrumentar('get_busqueda', cache=st.cache_data(ttl=60, max_entries=50))
+def get_busqueda(texto, limite=30, version=0):
+    """Mensajes que coinciden con `texto` en el índice de búsqueda (incluye meses archivados)"""
+    try:
+        return pool.leer(lambda conn: busqueda_bd.buscar(conn, texto, limite))
+    except Exception as e:
+        st.error(f"Error buscando: {e}")
         return pd.DataFrame()
 
+@metricas.instrumentar('get_posicion_mensaje')
+def get_posicion_mensaje(numero_telefono, timestamp, mensaje_id, mes=None):
+    """Cantidad de mensajes del contacto desde el mensaje dado hasta el más reciente"""
+    return pool.leer(
+        lambda conn: consultas_bd.posicion_mensaje(conn, numero_telefono, timestamp, mensaje_id, mes)
+    )
+
+def estado_vista_incremental():
+    """Estado incremental de la sesión (chat cargado y su watermark)"""
+    return st.session_state.setdefault('vista_incremental', {'chat': None})
+
+@metricas.instrumentar('get_mensajes_incremental')
+def get_mensajes_incremental(numero_telefono, paginas=1):
+    """Devuelve la ventana de mensajes del contacto agregando solo los posteriores al último visto
+
+    Se cargan páginas anteriores a medida que se piden; devuelve (mensajes_df, hay_anteriores).
+    """
+    # El chat se refresca por su cuenta, así que lee su propio watermark
+    vista = estado_vista_incremental()
+    hasta_id = get_ultimo_id_conversaciones(get_version_datos())
+    chat = vista['chat']
+    
+    # Contacto nuevo, o base de datos recreada: cargar la última página
+    if chat is None or chat['numero'] != numero_telefono or hasta_id < chat['ultimo_id']:
+        mensajes_df, hay_anteriores = get_pagina_mensajes(numero_telefono, hasta_id=hasta_id)
+        chat = vista['chat'] = {
+            'numero': numero_telefono,
+            'ultimo_id': hasta_id,
+            'mensajes': mensajes_df,
+            'paginas': 1,
+            'hay_anteriores': hay_anteriores
+        }
+    elif hasta_id > chat['ultimo_id']:
+        nuevos_df = get_mensajes_numero(numero_telefono, chat['ultimo_id'], hasta_id)
+        if len(nuevos_df) > 0:
+            # concat con categorías distintas deja object: se vuelve a compactar
+            mensajes_df = consultas_bd.compactar(
+                pd.concat([chat['mensajes'], nuevos_df], ignore_index=True)
+            )
+            # La ventana no crece mientras el chat sigue abierto: se quedan las
+            # páginas pedidas y lo que sale por arriba se vuelve a leer con "anteriores"
+            ventana = chat['paginas'] * MENSAJES_POR_PAGINA
+            if len(mensajes_df) > ventana:
+                mensajes_df = mensajes_df.iloc[-ventana:].reset_index(drop=True)
+                chat['hay_anteriores'] = True
+            chat['mensajes'] = mensajes_df
+        chat['ultimo_id'] = hasta_id
+    
+    while chat['paginas'] < paginas and chat['hay_anteriores'] and len(chat['mensajes']) > 0:
+        primero = chat['mensajes'].iloc[0]
+        anteriores_df, chat['hay_anteriores'] = get_pagina_mensajes(
+            numero_telefono, antes=(consultas_bd.clave_fecha(primero['timestamp']), int(primero['id']))
+        )
+        chat['mensajes'] = consultas_bd.compactar(
+            pd.concat([anteriores_df, chat['mensajes']], ignore_index=True)
+        )
+        chat['paginas'] += 1
+    
+    return chat['mensajes'], chat['hay_anteriores']
+
+# Descripción de cada step del bot (estado del chat y embudo de conversación)
+DESCRIPCIONES_PASO = {
+    'inicio': '🟢 Iniciando conversación',
+    'esperando_nombre': '✏️ Esperando nombre',
+    'esperando_tamaño': '🍟 Seleccionando tamaño',
+    'esperando_agregado_opcion': '🧀 Preguntando agregado',
+    'esperando_tipo_agregado': '➕ Seleccionando agregado',
+    'esperando_bebida': '🥤 Preguntando bebida',
+    'esperando_confirmacion_final': '✅ Confirmando pedido',
+    'modificando_pedido': '🔄 Modificando pedido',
+    'esperando_comprobante': '📱 Esperando comprobante',
+    'pedido_completado': '🎉 Pedido completado'
+}
+
 # Funciones auxiliares
 def format_phone_number(numero):
     if numero and numero.startswith('whatsapp:'):
         numero = numero.replace('whatsapp:', '')
     return f"***{numero[-4:]}" if numero and len(numero) >= 4 else numero
 
-def format_timestamp(timestamp_str):
-    try:
-        dt = datetime.strptime(timestamp_str, '%Y-%m-%d %H:%M:%S')
-        now = datetime.now()
+# Tablas de textos ya formateados: formatear una columna es indexarlas, sin strftime por fila
+HORAS_MINUTO = np.array([f"{h:02d}:{m:02d}" for h in range(24) for m in range(60)], dtype=object)
+DIAS_MES = np.array([f"{d:02d}/{m:02d} " for m in range(1, 13) for d in range(1, 32)], dtype=object)
+
+def formatear_momentos(momentos, ahora=None):
+    """Columna de fechas como 'HH:MM' (hoy), 'Ayer HH:MM' o 'dd/mm HH:MM', sin recorrer filas
+
+    Acepta datetimes (DataFrames compactados) o textos de SQLite.
+    """
+    momentos = pd.to_datetime(pd.Series(momentos), format=consultas_bd.FORMATO_FECHA, errors='coerce')
+    minuto = (momentos.dt.hour * 60 + momentos.dt.minute).fillna(0).to_numpy(dtype=int)
+    dia = ((momentos.dt.month - 1) * 31 + momentos.dt.day - 1).fillna(0).to_numpy(dtype=int)
+    dias = (pd.Timestamp(ahora or datetime.now()).normalize() - momentos.dt.normalize()).dt.days.to_numpy()
+    hora = HORAS_MINUTO[minuto]
+    texto = np.where(dias == 0, hora, np.where(dias == 1, "Ayer " + hora, DIAS_MES[dia] + hora))
+    return pd.Series(np.where(momentos.notna(), texto, ""), index=momentos.index, dtype=object)
+
+def enmascarar_telefonos(numeros):
+    """Versión por columna de format_phone_number"""
+    numeros = pd.Series(numeros).astype('string').str.removeprefix('whatsapp:')
+    return ('***' + numeros.str[-4:]).where(numeros.str.len() >= 4, numeros).fillna('')
+
+def format_cambio(momento):
+    """Hora del último cambio de datos, con cuánto hace si fue hoy"""
+    if momento is None:
+        return "desconocido"
+    if momento.date() != datetime.now().date():
+        return momento.strftime('%d/%m %H:%M')
+    segundos = int((datetime.now() - momento).total_seconds())
+    if segundos < 60:
+        hace = f"{segundos} s"
+    elif segundos < 3600:
+        hace = f"{segundos // 60} min"
+    else:
+        hace = f"{segundos // 3600} h {segundos % 3600 // 60} min"
+    return f"{momento.strftime('%H:%M:%S')} (hace {hace})"
+
+def render_mensajes_html(mensajes_df, destacado=None):
+    """Arma el HTML de toda la ventana de mensajes para mostrarlo en un solo bloque
+
+    `destacado` es el id del mensaje que se resalta (resultado de búsqueda).
+    """
+    partes = ['<div class="chat-container">']
+    horas = formatear_momentos(mensajes_df['timestamp'])
+    for row, timestamp in zip(mensajes_df.itertuples(index=False), horas):
+        extra = ' message-destacado' if destacado is not None and row.id == destacado else ''
         
-        if dt.date() == now.date():
-            return dt.strftime('%H:%M')
-        elif dt.date() == (now - timedelta(days=1)).date():
-            return f"Ayer {dt.strftime('%H:%M')}"
-        else:
-            return dt.strftime('%d/%m %H:%M')
-    except:
-        return timestamp_str
+        # Mensaje del usuario
+        if row.mensaje_usuario and row.mensaje_usuario.strip():
+            partes.append(
+                f'<div class="message-user{extra}"><strong>📱 Cliente:</strong><br>'
+                f'{html.escape(row.mensaje_usuario)}'
+                f'<div class="message-time">{timestamp}</div></div>'
+            )
+        
+        # Mensaje del bot
+        if row.mensaje_bot and row.mensaje_bot.strip():
+            mensaje_bot = html.escape(row.mensaje_bot).replace('\n', '<br>')
+            partes.append(
+                f'<div class="message-bot{extra}"><strong>🍟 Papanatas:</strong><br>'
+                f'{mensaje_bot}'
+                f'<div class="message-time">{timestamp}</div></div>'
+            )
+    partes.append('</div>')
+    return ''.join(partes)
+
+def leer_archivo(ruta):
+    with open(ruta, 'rb') as f:
+        return f.read()
+
+def mostrar_comprobante(url):
+    """Comprobante del pedido desde la caché local
+
+    Si todavía no está se lo pide al precargador y se muestra el enlace: el chat
+    no espera la descarga, y al refrescarse ya lo encuentra en disco.
+    """
+    ruta = cache_medios.obtener(url, descargar=False) if cache_medios is not None else None
+    if ruta is None:
+        st.markdown(f"**Comprobante:** [📸 Ver imagen]({url})")
+        if precargador_medios is not None:
+            precargador_medios.encolar([url])
+            if not cache_medios.fallo_reciente(url):
+                st.caption("⏳ Descargando comprobante…")
+    elif cache_medios.es_imagen(ruta):
+        miniatura = cache_medios.miniatura(url, descargar=False)
+        st.image(miniatura or ruta, caption="📸 Comprobante")
+        with st.expander("🔍 Ver imagen completa"):
+            st.image(ruta)
+    else:
+        st.download_button(
+            "📄 Descargar comprobante", data=lambda: leer_archivo(ruta),
+            file_name=f"comprobante{os.path.splitext(ruta)[1]}", on_click='ignore'
+        )
+
+BADGE_COMPROBANTE_OK = '<span class="estado-comprobante">📸 Comprobante OK</span>'
+BADGES_ESTADO = {
+    'esperando_pago': '<span class="estado-esperando">⏳ Esperando pago</span>',
+    'comprobante_recibido': '<span class="estado-comprobante">📸 Comprobante recibido</span>',
+    'completado': '<span class="estado-completado">✅ Completado</span>',
+}
 
 def mostrar_estado_pedido(estado, comprobante_recibido):
     if comprobante_recibido == 1:
-        return '<span class="estado-comprobante">📸 Comprobante OK</span>'
-    elif estado == 'esperando_pago':
-        return '<span class="estado-esperando">⏳ Esperando pago</span>'
-    elif estado == 'comprobante_recibido':
-        return '<span class="estado-comprobante">📸 Comprobante recibido</span>'
-    elif estado == 'completado':
-        return '<span class="estado-completado">✅ Completado</span>'
-    elif estado:
-        return f'<span class="estado-esperando">{estado}</span>'
-    else:
-        return '<span class="estado-esperando">Sin pedido</span>'
+        return BADGE_COMPROBANTE_OK
+    if pd.isna(estado) or not estado:
+        estado = consultas_bd.SIN_PEDIDO
+    return BADGES_ESTADO.get(estado, f'<span class="estado-esperando">{estado}</span>')
+
+def badges_estado(estados, comprobantes_recibidos):
+    """Versión por columna de mostrar_estado_pedido"""
+    estados = pd.Series(estados).astype(object)
+    recibido = pd.to_numeric(pd.Series(comprobantes_recibidos, index=estados.index), errors='coerce').eq(1)
+    otros = '<span class="estado-esperando">' + estados.fillna(consultas_bd.SIN_PEDIDO).astype(str) + '</span>'
+    return estados.map(BADGES_ESTADO).fillna(otros).mask(recibido, BADGE_COMPROBANTE_OK)
+
+def etiquetas_contactos(contactos_df):
+    """Texto del botón y badge de estado de cada contacto de la lista, armados por columna"""
+    nombres = contactos_df['nombre_cliente'].astype(object).where(
+        contactos_df['nombre_cliente'].astype(bool) & contactos_df['nombre_cliente'].notna(), "Cliente Anónimo"
+    )
+    boton = (
+        "👤 " + nombres.astype(str)
+        + "\n📱 " + enmascarar_telefonos(contactos_df['numero_telefono'])
+        + "\n🕐 " + formatear_momentos(contactos_df['ultima_actividad'])
+        + " • " + contactos_df['total_mensajes'].astype(str) + " msg"
+    )
+    # Sobre todo el índice: sin ningún total en la página un subconjunto vacío queda float64
+    total = pd.to_numeric(contactos_df['total'], errors='coerce')
+    boton = boton + total.map(lambda t: f"\n💰 ${t:,.0f}" if pd.notna(t) and t != 0 else "").astype(str)
+    recibido = pd.to_numeric(contactos_df['comprobante_recibido'], errors='coerce').eq(1)
+    esperando = contactos_df['estado'].astype(object).eq('esperando_pago')
+    boton = boton + pd.Series("", index=boton.index).mask(esperando, " ⏳").mask(recibido, " 📸")
+    badge = badges_estado(contactos_df['estado'], contactos_df['comprobante_recibido'])
+    return pd.DataFrame({
+        'boton': boton,
+        'badge': badge.where(contactos_df['estado'].notna()),
+    }, index=contactos_df.index)
 
 # *** INTERFAZ PRINCIPAL ***
 
@@ -333,31 +689,53 @@ if not estructura_bd['tiene_comprobante_recibido'] or not estructura_bd['tiene_c
     ```
     """)
 
-# Sidebar con configuraciones
-with st.sidebar:
-    st.header("⚙️ Configuración")
-    
-    auto_refresh = st.checkbox("🔄 Auto-refresh", value=True)
-    refresh_interval = st.slider("Intervalo (segundos)", 1, 10, 3)
-    
-    # Manual refresh button
-    if st.button("🔄 Actualizar Ahora"):
-        st.cache_data.clear()
-        st.rerun()
-    
-    st.markdown("---")
-    
-    # Estado de la base de datos
-    st.header("🗄️ Estado de BD")
-    st.write(f"**Columnas disponibles:**")
-    st.write(f"• comprobante_recibido: {'✅' if estructura_bd['tiene_comprobante_recibido'] else '❌'}")
-    st.write(f"• comprobante_url: {'✅' if estructura_bd['tiene_comprobante_url'] else '❌'}")
-    
-    st.markdown("---")
+# *** PANELES CON REFRESCO PROPIO ***
+# Cada panel es un fragmento de Streamlit que se vuelve a ejecutar solo en su
+# intervalo, sin bloquear el script ni redibujar el resto de la página.
+
+def intervalo_refresco(segundos):
+    """Intervalo de refresco de un panel, o None si el auto-refresh está desactivado"""
+    return segundos if auto_refresh else None
+
+def miniaturas_disponibles(comprobantes_df):
+    """URLs de la lista que ya tienen miniatura en la caché local"""
+    if cache_medios is None:
+        return frozenset()
+    return frozenset(url for url in comprobantes_df['comprobante_url'] if cache_medios.tiene_miniatura(url))
+
+def render_comprobantes_html(comprobantes_df, miniaturas=frozenset()):
+    """Arma el HTML de la lista de comprobantes recientes
+
+    Los que ya están en la caché local se muestran con su miniatura incrustada;
+    el resto mantiene el enlace al original mientras el precargador los descarga.
+    """
+    partes = []
+    horas = formatear_momentos(comprobantes_df['timestamp'])
+    for row, timestamp in zip(comprobantes_df.itertuples(index=False), horas):
+        cliente = row.nombre_cliente if row.nombre_cliente else "Cliente Anónimo"
+        datos = cache_medios.miniatura(row.comprobante_url, descargar=False) if row.comprobante_url in miniaturas else None
+        if datos:
+            comprobante = (f'<img src="data:image/jpeg;base64,{base64.b64encode(datos).decode("ascii")}" '
+                           'style="max-width: 100%; border-radius: 4px; margin-top: 4px;">')
+        else:
+            comprobante = f'📸 <a href="{html.escape(row.comprobante_url)}" target="_blank">Ver comprobante</a>'
+        partes.append(
+            '<div style="background-color: #f0f8ff; padding: 8px; border-radius: 5px; margin: 5px 0;">'
+            f'<small><strong>{html.escape(cliente)}</strong><br>'
+            f'💰 ${row.total:,.0f} • {timestamp}<br>'
+            f'{comprobante}</small>'
+            '</div>'
+        )
+    return ''.join(partes)
+
+@metricas.medir_seccion('metricas')
+def panel_metricas():
+    """Estadísticas del día y comprobantes recientes (sidebar), leídas del snapshot compartido"""
+    snapshot = servicio_snapshot.actual()
     
     # Estadísticas generales
     try:
-        stats, pedidos = get_estadisticas_generales()
+        stats, pedidos = snapshot.estadisticas, snapshot.pedidos_hoy
         
         st.header("📊 Estadísticas Hoy")
         
@@ -368,122 +746,232 @@ with st.sidebar:
         if len(pedidos) > 0:
             st.metric("🛒 Pedidos", pedidos.iloc[0]['pedidos_hoy'])
             st.metric("💰 Ventas", f"${pedidos.iloc[0]['ventas_hoy']:,.0f}")
-            if estructura_bd['tiene_comprobante_recibido']:
+            if snapshot.estructura['tiene_comprobante_recibido']:
                 st.metric("📸 Comprobantes", pedidos.iloc[0]['comprobantes_recibidos'])
                 st.metric("⏳ Pendientes", pedidos.iloc[0]['esperando_pago'])
         
+        if snapshot.error:
+            st.error(f"Error cargando estadísticas: {snapshot.error}")
+        
     except Exception as e:
         st.error(f"Error cargando estadísticas: {str(e)}")
     
     st.markdown("---")
     
     # Sección de comprobantes recientes (solo si está disponible)
-    if estructura_bd['tiene_comprobante_url']:
+    if snapshot.estructura['tiene_comprobante_url']:
         st.header("📸 Comprobantes Recientes")
-        try:
-            comprobantes_df = get_comprobantes_recientes()
-            if len(comprobantes_df) > 0:
-                for i, row in comprobantes_df.iterrows():
-                    cliente = row['nombre_cliente'] if row['nombre_cliente'] else "Cliente Anónimo"
-                    timestamp = format_timestamp(row['timestamp'])
-                    st.markdown(f"""
-                    <div style="background-color: #f0f8ff; padding: 8px; border-radius: 5px; margin: 5px 0;">
-                        <small><strong>{cliente}</strong><br>
-                        💰 ${row['total']:,.0f} • {timestamp}<br>
-                        📸 <a href="{row['comprobante_url']}" target="_blank">Ver comprobante</a></small>
-                    </div>
-                    """, unsafe_allow_html=True)
-            else:
-                st.info("No hay comprobantes recientes")
-        except Exception as e:
-            st.error(f"Error: {str(e)}")
+        if len(snapshot.comprobantes) > 0:
+            # El HTML solo se rearma con una versión nueva del snapshot o cuando llegan miniaturas
+            miniaturas = miniaturas_disponibles(snapshot.comprobantes)
+            cache = st.session_state.get('html_comprobantes')
+            if cache is None or cache[0] != (snapshot.version, miniaturas):
+                cache = ((snapshot.version, miniaturas),
+                         render_comprobantes_html(snapshot.comprobantes, miniaturas))
+                st.session_state.html_comprobantes = cache
+            st.markdown(cache[1], unsafe_allow_html=True)
+        else:
+            st.info("No hay comprobantes recientes")
     else:
         st.header("📸 Comprobantes")
         st.info("Función no disponible\n\nEjecuta la migración de BD")
+    
+    st.caption(
+        f"Snapshot v{snapshot.version} • revisado {servicio_snapshot.revisado.strftime('%H:%M:%S')} • "
+        f"último cambio {format_cambio(snapshot.cambiado)}"
+    )
 
-# Auto-refresh logic
-if auto_refresh:
-    placeholder = st.empty()
-    with placeholder.container():
-        st.info(f"🔄 Auto-actualizando cada {refresh_interval} segundos...")
-    time.sleep(refresh_interval)
-    placeholder.empty()
-    st.rerun()
+def reiniciar_pagina_contactos():
+    """Callback de los filtros: vuelve a la primera página"""
+    st.session_state.pagina_contactos = 0
 
-# Layout principal
-col1, col2 = st.columns([1, 2])
+def cambiar_pagina_contactos(delta):
+    """Callback de la navegación de la lista de contactos"""
+    st.session_state.pagina_contactos = max(0, st.session_state.get('pagina_contactos', 0) + delta)
 
-with col1:
+@metricas.medir_seccion('contactos')
+def panel_contactos():
+    """Lista de conversaciones activas (una página, con filtros resueltos en SQL)"""
     st.subheader("👥 Conversaciones Activas")
     
+    # Filtros
+    col_nombre, col_telefono = st.columns(2)
+    with col_nombre:
+        filtro_nombre = st.text_input("🔎 Nombre", key="filtro_nombre", on_change=reiniciar_pagina_contactos)
+    with col_telefono:
+        filtro_telefono = st.text_input("📱 Termina en", key="filtro_telefono", on_change=reiniciar_pagina_contactos)
+    col_estado, col_comprobante = st.columns(2)
+    with col_estado:
+        filtro_estado = st.selectbox(
+            "Estado", ["Todos", consultas_bd.SIN_PEDIDO] + get_estados_pedido(get_version_datos()),
+            key="filtro_estado", on_change=reiniciar_pagina_contactos
+        )
+    with col_comprobante:
+        filtro_comprobante = st.checkbox(
+            "📸 Con comprobante", key="filtro_comprobante", on_change=reiniciar_pagina_contactos
+        )
+    
     try:
-        conversaciones_df = get_conversaciones_por_numero()
+        pagina = st.session_state.setdefault('pagina_contactos', 0)
+        filtros = (
+            filtro_nombre.strip(),
+            filtro_telefono.strip(),
+            None if filtro_estado == "Todos" else filtro_estado,
+            filtro_comprobante
+        )
+        snapshot = servicio_snapshot.actual()
+        if pagina == 0 and not any(filtros) and snapshot.error is None:
+            # Primera página sin filtros: la trae el snapshot compartido
+            conversaciones_df, total_contactos = snapshot.contactos, snapshot.total_contactos
+        else:
+            conversaciones_df, total_contactos = get_pagina_contactos(
+                *filtros, pagina, get_version_datos()
+            )
         
         if len(conversaciones_df) > 0:
-            # Variable de estado para el contacto seleccionado
+            # Variable de estado para el contacto seleccionado (se conserva al cambiar de página)
             if 'selected_contact' not in st.session_state:
                 st.session_state.selected_contact = conversaciones_df.iloc[0]['numero_telefono']
             
-            # Lista de contactos
-            for i, row in conversaciones_df.iterrows():
-                numero = row['numero_telefono']
-                nombre = row['nombre_cliente'] if row['nombre_cliente'] else "Cliente Anónimo"
-                ultima_actividad = format_timestamp(row['ultima_actividad'])
-                total_mensajes = row['total_mensajes']
-                
-                # Información del pedido (si está disponible)
-                estado_pedido = row.get('estado')
-                comprobante_recibido = row.get('comprobante_recibido', 0)
-                total_pedido = row.get('total')
-                
+            # Lista de contactos: textos y badges armados por columna, no fila por fila
+            etiquetas = etiquetas_contactos(conversaciones_df)
+            for numero, button_text, estado_html in zip(
+                conversaciones_df['numero_telefono'], etiquetas['boton'], etiquetas['badge']
+            ):
                 # Determinar si está activo
                 is_active = (numero == st.session_state.selected_contact)
                 
-                # Crear texto del botón
-                button_text = f"👤 {nombre}\n📱 {format_phone_number(numero)}\n🕐 {ultima_actividad} • {total_mensajes} msg"
-                
-                if total_pedido:
-                    button_text += f"\n💰 ${total_pedido:,.0f}"
-                
-                if comprobante_recibido == 1:
-                    button_text += " 📸"
-                elif estado_pedido == 'esperando_pago':
-                    button_text += " ⏳"
-                
                 # Botón para seleccionar contacto
                 if st.button(
                     button_text,
-                    key=f"contact_{i}",
-                    use_container_width=True
+                    key=f"contact_{numero}",
+                    width='stretch'
                 ):
                     st.session_state.selected_contact = numero
                     st.rerun()
                 
                 # Mostrar estado del pedido si existe
-                if estado_pedido:
-                    estado_html = mostrar_estado_pedido(estado_pedido, comprobante_recibido)
+                if pd.notna(estado_html):
                     st.markdown(estado_html, unsafe_allow_html=True)
                 
                 if is_active:
                     st.markdown(f"<div style='border: 2px solid #25d366; border-radius: 8px; padding: 2px;'></div>", unsafe_allow_html=True)
                 
                 st.markdown("---")
-        else:
-            st.info("📭 No hay conversaciones registradas aún.")
+        elif total_contactos == 0 and pagina == 0:
+            st.info("📭 No hay conversaciones que coincidan.")
+        
+        # Navegación entre páginas
+        total_paginas = max(1, -(-total_contactos // CONTACTOS_POR_PAGINA))
+        col_anterior, col_pagina, col_siguiente = st.columns([1, 2, 1])
+        with col_anterior:
+            st.button("◀️", key="contactos_anterior", disabled=pagina == 0,
+                      on_click=cambiar_pagina_contactos, args=(-1,))
+        with col_pagina:
+            st.caption(f"Página {pagina + 1} de {total_paginas} • {total_contactos} contactos")
+        with col_siguiente:
+            st.button("▶️", key="contactos_siguiente", disabled=pagina + 1 >= total_paginas,
+                      on_click=cambiar_pagina_contactos, args=(1,))
             
     except Exception as e:
         st.error(f"Error cargando conversaciones: {str(e)}")
 
-with col2:
+# Mensajes anteriores a un resultado de búsqueda que se ven arriba de él en el chat
+CONTEXTO_BUSQUEDA = 3
+
+def fragmento_html(fragmento):
+    """Fragmento de un resultado, escapado y con las coincidencias resaltadas"""
+    return (html.escape(fragmento or '').replace('\n', ' ')
+            .replace(busqueda_bd.INICIO_COINCIDENCIA, '<mark>')
+            .replace(busqueda_bd.FIN_COINCIDENCIA, '</mark>'))
+
+def ir_a_mensaje(numero_telefono, timestamp, mensaje_id, mes):
+    """Abre el chat del contacto con la ventana cargada hasta el mensaje encontrado"""
+    posicion = get_posicion_mensaje(numero_telefono, timestamp, mensaje_id, mes)
+    st.session_state.selected_contact = numero_telefono
+    st.session_state.setdefault('paginas_chat', {}).pop(numero_telefono, None)
+    st.session_state.mensaje_destacado = {
+        'numero': numero_telefono,
+        'id': mensaje_id,
+        'limite': posicion + CONTEXTO_BUSQUEDA
+    }
+
+def quitar_destacado():
+    """Callback del chat: vuelve a la ventana normal (los mensajes más recientes)"""
+    st.session_state.pop('mensaje_destacado', None)
+
+@metricas.medir_seccion('busqueda')
+def panel_busqueda():
+    """Búsqueda de texto completo en todos los mensajes; cada resultado abre el chat en ese mensaje"""
+    texto = st.text_input(
+        "🔍 Buscar en mensajes", key="texto_busqueda",
+        placeholder='palabras, "frase exacta" o prefijo*'
+    ).strip()
+    if not texto:
+        return
+    resultados = get_busqueda(texto, version=get_version_datos())
+    if len(resultados) == 0:
+        st.info("Sin resultados")
+        return
+    st.caption(f"{len(resultados)} resultados más relevantes")
+    telefonos = enmascarar_telefonos(resultados['numero_telefono'])
+    horas = formatear_momentos(resultados['timestamp'])
+    with st.container(height=320):
+        for row, telefono, hora in zip(resultados.itertuples(index=False), telefonos, horas):
+            if busqueda_bd.INICIO_COINCIDENCIA in (row.fragmento_usuario or ''):
+                fragmento = f"📱 {fragmento_html(row.fragmento_usuario)}"
+            else:
+                fragmento = f"🍟 {fragmento_html(row.fragmento_bot)}"
+            st.markdown(
+                f'<div class="resultado-busqueda"><small><strong>{telefono}</strong>'
+                f' • {hora}<br>{fragmento}</small></div>',
+                unsafe_allow_html=True
+            )
+            if st.button("Ir al mensaje", key=f"busqueda_{row.mes}_{row.id}"):
+                try:
+                    ir_a_mensaje(row.numero_telefono, row.timestamp, int(row.id), row.mes)
+                except Exception as e:
+                    st.error(f"Error abriendo el mensaje: {e}")
+                else:
+                    # El chat es otro fragmento: hace falta rerun de toda la página
+                    st.rerun()
+
+def cargar_pagina_anterior(numero_telefono):
+    """Callback del botón de historial: agrega una página más a la ventana del contacto"""
+    paginas_chat = st.session_state.setdefault('paginas_chat', {})
+    paginas_chat[numero_telefono] = paginas_chat.get(numero_telefono, 1) + 1
+
+@metricas.medir_seccion('chat')
+def panel_chat():
+    """Chat del contacto seleccionado"""
     if 'selected_contact' in st.session_state:
         try:
-            # Obtener mensajes del contacto seleccionado
-            mensajes_df = get_mensajes_numero(st.session_state.selected_contact)
+            # Obtener la ventana de mensajes del contacto seleccionado
+            paginas_chat = st.session_state.setdefault('paginas_chat', {})
+            paginas = paginas_chat.get(st.session_state.selected_contact, 1)
+            destacado = st.session_state.get('mensaje_destacado')
+            if destacado and destacado['numero'] != st.session_state.selected_contact:
+                destacado = None
+            if destacado:
+                # Ventana que empieza unos mensajes antes del resultado de búsqueda
+                mensajes_df, hay_anteriores = get_pagina_mensajes(
+                    st.session_state.selected_contact,
+                    limite=destacado['limite'] + MENSAJES_POR_PAGINA * (paginas - 1),
+                    version=get_version_datos()
+                )
+            elif modo_incremental:
+                mensajes_df, hay_anteriores = get_mensajes_incremental(
+                    st.session_state.selected_contact, paginas
+                )
+            else:
+                mensajes_df, hay_anteriores = get_pagina_mensajes(
+                    st.session_state.selected_contact, limite=MENSAJES_POR_PAGINA * paginas,
+                    version=get_version_datos()
+                )
             
             if len(mensajes_df) > 0:
                 # Obtener información del cliente
-                conversaciones_df = get_conversaciones_por_numero()
-                cliente_info = conversaciones_df[conversaciones_df['numero_telefono'] == st.session_state.selected_contact]
+                cliente_info = get_resumen_contacto(st.session_state.selected_contact, get_version_datos())
                 
                 if len(cliente_info) > 0:
                     nombre_cliente = cliente_info.iloc[0]['nombre_cliente']
@@ -498,13 +986,13 @@ with col2:
                     else:
                         header_text = f"💬 Chat con {format_phone_number(st.session_state.selected_contact)}"
                     
-                    if total_pedido:
+                    if pd.notna(total_pedido) and total_pedido:
                         header_text += f" • 💰 ${total_pedido:,.0f}"
                     
                     st.subheader(header_text)
                     
-                    # Mostrar estado del pedido
-                    if estado_pedido:
+                    # Mostrar estado del pedido (estado es category: NaN si no hay pedido)
+                    if pd.notna(estado_pedido) and estado_pedido:
                         col_estado, col_comprobante = st.columns([1, 1])
                         with col_estado:
                             estado_html = mostrar_estado_pedido(estado_pedido, comprobante_recibido)
@@ -512,57 +1000,36 @@ with col2:
                         
                         with col_comprobante:
                             if comprobante_url:
-                                st.markdown(f"**Comprobante:** [📸 Ver imagen]({comprobante_url})")
+                                mostrar_comprobante(comprobante_url)
                 else:
                     st.subheader(f"💬 Chat con {format_phone_number(st.session_state.selected_contact)}")
                 
-                # Contenedor del chat
-                st.markdown('<div class="chat-container">', unsafe_allow_html=True)
+                # Cargar la página anterior bajo demanda
+                if hay_anteriores:
+                    st.button(
+                        "⬆️ Cargar mensajes anteriores",
+                        key="cargar_anteriores",
+                        on_click=cargar_pagina_anterior,
+                        args=(st.session_state.selected_contact,)
+                    )
                 
-                # Mostrar mensajes
-                for i, row in mensajes_df.iterrows():
-                    timestamp = format_timestamp(row['timestamp'])
-                    
-                    # Mensaje del usuario
-                    if row['mensaje_usuario'] and row['mensaje_usuario'].strip():
-                        st.markdown(f"""
-                        <div class="message-user">
-                            <strong>📱 Cliente:</strong><br>
-                            {row['mensaje_usuario']}
-                            <div class="message-time">{timestamp}</div>
-                        </div>
-                        """, unsafe_allow_html=True)
-                    
-                    # Mensaje del bot
-                    if row['mensaje_bot'] and row['mensaje_bot'].strip():
-                        mensaje_bot = row['mensaje_bot'].replace('\n', '<br>')
-                        st.markdown(f"""
-                        <div class="message-bot">
-                            <strong>🍟 Papanatas:</strong><br>
-                            {mensaje_bot}
-                            <div class="message-time">{timestamp}</div>
-                        </div>
-                        """, unsafe_allow_html=True)
+                if destacado:
+                    col_aviso, col_volver = st.columns([3, 1])
+                    with col_aviso:
+                        st.caption("🔍 El resultado de la búsqueda está resaltado")
+                    with col_volver:
+                        st.button("✖ Volver", key="quitar_destacado", on_click=quitar_destacado)
                 
-                st.markdown('</div>', unsafe_allow_html=True)
+                # Toda la ventana visible en un solo bloque HTML
+                st.markdown(
+                    render_mensajes_html(mensajes_df, destacado['id'] if destacado else None),
+                    unsafe_allow_html=True
+                )
                 
                 # Estado actual del flujo
                 if len(mensajes_df) > 0:
                     ultimo_step = mensajes_df.iloc[-1]['step']
-                    step_descriptions = {
-                        'inicio': '🟢 Iniciando conversación',
-                        'esperando_nombre': '✏️ Esperando nombre',
-                        'esperando_tamaño': '🍟 Seleccionando tamaño',
-                        'esperando_agregado_opcion': '🧀 Preguntando agregado',
-                        'esperando_tipo_agregado': '➕ Seleccionando agregado',
-                        'esperando_bebida': '🥤 Preguntando bebida',
-                        'esperando_confirmacion_final': '✅ Confirmando pedido',
-                        'modificando_pedido': '🔄 Modificando pedido',
-                        'esperando_comprobante': '📱 Esperando comprobante',
-                        'pedido_completado': '🎉 Pedido completado'
-                    }
-                    
-                    estado_actual = step_descriptions.get(ultimo_step, f"📍 {ultimo_step}")
+                    estado_actual = DESCRIPCIONES_PASO.get(ultimo_step, f"📍 {ultimo_step}")
                     st.info(f"**Estado del flujo:** {estado_actual}")
                 
             else:
@@ -573,38 +1040,518 @@ with col2:
     else:
         st.info("👆 Selecciona una conversación para ver los mensajes")
 
+# Sidebar con configuraciones
+with st.sidebar, metricas.seccion('sidebar'):
+    st.header("⚙️ Configuración")
+    
+    auto_refresh = st.checkbox("🔄 Auto-refresh", value=True)
+    refresh_interval = st.slider("Intervalo chat (segundos)", 1, 10, 3)
+    intervalo_contactos = st.slider("Intervalo contactos (segundos)", 1, 30, 5)
+    intervalo_metricas = st.slider("Intervalo métricas (segundos)", 5, 60, 10)
+    modo_incremental = st.checkbox(
+        "⚡ Modo incremental", value=True,
+        help="Consulta solo los mensajes nuevos desde la última actualización"
+    )
+    
+    # Manual refresh button
+    if st.button("🔄 Actualizar Ahora"):
+        st.cache_data.clear()
+        st.session_state.pop('vista_incremental', None)
+        st.rerun()
+    
+    st.markdown("---")
+    
+    # Estado de la base de datos
+    st.header("🗄️ Estado de BD")
+    st.write(f"**Columnas disponibles:**")
+    st.write(f"• comprobante_recibido: {'✅' if estructura_bd['tiene_comprobante_recibido'] else '❌'}")
+    st.write(f"• comprobante_url: {'✅' if estructura_bd['tiene_comprobante_url'] else '❌'}")
+    
+    indices_ok = sum(1 for estado in indices_bd.values() if estado == 'ok')
+    st.write(f"**Índices:** {indices_ok}/{len(indices_bd)} {'✅' if indices_bd and indices_ok == len(indices_bd) else '⚠️'}")
+    st.write(f"• contact_summary: {'✅' if estado_resumen in ('ok', 'creada') else '⚠️ ' + estado_resumen}")
+    st.write(f"• contadores: {'✅' if estado_contadores in ('ok', 'creada') else '⚠️ ' + estado_contadores}")
+    st.write(f"• búsqueda: {'✅' if estado_busqueda in ('ok', 'creada') else '⚠️ ' + estado_busqueda}")
+    meses_archivo = archivo_bd.meses_archivados(RUTA_BD)
+    if meses_archivo:
+        st.write(f"• Archivo: {len(meses_archivo)} meses ({meses_archivo[0]} a {meses_archivo[-1]})")
+    for nombre, detalle in recorridos_completos:
+        st.warning(f"⚠️ **{nombre}** recorre la tabla completa (`{detalle}`)")
+    
+    estadisticas_pool = pool.estadisticas()
+    st.write("**Pool de conexiones:**")
+    st.caption(
+        f"Checkouts: {estadisticas_pool['checkouts']} • Esperas: {estadisticas_pool['esperas']} • "
+        f"Reintentos BUSY: {estadisticas_pool['reintentos_busy']} • Fallos BUSY: {estadisticas_pool['errores_busy']}"
+    )
+    st.caption(
+        f"Conexiones: {estadisticas_pool['conexiones_en_uso']} en uso / "
+        f"{estadisticas_pool['conexiones_libres']} libres (máx. {pool.max_conexiones})"
+    )
+    st.caption(
+        f"Versión de datos: {get_version_datos()} • Refrescos sin cambios (sin consultar): "
+        f"{servicio_snapshot.consultas_evitadas}"
+    )
+    if cache_medios is not None:
+        estadisticas_medios = cache_medios.estadisticas()
+        st.write("**Caché de comprobantes:**")
+        st.caption(
+            f"{estadisticas_medios['archivos']} archivos • {estadisticas_medios['bytes'] / 1024 / 1024:.1f} "
+            f"de {cache_medios.max_bytes / 1024 / 1024:.0f} MB • Aciertos: {estadisticas_medios['aciertos']} • "
+            f"Descargas: {estadisticas_medios['descargas']} • Errores: {estadisticas_medios['errores']}"
+        )
+    
+    st.markdown("---")
+    
+    st.fragment(panel_metricas, run_every=intervalo_refresco(intervalo_metricas))()
+    
+    if auto_refresh:
+        st.caption(f"🔄 Chat cada {refresh_interval}s • contactos cada {intervalo_contactos}s • métricas cada {intervalo_metricas}s")
+
+# Layout principal
+col1, col2 = st.columns([1, 2])
+
+with col1:
+    st.fragment(panel_busqueda)()
+    st.fragment(panel_contactos, run_every=intervalo_refresco(intervalo_contactos))()
+
+with col2:
+    st.fragment(panel_chat, run_every=intervalo_refresco(refresh_interval))()
+
+# *** TODAS LAS SUCURSALES ***
+# Con varias bases en PAPANATAS_SUCURSALES, las mismas consultas corren contra
+# todas en paralelo; una sucursal lenta o bloqueada no frena a las demás.
+
+def preparar_sucursal(conn):
+    """Índices, contact_summary y contadores en la base de una sucursal"""
+    crear_indices(conn)
+    return resumen_contactos.instalar(conn), contadores_bd.instalar(conn)
+
+@st.cache_resource
+def init_consultor_sucursales():
+    """Consultor compartido por las sesiones; None con menos de dos sucursales"""
+    if len(SUCURSALES) < 2:
+        return None, {}
+    consultor = sucursales_bd.ConsultorSucursales(
+        SUCURSALES, timeout=float(os.environ.get('PAPANATAS_SUCURSALES_TIMEOUT', '2'))
+    )
+    return consultor, consultor.preparar(preparar_sucursal)
+
+consultor_sucursales, preparacion_sucursales = init_consultor_sucursales()
+
+@metricas.instrumentar('get_resumen_sucursales', cache=st.cache_data(ttl=2, max_entries=20))
+def get_resumen_sucursales(nombres, nombre='', con_comprobante=False):
+    """Resumen de cada sucursal de `nombres`: ({sucursal: resumen}, {sucursal: error})"""
+    return consultor_sucursales.consultar(
+        lambda conn: sucursales_bd.resumen_sucursal(conn, nombre, con_comprobante, CONTACTOS_POR_PAGINA),
+        clave=('resumen', nombre, con_comprobante), nombres=list(nombres), consistente=True
+    )
+
+@metricas.instrumentar('get_mensajes_sucursal', cache=st.cache_data(ttl=2, max_entries=20))
+def get_mensajes_sucursal(sucursal, numero_telefono):
+    """Últimos mensajes de un contacto en la base de su sucursal"""
+    resultados, errores = consultor_sucursales.consultar(
+        lambda conn: consultas_bd.pagina_mensajes(conn, numero_telefono, limite=MENSAJES_POR_PAGINA)[0],
+        clave=('mensajes', numero_telefono), nombres=[sucursal]
+    )
+    if sucursal in errores:
+        raise RuntimeError(errores[sucursal])
+    return resultados[sucursal]
+
+def estado_preparacion_sucursal(nombre):
+    """'ok', 'preparando…' o el error de la preparación de la base"""
+    futuro = preparacion_sucursales.get(nombre)
+    if futuro is None or not futuro.done():
+        return 'preparando…'
+    return 'ok' if futuro.exception() is None else f"error: {futuro.exception()}"
+
+def reintentar_preparacion_sucursales():
+    """Vuelve a preparar las bases cuya preparación falló (ej. estaban bloqueadas)"""
+    fallidas = [nombre for nombre, futuro in preparacion_sucursales.items()
+                if futuro.done() and futuro.exception() is not None]
+    if fallidas:
+        preparacion_sucursales.update(consultor_sucursales.preparar(preparar_sucursal, fallidas))
+
+def tabla_sucursales(resultados, errores):
+    """Una fila por sucursal con las cifras del día y el estado de su consulta"""
+    estado = consultor_sucursales.estado()
+    filas = []
+    for nombre in consultor_sucursales.nombres:
+        fila = {'sucursal': nombre}
+        if nombre in resultados:
+            resumen = resultados[nombre]
+            fila.update(resumen['estadisticas'].iloc[0].to_dict())
+            fila.update(resumen['pedidos_hoy'].iloc[0].to_dict())
+            fila['estado'] = f"✅ {estado[nombre].segundos * 1000:.0f} ms"
+        elif nombre in errores:
+            preparacion = estado_preparacion_sucursal(nombre)
+            fila['estado'] = f"⚠️ {errores[nombre]}" if preparacion == 'ok' else f"⚠️ {preparacion}"
+        else:
+            continue
+        filas.append(fila)
+    tabla = pd.DataFrame(filas)
+    # Enteros aunque alguna sucursal no tenga cifras
+    for columna in ('conversaciones_hoy', 'mensajes_hoy', 'pedidos_hoy', 'comprobantes_recibidos', 'esperando_pago'):
+        if columna in tabla.columns:
+            tabla[columna] = tabla[columna].astype('Int64')
+    return tabla
+
+@metricas.medir_seccion('sucursales')
+def panel_sucursales():
+    """Estadísticas, contactos y comprobantes de todas las sucursales en una vista"""
+    st.subheader("🏪 Todas las sucursales")
+    col_sucursales, col_nombre, col_comprobante = st.columns([2, 2, 1])
+    with col_sucursales:
+        nombres = st.multiselect(
+            "Sucursales", consultor_sucursales.nombres, default=consultor_sucursales.nombres,
+            key="filtro_sucursales"
+        )
+    with col_nombre:
+        filtro_nombre = st.text_input("🔎 Nombre", key="filtro_nombre_sucursales")
+    with col_comprobante:
+        filtro_comprobante = st.checkbox("📸 Con comprobante", key="filtro_comprobante_sucursales")
+    if not nombres:
+        st.info("Elegí al menos una sucursal")
+        return
+
+    reintentar_preparacion_sucursales()
+    resultados, errores = get_resumen_sucursales(tuple(nombres), filtro_nombre.strip(), filtro_comprobante)
+    resumen_df = tabla_sucursales(resultados, errores)
+
+    if resultados:
+        col_conversaciones, col_mensajes, col_pedidos, col_ventas = st.columns(4)
+        col_conversaciones.metric("💬 Conversaciones", int(resumen_df['conversaciones_hoy'].sum()))
+        col_mensajes.metric("📨 Mensajes", int(resumen_df['mensajes_hoy'].sum()))
+        col_pedidos.metric("🛒 Pedidos", int(resumen_df['pedidos_hoy'].sum()))
+        col_ventas.metric("💰 Ventas", f"${resumen_df['ventas_hoy'].sum():,.0f}")
+    st.dataframe(resumen_df, hide_index=True, width='stretch')
+    if errores:
+        st.caption("Las sucursales sin respuesta se muestran apenas terminen su consulta")
+
+    contactos_df = sucursales_bd.combinar(
+        {nombre: resumen['contactos'] for nombre, resumen in resultados.items()}, orden='ultima_actividad'
+    ).head(CONTACTOS_POR_PAGINA)
+    col_contactos, col_comprobantes = st.columns([2, 1])
+    with col_contactos:
+        total = sum(resumen['total_contactos'] for resumen in resultados.values())
+        st.markdown(f"**👥 Conversaciones** ({total} en total, las {len(contactos_df)} más recientes)")
+        if len(contactos_df) == 0:
+            st.info("📭 No hay conversaciones con esos filtros")
+            seleccion = []
+        else:
+            vista = pd.DataFrame({
+                'sucursal': contactos_df['sucursal'],
+                'cliente': contactos_df['nombre_cliente'].fillna("Cliente Anónimo"),
+                'teléfono': enmascarar_telefonos(contactos_df['numero_telefono']),
+                'mensajes': contactos_df['total_mensajes'],
+                'última actividad': formatear_momentos(contactos_df['ultima_actividad']),
+                'estado': contactos_df['estado'].astype(object).fillna(consultas_bd.SIN_PEDIDO),
+            })
+            evento = st.dataframe(
+                vista, hide_index=True, width='stretch', height=300,
+                on_select='rerun', selection_mode='single-row', key="contactos_sucursales"
+            )
+            seleccion = evento.selection.rows
+    with col_comprobantes:
+        comprobantes_df = sucursales_bd.combinar(
+            {nombre: resumen['comprobantes'] for nombre, resumen in resultados.items()}, orden='timestamp'
+        ).head(10)
+        st.markdown("**📸 Comprobantes recientes**")
+        if len(comprobantes_df) == 0:
+            st.info("No hay comprobantes recientes")
+        horas = formatear_momentos(comprobantes_df['timestamp']) if len(comprobantes_df) else []
+        for row, hora in zip(comprobantes_df.itertuples(index=False), horas):
+            cliente = row.nombre_cliente if row.nombre_cliente else "Cliente Anónimo"
+            st.caption(f"🏪 {row.sucursal} • **{cliente}** • ${row.total:,.0f} • "
+                       f"{hora} • [Ver]({row.comprobante_url})")
+
+    if seleccion:
+        contacto = contactos_df.iloc[seleccion[0]]
+        st.markdown(f"**💬 {contacto['nombre_cliente'] or 'Cliente Anónimo'}** • 🏪 {contacto['sucursal']}")
+        try:
+            mensajes_df = get_mensajes_sucursal(contacto['sucursal'], contacto['numero_telefono'])
+            st.markdown(render_mensajes_html(mensajes_df), unsafe_allow_html=True)
+        except Exception as e:
+            st.error(f"Error cargando mensajes de {contacto['sucursal']}: {e}")
+
+if consultor_sucursales is not None:
+    st.markdown("---")
+    if st.toggle(f"🏪 Ver las {len(SUCURSALES)} sucursales", value=False, key="ver_sucursales"):
+        st.fragment(panel_sucursales, run_every=intervalo_refresco(intervalo_contactos))()
+
+# *** ANÁLISIS DE VENTAS ***
+# Los gráficos leen las tablas de rollup (cientos de filas aunque el rango sea de meses)
+
+RANGOS_ANALISIS = {"Hoy": 1, "7 días": 7, "30 días": 30, "90 días": 90}
+
+NOMBRES_AGREGADO = {
+    '': 'Sin agregado',
+    'premium': 'Premium (cheddar)',
+    'extra_premium': 'Extra Premium (carne)',
+    'premium,extra_premium': 'Premium + Extra Premium',
+}
+
+@st.cache_resource
+def cargar_plotly():
+    """plotly.express, importado recién al dibujar el primer gráfico (None si no está instalado)"""
+    try:
+        import plotly.express as px
+    except ImportError:
+        return None
+    return px
+
+def grafico(df, x, y, tipo='bar', titulo=None):
+    """Dibuja un gráfico con Plotly, o con los gráficos nativos si Plotly no está instalado"""
+    px = cargar_plotly()
+    if px is None:
+        if titulo:
+            st.caption(titulo)
+        st.bar_chart(df.set_index(x)[y])
+        return
+    if tipo == 'pie':
+        fig = px.pie(df, names=x, values=y, title=titulo, hole=0.4)
+    elif tipo == 'line':
+        fig = px.line(df, x=x, y=y, title=titulo, markers=True)
+    else:
+        fig = px.bar(df, x=x, y=y, title=titulo)
+    fig.update_layout(height=300, margin=dict(l=10, r=10, t=40, b=10))
+    st.plotly_chart(fig, width='stretch')
+
+def format_duracion(segundos):
+    """Tope de una cubeta de duración del embudo ('≤ 2 min'); sin tope es más de un día"""
+    if pd.isna(segundos):
+        return "-"
+    if segundos == float('inf'):
+        return f"> {embudo_bd.CUBETAS[-1] // 3600} h"
+    if segundos < 60:
+        return f"≤ {segundos:.0f} s"
+    if segundos < 3600:
+        return f"≤ {segundos / 60:.0f} min"
+    return f"≤ {segundos / 3600:.0f} h"
+
+def tabla_embudo(embudo_df):
+    """Tabla compacta del embudo para mostrar"""
+    return pd.DataFrame({
+        'Paso': embudo_df['step'].map(DESCRIPCIONES_PASO).fillna(embudo_df['step']),
+        'Llegaron': embudo_df['llegaron'],
+        'Conversión': embudo_df['conversion'].map(lambda valor: "-" if pd.isna(valor) else f"{valor:.0%}"),
+        'Abandonos': embudo_df['abandonos'],
+        'En curso': embudo_df['en_curso'],
+        'Tiempo mediano': embudo_df['p50_s'].map(format_duracion),
+        'p90': embudo_df['p90_s'].map(format_duracion),
+    })
+
+def ventas_por_hora_del_dia(horario_df):
+    """Suma de pedidos e ingresos por hora del día (0-23) sobre el rango"""
+    horas = pd.to_datetime(horario_df['periodo']).dt.hour
+    return (
+        horario_df[['pedidos', 'ingresos']]
+        .groupby(horas.rename('hora')).sum()
+        .reindex(range(24), fill_value=0)
+        .reset_index()
+    )
+
+@metricas.medir_seccion('analisis')
+def panel_analisis():
+    """Timeline de ventas, ventas por hora y distribución de productos desde los rollups"""
+    actualizar_rollups()
+    st.subheader("📈 Análisis de ventas")
+    rango = st.radio("Periodo", list(RANGOS_ANALISIS), horizontal=True, key="rango_analisis")
+    dias = RANGOS_ANALISIS[rango]
+    hoy = datetime.now().date()
+    desde = (hoy - timedelta(days=dias - 1)).strftime('%Y-%m-%d')
+    hasta = (hoy + timedelta(days=1)).strftime('%Y-%m-%d')
+    granularidad = 'hora' if dias == 1 else 'dia'
+
+    version = get_version_datos()
+    horario_df = get_rollup_actividad('hora', desde, hasta, version)
+    actividad_df = horario_df if granularidad == 'hora' else get_rollup_actividad('dia', desde, hasta, version)
+    productos_df = get_rollup_productos(granularidad, desde, hasta, version)
+
+    if len(actividad_df) == 0:
+        st.info("📭 No hay actividad en el periodo seleccionado")
+        return
+
+    pedidos_total = int(actividad_df['pedidos'].sum())
+    ingresos_total = int(actividad_df['ingresos'].sum())
+    col_pedidos, col_ventas, col_ticket, col_mensajes = st.columns(4)
+    col_pedidos.metric("🛒 Pedidos", f"{pedidos_total:,}")
+    col_ventas.metric("💰 Ventas", f"${ingresos_total:,.0f}")
+    col_ticket.metric("🧾 Ticket promedio", f"${ingresos_total / pedidos_total:,.0f}" if pedidos_total else "-")
+    col_mensajes.metric("💬 Mensajes", f"{int(actividad_df['mensajes'].sum()):,}")
+
+    actualizar_embudo()
+    embudo_df = get_embudo(desde, hasta, get_version_datos())
+    if len(embudo_df) > 0 and embudo_df['llegaron'].iloc[0] > 0:
+        st.markdown("**🔻 Embudo de conversación**")
+        st.dataframe(tabla_embudo(embudo_df), hide_index=True, width='stretch')
+        st.caption(f"Recorridos iniciados en el periodo; sin actividad por más de "
+                   f"{int(embudo_bd.ABANDONO.total_seconds()) // 3600} h cuentan como abandono")
+
+    # Los gráficos (Plotly o Altair) son lo más caro de importar y de armar en cada rerun
+    if not st.toggle("Mostrar gráficos", value=False, key="graficos_analisis"):
+        return
+
+    col_timeline, col_horas = st.columns(2)
+    with col_timeline:
+        grafico(actividad_df, 'periodo', 'ingresos', tipo='line', titulo="Timeline de ventas")
+    with col_horas:
+        grafico(ventas_por_hora_del_dia(horario_df), 'hora', 'pedidos', titulo="Ventas por hora del día")
+
+    col_tamanos, col_agregados = st.columns(2)
+    with col_tamanos:
+        tamanos_df = productos_df[productos_df['dimension'] == 'tamaño']
+        grafico(tamanos_df, 'valor', 'pedidos', tipo='pie', titulo="Distribución por tamaños")
+    with col_agregados:
+        agregados_df = productos_df[productos_df['dimension'] == 'agregado'].assign(
+            valor=lambda df: df['valor'].map(NOMBRES_AGREGADO).fillna(df['valor'])
+        )
+        grafico(agregados_df, 'valor', 'pedidos', titulo="Agregados más populares")
+
+    bebidas_df = productos_df[productos_df['dimension'] == 'bebida'].set_index('valor')['pedidos']
+    if bebidas_df.sum() > 0:
+        st.caption(f"🥤 {bebidas_df.get('1', 0) / bebidas_df.sum():.0%} de los pedidos incluye bebida")
+
+st.markdown("---")
+st.fragment(panel_analisis, run_every=intervalo_refresco(intervalo_metricas))()
+
 # Footer con información del sistema
+inicio_footer = time.perf_counter()
 st.markdown("---")
 col1, col2, col3, col4 = st.columns(4)
 
+snapshot = servicio_snapshot.actual()
+
 with col1:
     st.markdown("🟢 **Sistema Activo**")
-    st.caption(f"Actualizado: {datetime.now().strftime('%H:%M:%S')}")
+    st.caption(f"Página actualizada: {datetime.now().strftime('%H:%M:%S')}")
+    st.caption(f"Datos cambiados: {format_cambio(snapshot.cambiado)}")
 
 with col2:
-    try:
-        cursor = conn.cursor()
-        cursor.execute("SELECT COUNT(*) FROM conversaciones")
-        total_mensajes = cursor.fetchone()[0]
-        st.markdown(f"💬 **{total_mensajes} mensajes**")
+    if snapshot.error is None:
+        st.markdown(f"💬 **{snapshot.total_mensajes} mensajes**")
         st.caption("Total en base de datos")
-    except:
+    else:
         st.markdown("❌ **Error BD**")
 
 with col3:
-    if estructura_bd['tiene_comprobante_recibido']:
-        try:
-            cursor = conn.cursor()
-            cursor.execute("SELECT COUNT(*) FROM pedidos WHERE comprobante_recibido = 1")
-            total_comprobantes = cursor.fetchone()[0]
-            st.markdown(f"📸 **{total_comprobantes} comprobantes**")
-            st.caption("Recibidos correctamente")
-        except:
-            st.markdown("❌ **Error comprobantes**")
+    if snapshot.total_comprobantes is not None:
+        st.markdown(f"📸 **{snapshot.total_comprobantes} comprobantes**")
+        st.caption("Recibidos correctamente")
     else:
         st.markdown("📸 **Comprobantes**")
         st.caption("No disponible")
 
 with col4:
     st.markdown("🍟 **Papanatas SPA**")
-    st.caption("Dashboard WhatsApp v2.1")
\ No newline at end of file
+    st.caption("Dashboard WhatsApp v2.1")
+
+metricas.observar_seccion('footer', time.perf_counter() - inicio_footer)
+metricas.observar_seccion('pagina', time.perf_counter() - inicio_pagina)
+
+# *** PANEL DE RENDIMIENTO ***
+
+def histograma_duraciones(duraciones):
+    """Cuenta de duraciones por bucket (etiquetas en ms, en orden creciente)"""
+    limites_ms = [limite * 1000 for limite in BUCKETS]
+    etiquetas = [f"≤{limite:g} ms" for limite in limites_ms] + [f">{limites_ms[-1]:g} ms"]
+    cubetas = pd.cut(
+        pd.Series(duraciones, dtype=float) * 1000,
+        bins=[0] + limites_ms + [float('inf')],
+        labels=etiquetas,
+        include_lowest=True
+    )
+    return cubetas.value_counts(sort=False).rename_axis('duracion').reset_index(name='llamadas')
+
+def panel_rendimiento():
+    """Tiempos recientes de funciones de datos y secciones, con histograma por métrica"""
+    import altair as alt
+
+    resumen_df = pd.DataFrame(metricas.resumen())
+    if resumen_df.empty:
+        st.info("Todavía no hay mediciones")
+        return
+
+    secciones_df = resumen_df[resumen_df['tipo'] == 'seccion']
+    st.write("**Secciones (ms):**")
+    st.dataframe(
+        secciones_df[['nombre', 'llamadas', 'p50_ms', 'p95_ms']].round(1),
+        hide_index=True, width='stretch'
+    )
+    funciones_df = resumen_df[resumen_df['tipo'] == 'funcion'].sort_values('p95_ms', ascending=False)
+    st.write("**Funciones de datos (ms):**")
+    st.dataframe(
+        funciones_df[['nombre', 'llamadas', 'p50_ms', 'p95_ms', 'filas', 'aciertos_cache']].round(2),
+        hide_index=True, width='stretch',
+        column_config={'aciertos_cache': st.column_config.ProgressColumn(
+            "Caché", min_value=0, max_value=1, format="percent"
+        )}
+    )
+
+    nombre = st.selectbox("Histograma", resumen_df['nombre'].tolist(), key="metrica_histograma")
+    duraciones = metricas.recientes(nombre)
+    st.altair_chart(
+        alt.Chart(histograma_duraciones(duraciones)).mark_bar().encode(
+            x=alt.X('duracion:N', sort=None, title=None),
+            y=alt.Y('llamadas:Q', title=None)
+        ).properties(height=160),
+        width='stretch'
+    )
+    st.caption(f"Últimas {len(duraciones)} mediciones de {nombre}")
+
+def contar_exportacion(tabla, desde, hasta, estados):
+    with pool.conexion() as conn:
+        return consultas_bd.contar_exportacion(conn, tabla, desde, hasta, estados)
+
+def generar_exportacion(tabla, formato, desde, hasta, estados):
+    """Archivo completo para st.download_button (sin servidor de exportación, hasta MAX_FILAS_DESCARGA filas)"""
+    with pool.conexion() as conn:
+        if formato == 'parquet':
+            salida = io.BytesIO()
+            exportar_bd.escribir_parquet(conn, salida, tabla, desde, hasta, estados)
+            return salida.getvalue()
+        return b''.join(exportar_bd.trozos_csv(conn, tabla, desde, hasta, estados))
+
+@metricas.medir_seccion('exportar')
+def panel_exportar():
+    """Descarga de pedidos o conversaciones filtrados por fecha y estado"""
+    tabla = st.selectbox("Tabla", exportar_bd.TABLAS, key="exportar_tabla")
+    formato = st.radio("Formato", exportar_bd.FORMATOS, horizontal=True, key="exportar_formato")
+    hoy = datetime.now().date()
+    rango = st.date_input("Fechas", value=(hoy - timedelta(days=30), hoy), key="exportar_fechas")
+    if len(rango) != 2:
+        st.info("Elegí la fecha final")
+        return
+    desde, hasta = rango
+    estados = []
+    if tabla == 'pedidos':
+        estados = st.multiselect("Estados", get_estados_pedido(get_version_datos()), key="exportar_estados",
+                                 placeholder="Todos")
+    nombre = exportar_bd.nombre_archivo(tabla, formato, desde, hasta)
+
+    if url_exportacion:
+        parametros = urlencode(
+            [('tabla', tabla), ('formato', formato), ('desde', desde), ('hasta', hasta)]
+            + [('estado', estado) for estado in estados]
+        )
+        st.link_button(f"⬇️ {nombre}", f"{url_exportacion}/exportar?{parametros}")
+        return
+    filas = contar_exportacion(tabla, desde, hasta, estados)
+    if filas > MAX_FILAS_DESCARGA:
+        st.warning(f"{filas:,} filas es demasiado para armar la descarga en memoria (máximo "
+                   f"{MAX_FILAS_DESCARGA:,}). Acortá el rango, activá el servidor de exportación "
+                   f"(PAPANATAS_EXPORTAR_PUERTO) o usá `python exportar_bd.py {tabla}`.")
+        return
+    st.download_button(
+        f"⬇️ {nombre}",
+        data=lambda: generar_exportacion(tabla, formato, desde, hasta, estados),
+        file_name=nombre, mime=exportar_bd.TIPOS_MIME[formato], on_click='ignore'
+    )
+    st.caption(f"{filas:,} filas. Sin servidor de exportación el archivo se arma en memoria")
+
+with st.sidebar:
+    st.markdown("---")
+    if st.checkbox("📤 Exportar", value=False, help="Pedidos o conversaciones en CSV o Parquet"):
+        panel_exportar()
+    if st.checkbox("⏱️ Rendimiento", value=False, help="Tiempos de consultas, caché y render de esta instancia"):
+        panel_rendimiento()
@@ -0,0 +1,210 @@
+"""Varias sucursales en un mismo dashboard: una base del bot por sucursal
+
+Cada sucursal corre su propio bot con su `papanatas_chat.db`. El dashboard
+recibe la lista en PAPANATAS_SUCURSALES y `ConsultorSucursales` ejecuta la
+misma función de consultas_bd contra todas las bases a la vez, en un pool de
+hilos, con un pool de conexiones de solo lectura por sucursal.
+
+Cada consulta espera como máximo `timeout` segundos: una base lenta o
+bloqueada queda marcada como "sin respuesta" y el resto se muestra igual. Su
+consulta sigue en segundo plano y, mientras no termine, los pedidos siguientes
+la reutilizan en vez de acumular hilos esperando el mismo archivo.
+
+    PAPANATAS_SUCURSALES="Centro=/datos/centro.db;Norte=/datos/norte.db" streamlit run streamlit_dashboard.py
+"""
+
+import os
+import re
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor, wait
+from dataclasses import dataclass
+from typing import Optional
+
+import pandas as pd
+
+import consultas_bd
+from pool_bd import PoolConexiones
+
+COLUMNA_SUCURSAL = 'sucursal'
+
+
+@dataclass(frozen=True)
+class Sucursal:
+    nombre: str
+    ruta: str
+
+
+@dataclass(frozen=True)
+class EstadoSucursal:
+    """Resultado de la última consulta a una sucursal"""
+    segundos: Optional[float] = None
+    error: Optional[str] = None
+    hora: float = 0.0
+
+
+def leer_configuracion(texto):
+    """Sucursales a partir de 'Centro=/datos/centro.db;Norte=/datos/norte.db'
+
+    Se separan con ';' o saltos de línea. Sin nombre ('/datos/norte.db') se usa
+    el nombre del archivo sin extensión.
+    """
+    sucursales = []
+    for parte in re.split(r'[;\n]', texto or ''):
+        parte = parte.strip()
+        if not parte:
+            continue
+        nombre, separador, ruta = parte.partition('=')
+        if not separador:
+            nombre, ruta = os.path.splitext(os.path.basename(parte))[0], parte
+        sucursales.append(Sucursal(nombre.strip(), os.path.expanduser(ruta.strip())))
+    nombres = [sucursal.nombre for sucursal in sucursales]
+    repetidos = {nombre for nombre in nombres if nombres.count(nombre) > 1}
+    if repetidos:
+        raise ValueError(f"Sucursales repetidas: {', '.join(sorted(repetidos))}")
+    return sucursales
+
+
+def combinar(resultados, orden=None, descendente=True):
+    """Une los DataFrames de cada sucursal agregando la columna `sucursal` al principio"""
+    partes = []
+    for nombre, df in resultados.items():
+        if df is None or len(df) == 0:
+            continue
+        df = df.copy()
+        df.insert(0, COLUMNA_SUCURSAL, nombre)
+        partes.append(df)
+    if not partes:
+        return pd.DataFrame()
+    combinado = pd.concat(partes, ignore_index=True)
+    if orden is not None and orden in combinado.columns:
+        combinado = combinado.sort_values(orden, ascending=not descendente, kind='stable', ignore_index=True)
+    return combinado
+
+
+def resumen_sucursal(conn, nombre='', con_comprobante=False, limite_contactos=50, limite_comprobantes=10):
+    """Estadísticas del día, contactos más recientes y comprobantes de una base
+
+    Pensada para `leer_consistente`: las tres partes ven la misma versión.
+    """
+    estructura = consultas_bd.estructura_bd(conn)
+    stats, pedidos = consultas_bd.estadisticas_generales(conn, estructura['tiene_comprobante_recibido'])
+    contactos, total_contactos = consultas_bd.pagina_contactos(
+        conn, nombre=nombre, con_comprobante=con_comprobante, por_pagina=limite_contactos
+    )
+    comprobantes = (
+        consultas_bd.comprobantes_recientes(conn, limite_comprobantes)
+        if estructura['tiene_comprobante_url'] else None
+    )
+    return {
+        'estadisticas': stats,
+        'pedidos_hoy': pedidos,
+        'contactos': contactos,
+        'total_contactos': total_contactos,
+        'comprobantes': comprobantes,
+    }
+
+
+class ConsultorSucursales:
+    """Ejecuta funciones de consulta sobre todas las sucursales en paralelo"""
+
+    def __init__(self, sucursales, timeout=2.0, max_conexiones=2, hilos=None):
+        self.sucursales = list(sucursales)
+        self.timeout = timeout
+        self._pools = {
+            sucursal.nombre: PoolConexiones(sucursal.ruta, max_conexiones=max_conexiones)
+            for sucursal in self.sucursales
+        }
+        self._ejecutor = ThreadPoolExecutor(
+            max_workers=hilos or 2 * len(self.sucursales), thread_name_prefix='sucursal'
+        )
+        self._lock = threading.Lock()
+        self._en_curso = {}
+        self._estado = {sucursal.nombre: EstadoSucursal() for sucursal in self.sucursales}
+
+    @property
+    def nombres(self):
+        return [sucursal.nombre for sucursal in self.sucursales]
+
+    def pool(self, nombre):
+        return self._pools[nombre]
+
+    def _ejecutar(self, nombre, funcion, consistente):
+        pool = self._pools[nombre]
+        inicio = time.perf_counter()
+        try:
+            datos = pool.leer_consistente(funcion) if consistente else pool.leer(funcion)
+        except Exception as e:
+            self._estado[nombre] = EstadoSucursal(time.perf_counter() - inicio, str(e), time.time())
+            raise
+        self._estado[nombre] = EstadoSucursal(time.perf_counter() - inicio, None, time.time())
+        return datos
+
+    def consultar(self, funcion, clave, nombres=None, consistente=False, timeout=None):
+        """Ejecuta `funcion(conn)` en cada sucursal de `nombres` (todas por defecto)
+
+        `clave` identifica la consulta (función y parámetros): si una sucursal
+        todavía está resolviendo la misma clave de un pedido anterior no se
+        lanza otra ni se la espera, queda como ocupada. Devuelve (resultados,
+        errores): {sucursal: datos} y {sucursal: mensaje} para las que fallaron
+        o no respondieron dentro de `timeout` segundos.
+        """
+        nombres = self.nombres if nombres is None else [n for n in nombres if n in self._pools]
+        futuros, nuevos, ocupadas = {}, [], set()
+        with self._lock:
+            for nombre in nombres:
+                futuro = self._en_curso.get((nombre, clave))
+                if futuro is None or futuro.done():
+                    futuro = self._ejecutor.submit(self._ejecutar, nombre, funcion, consistente)
+                    self._en_curso[(nombre, clave)] = futuro
+                    nuevos.append((nombre, futuro))
+                else:
+                    ocupadas.add(nombre)
+                futuros[nombre] = futuro
+        # Fuera del lock: si el futuro ya terminó, el callback corre en este mismo hilo
+        for nombre, futuro in nuevos:
+            futuro.add_done_callback(lambda f, llave=(nombre, clave): self._terminar(llave, f))
+        limite = self.timeout if timeout is None else timeout
+        wait([futuro for _, futuro in nuevos], timeout=limite)
+
+        resultados, errores = {}, {}
+        for nombre, futuro in futuros.items():
+            if not futuro.done():
+                errores[nombre] = (
+                    "ocupada: la consulta anterior sigue en curso" if nombre in ocupadas
+                    else f"sin respuesta en {limite:g} s"
+                )
+            elif futuro.exception() is not None:
+                errores[nombre] = str(futuro.exception())
+            else:
+                resultados[nombre] = futuro.result()
+        return resultados, errores
+
+    def _terminar(self, llave, futuro):
+        with self._lock:
+            if self._en_curso.get(llave) is futuro:
+                del self._en_curso[llave]
+
+    def estado(self):
+        """Última latencia y error de cada sucursal (incluye las consultas que terminaron tarde)"""
+        return dict(self._estado)
+
+    def preparar(self, funcion, nombres=None):
+        """Corre `funcion(conn)` con la conexión de escritura de cada sucursal, en segundo plano
+
+        Para instalar en cada base los índices y tablas que usan las consultas.
+        Devuelve los futuros por sucursal.
+        """
+        def tarea(nombre):
+            pool = self._pools[nombre]
+            # La conexión de escritura crearía un archivo vacío si la ruta está mal
+            if not os.path.exists(pool.ruta):
+                raise FileNotFoundError(f"no existe {pool.ruta}")
+            with pool.escritura() as conn:
+                return funcion(conn)
+        return {nombre: self._ejecutor.submit(tarea, nombre) for nombre in (nombres or self.nombres)}
+
+    def cerrar(self):
+        self._ejecutor.shutdown(wait=False, cancel_futures=True)
+        for pool in self._pools.values():
+            pool.cerrar()
@@ -0,0 +1,34 @@
+import sqlite3
+
+import numpy as np
+
+import embudo_bd
+import generar_datos
+
+
+def _base(tmp_path, filas):
+    ruta = str(tmp_path / 'embudo.db')
+    generar_datos.generar(ruta, filas, dias=5, semilla=3)
+    conn = sqlite3.connect(ruta)
+    embudo_bd.instalar(conn)
+    embudo_bd.actualizar(conn)
+    return conn
+
+
+def test_rango_sin_recorridos(tmp_path):
+    conn = _base(tmp_path, 500)
+    df = embudo_bd.embudo(conn, '2000-01-01', '2000-01-02')
+    assert list(df['step']) == list(embudo_bd.ETAPAS)
+    assert (df['llegaron'] == 0).all()
+    assert (df['abandonos'] == 0).all()
+    assert (df['en_curso'] == 0).all()
+    assert df['conversion'].isna().all()
+
+
+def test_rango_con_recorridos(tmp_path):
+    conn = _base(tmp_path, 500)
+    df = embudo_bd.embudo(conn, '2000-01-01', '2100-01-01')
+    llegaron = df['llegaron'].to_numpy()
+    assert llegaron[0] > 0
+    assert (np.diff(llegaron) <= 0).all()
+    assert df['conversion'].iloc[0] == 1.0
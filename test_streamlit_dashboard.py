@@ -0,0 +1,41 @@
+import os
+import sqlite3
+
+from streamlit.testing.v1 import AppTest
+
+import consultas_bd
+import generar_datos
+
+DASHBOARD = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'streamlit_dashboard.py')
+
+
+def _dashboard(tmp_path, monkeypatch):
+    ruta = str(tmp_path / 'dashboard.db')
+    generar_datos.generar(ruta, 2000, dias=5, semilla=7)
+    # Contactos que nunca llegaron a pedir
+    conn = sqlite3.connect(ruta)
+    conn.executemany(
+        "INSERT INTO conversaciones (numero_telefono, mensaje_usuario, mensaje_bot, step) "
+        "VALUES (?, 'hola', '¿Cómo te llamas?', 'esperando_nombre')",
+        [(f"whatsapp:+5690000000{i}",) for i in range(3)]
+    )
+    conn.commit()
+    conn.close()
+    monkeypatch.setenv('PAPANATAS_DB', ruta)
+    monkeypatch.setenv('PAPANATAS_MEDIOS_DIR', str(tmp_path / 'medios'))
+    # Sin red: las descargas de comprobantes fallan enseguida
+    monkeypatch.setenv('TWILIO_API_URL', 'http://127.0.0.1:9')
+    at = AppTest.from_file(DASHBOARD, default_timeout=120)
+    at.run()
+    assert not at.exception
+    return at
+
+
+def test_pagina_de_contactos_sin_totales(tmp_path, monkeypatch):
+    at = _dashboard(tmp_path, monkeypatch)
+    at.selectbox(key='filtro_estado').select(consultas_bd.SIN_PEDIDO).run()
+    assert not at.exception
+    assert not [error.value for error in at.error]
+    botones = [boton.label for boton in at.button if boton.label.startswith('👤')]
+    assert botones
+    assert not any('💰' in etiqueta for etiqueta in botones)